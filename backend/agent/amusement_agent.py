@@ -3,12 +3,11 @@ import uuid
 import logging
 import operator
 import json
+import hashlib
 from typing import TypedDict, Annotated, Literal, Optional, List
 from pydantic import Field
 
-from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage,ToolMessage,AnyMessage
-from langchain_core.output_parsers import JsonOutputParser
 from langgraph.types import Command
 from langgraph.graph.message import add_messages
 from langgraph.graph import StateGraph, START, END
@@ -16,8 +15,27 @@ from langgraph.graph import StateGraph, START, END
 from utils import get_llm
 from utils.agent_tools import retry_llm_call
 from utils.mcp_manager import get_mcp_manager
-
-from prompts import AMUSEMENT_SYSTEM_PLAN_TEMPLATE,AMUSEMENT_SYSYRM_REPLAN_TEMPLATE,AMUSEMENT_SYSTEM_JUDGE_TEMPLATE,AMUSEMENT_SUMMARY_PROMPT,AMUSEMENT_COORDINATOR_TASK_DISPATCH_TEMPLATE,AMUSEMENT_SYSTEM_PLAN_FEEDBACK_TEMPLATE,AMUSEMENT_SYSYRM_REPLAN_FEEDBACK_TEMPLATE
+from utils.token_counter import estimate_message_tokens, truncate_to_tokens, condense_message
+from utils.retrieval_index import build_session_index, build_itinerary_sections
+from utils.tool_data_storage import get_tool_storage
+from utils.prompt_cache import get_json_parser, get_chat_prompt_template
+from utils.prompt_layout import build_layered_messages, messages_to_text
+from utils.session_budget import budget_allows, get_session_budget
+from utils.itinerary_optimizer import plan_itinerary_skeleton
+from utils.budget_optimizer import solve_budget, render_budget_plan
+from utils.completion_check import structured_entity
+from config import get_context_budget
+from config.context_config import (
+    DEFAULT_CONTEXT_TOKEN_BUDGET,
+    MESSAGE_TYPE_BUDGET_RATIOS,
+    TOOL_MESSAGE_MAX_TOKENS,
+    TOOL_MESSAGE_MIN_TOKENS,
+    OTHER_MESSAGE_MAX_TOKENS,
+    SUMMARY_INPUT_MAX_TOKENS,
+    RETRIEVAL_FULL_CONTEXT_ENTITIES
+)
+
+from prompts import AMUSEMENT_SYSTEM_PLAN_TEMPLATE,AMUSEMENT_SYSYRM_REPLAN_TEMPLATE,AMUSEMENT_SYSTEM_JUDGE_TEMPLATE,AMUSEMENT_SUMMARY_PROMPT,AMUSEMENT_ROLLING_SUMMARY_PROMPT,AMUSEMENT_COORDINATOR_TASK_DISPATCH_TEMPLATE,AMUSEMENT_SYSTEM_PLAN_FEEDBACK_TEMPLATE,AMUSEMENT_SYSYRM_REPLAN_FEEDBACK_TEMPLATE,AMUSEMENT_ITINERARY_SKELETON_PROMPT,AMUSEMENT_BUDGET_PLAN_PROMPT
 from formatters import ReplanFormat,PlanFormat
 from formatters.amusement_format import AmusementFormat, PlanWithIntervention, ReplanWithIntervention, InterventionResponse
 
@@ -56,6 +74,10 @@ class AmusementState(TypedDict):
     is_feedback_mode: Annotated[bool, Field(description="是否处于反馈调整模式", default=False)]
     user_feedback: Annotated[str, Field(description="用户的反馈建议", default="")]
     original_amusement_info: Annotated[AmusementFormat, Field(description="原始完整旅游计划（反馈模式）", default=None)]
+    # 滚动历史总结（content + 已覆盖的消息ID范围），跨plan/replan轮次复用
+    conversation_summary: Annotated[dict, Field(description="滚动历史总结，包含总结内容和已覆盖的消息ID范围", default=None)]
+    # LLM用量统计（由API层在执行graph前后维护，见 utils/llm_usage.py）
+    llm_usage: Annotated[dict, Field(description="会话的LLM调用用量统计（总计/按节点/按子Agent）", default=None)]
 
 async def get_local_llm(node):
     global _llm_cache
@@ -64,30 +86,46 @@ async def get_local_llm(node):
         _llm_cache[node] = get_llm(node)
     return _llm_cache[node]
 
-async def compress_messages(messages: list[BaseMessage], max_messages: int = 15) -> list[BaseMessage]:
+async def compress_messages(
+    messages: list[BaseMessage],
+    max_tokens: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+    summary: Optional[dict] = None
+) -> tuple[list[BaseMessage], Optional[dict]]:
     """
-    智能压缩消息历史，避免上下文过长导致重要信息丢失
+    按token预算压缩消息历史，保证传给LLM的上下文大小有上限且可预测
 
-    策略：
-    1. 保留所有ToolMessage（工具调用结果很重要，不能丢失）
-    2. 保留最近的N条其他消息（HumanMessage、AIMessage等）
-    3. 如果超过阈值，使用LLM总结早期的非工具消息
+    策略（token数均为本地估算）：
+    1. 单条超长的工具结果先压缩到 TOOL_MESSAGE_MAX_TOKENS 以内（保留开头和结尾）
+    2. 总量未超过预算时直接返回
+    3. 超过预算时按消息类型分配预算（见 MESSAGE_TYPE_BUDGET_RATIOS）：
+       - ToolMessage：在工具预算内平均分配，预算不足时丢弃最旧的工具结果
+       - 其他消息：从最新往前保留，放不下的旧消息合并进滚动总结
+    4. 滚动总结保存在graph state中，按消息ID记录已覆盖的范围，
+       每轮只把新移出窗口的消息合并进已有总结，不再重复总结整段历史
 
     Args:
         messages: 原始消息列表
-        max_messages: 保留的最大消息数（不包括工具消息和总结）
+        max_tokens: 消息历史的token预算
+        summary: 上一轮的滚动总结（state["conversation_summary"]）
 
     Returns:
-        压缩后的消息列表
+        (压缩后的消息列表, 更新后的滚动总结)
     """
     if not messages:
-        return []
+        return [], summary
 
-    if len(messages) <= max_messages:
-        logger.debug(f"消息数量({len(messages)})未超过阈值({max_messages})，无需压缩")
-        return messages
+    # 第一步：压缩单条超长消息（工具结果通常是12306、酒店等的大段原始数据）
+    messages = [
+        condense_message(msg, TOOL_MESSAGE_MAX_TOKENS if isinstance(msg, ToolMessage) else OTHER_MESSAGE_MAX_TOKENS)
+        for msg in messages
+    ]
+    total_tokens = sum(estimate_message_tokens(msg) for msg in messages)
+
+    if total_tokens <= max_tokens:
+        logger.debug(f"消息token数({total_tokens})未超过预算({max_tokens})，无需压缩")
+        return messages, summary
 
-    logger.info(f"开始压缩消息历史：原始消息数={len(messages)}，阈值={max_messages}")
+    logger.info(f"开始压缩消息历史：原始消息数={len(messages)}，估算token={total_tokens}，预算={max_tokens}")
 
     # 分类消息：工具消息 vs 其他消息
     tool_messages = []
@@ -101,60 +139,286 @@ async def compress_messages(messages: list[BaseMessage], max_messages: int = 15)
 
     logger.debug(f"消息分类：ToolMessage={len(tool_messages)}，其他消息={len(other_messages)}")
 
-    # 如果其他消息不多，直接返回所有消息
-    if len(other_messages) <= max_messages:
-        logger.debug("其他消息数量未超过阈值，保留所有消息")
-        return messages
-
-    # 保留最近的消息
-    recent_count = max(5, max_messages // 2)  # 至少保留5条最近消息
-    recent_other = other_messages[-recent_count:]
-    old_other = other_messages[:-recent_count]
+    # 按消息类型分配预算，工具预算未用完的部分让给其他消息，反之亦然
+    tool_budget = int(max_tokens * MESSAGE_TYPE_BUDGET_RATIOS["tool"])
+    summary_budget = int(max_tokens * MESSAGE_TYPE_BUDGET_RATIOS["summary"])
+    other_budget = max_tokens - tool_budget - summary_budget
+
+    tool_tokens = sum(estimate_message_tokens(msg) for msg in tool_messages)
+    other_tokens = sum(estimate_message_tokens(msg) for msg in other_messages)
+    if tool_tokens < tool_budget:
+        other_budget += tool_budget - tool_tokens
+        tool_budget = tool_tokens
+    elif other_tokens < other_budget:
+        tool_budget += other_budget - other_tokens
+        other_budget = other_tokens
+
+    kept_tools = _fit_tool_messages(tool_messages, tool_budget)
+
+    # 从最新往前保留其他消息，直到用完预算
+    recent_other = []
+    used = 0
+    for msg in reversed(other_messages):
+        msg_tokens = estimate_message_tokens(msg)
+        if used + msg_tokens > other_budget:
+            break
+        recent_other.insert(0, msg)
+        used += msg_tokens
+    old_other = other_messages[:len(other_messages) - len(recent_other)]
+
+    if not old_other:
+        compressed = kept_tools + recent_other
+        logger.info(f"✅ 消息压缩完成：{len(messages)} → {len(compressed)} (工具{len(kept_tools)}条 + 最近{len(recent_other)}条)")
+        return compressed, summary
 
     logger.info(f"将总结{len(old_other)}条旧消息，保留{len(recent_other)}条最近消息")
 
-    # 使用LLM总结旧消息
+    # 只有新移出窗口的消息才需要合并进滚动总结，已总结过的消息直接复用
+    summary = summary or {}
+    covered_keys = set(summary.get("message_keys", []))
+    new_aged = [msg for msg in old_other if _message_key(msg) not in covered_keys]
+    # 只记录仍在消息列表中的已总结消息，已经不在列表中的key不会再被比较，不再保留
+    aged_keys = [_message_key(msg) for msg in old_other]
+
+    if summary.get("content") and not new_aged:
+        logger.info(f"✅ 复用滚动总结（覆盖{len(covered_keys)}条消息，范围 {summary.get('first_id')} ~ {summary.get('last_id')}），无需调用LLM")
+        summary = {**summary, "message_keys": aged_keys}
+        summary_msg = SystemMessage(content=f"【历史对话总结】\n{summary['content']}")
+        compressed = [summary_msg] + kept_tools + recent_other
+        logger.info(f"✅ 消息压缩完成：{len(messages)} → {len(compressed)} (总结1条 + 工具{len(kept_tools)}条 + 最近{len(recent_other)}条)")
+        return compressed, summary
+
+    # 会话预算不足时不再调用LLM更新总结，沿用已有总结
+    if not budget_allows("历史对话总结"):
+        if summary.get("content"):
+            summary_msg = SystemMessage(content=f"【历史对话总结】\n{summary['content']}")
+            return [summary_msg] + kept_tools + recent_other, summary
+        return kept_tools + recent_other, summary
+
+    # 使用LLM将新移出窗口的消息合并进总结
     try:
         llm = await get_local_llm("plan")
 
-        # 构建总结prompt
-        old_messages_text = "\n\n".join([
-            f"[{type(msg).__name__}] {msg.content[:500]}" for msg in old_other
+        # 构建总结prompt（旧消息本身也受token上限约束）
+        new_messages_text = "\n\n".join([
+            f"[{type(msg).__name__}] {msg.content[:500]}" for msg in new_aged
         ])
-        prompt = AMUSEMENT_SUMMARY_PROMPT.format(old_messages=old_messages_text)
+        new_messages_text = truncate_to_tokens(new_messages_text, SUMMARY_INPUT_MAX_TOKENS, head_ratio=0.3)
+        if summary.get("content"):
+            logger.info(f"增量更新滚动总结：已覆盖{len(covered_keys)}条，新增{len(new_aged)}条")
+            prompt = AMUSEMENT_ROLLING_SUMMARY_PROMPT.format(
+                previous_summary=summary["content"],
+                new_messages_text=new_messages_text
+            )
+        else:
+            prompt = AMUSEMENT_SUMMARY_PROMPT.format(old_messages_text=new_messages_text)
 
         logger.debug(f"调用LLM总结消息，prompt长度={len(prompt)}")
         summary_response = await retry_llm_call(
             llm.ainvoke,
             [HumanMessage(content=prompt)],
             max_retries=1,
-            error_context="消息总结"
+            error_context="消息总结",
+            node="summary"
         )
 
         if summary_response is None:
-            logger.warning("消息总结失败，将使用原始消息")
-            return messages  # 返回原始消息，不进行压缩
+            logger.warning("消息总结失败，将使用已有总结并丢弃超出预算的旧消息")
+            if summary.get("content"):
+                summary_msg = SystemMessage(content=f"【历史对话总结】\n{summary['content']}")
+                return [summary_msg] + kept_tools + recent_other, summary
+            return kept_tools + recent_other, summary
 
-        summary_content = summary_response.content
+        summary_content = truncate_to_tokens(summary_response.content, summary_budget)
 
         logger.info(f"✅ 消息总结完成，总结长度={len(summary_content)}")
         logger.debug(f"总结内容预览：{summary_content[:200]}...")
 
+        # 更新滚动总结：按消息ID记录已覆盖的范围
+        new_summary = {
+            "content": summary_content,
+            "first_id": summary.get("first_id") or _message_key(new_aged[0]),
+            "last_id": _message_key(new_aged[-1]),
+            "message_keys": aged_keys
+        }
+
         # 创建总结消息
         summary_msg = SystemMessage(content=f"【历史对话总结】\n{summary_content}")
 
-        # 组合消息：总结 + 所有工具消息 + 最近消息
-        compressed = [summary_msg] + tool_messages + recent_other
+        # 组合消息：总结 + 工具消息 + 最近消息
+        compressed = [summary_msg] + kept_tools + recent_other
 
-        logger.info(f"✅ 消息压缩完成：{len(messages)} → {len(compressed)} (总结1条 + 工具{len(tool_messages)}条 + 最近{len(recent_other)}条)")
+        logger.info(f"✅ 消息压缩完成：{len(messages)} → {len(compressed)} (总结1条 + 工具{len(kept_tools)}条 + 最近{len(recent_other)}条)")
 
-        return compressed
+        return compressed, new_summary
 
     except Exception as e:
         logger.error(f"消息总结失败: {type(e).__name__}: {str(e)}")
         logger.warning("将使用简单截断策略作为降级方案")
-        # 降级方案：保留工具消息和最近的消息
-        return tool_messages + other_messages[-max_messages:]
+        # 降级方案：保留预算内的工具消息和最近的消息
+        return kept_tools + recent_other, summary
+
+def _message_key(msg: BaseMessage) -> str:
+    """获取消息的唯一标识：优先使用消息ID，没有ID的消息使用内容哈希"""
+    if getattr(msg, "id", None):
+        return msg.id
+    digest = hashlib.sha1(f"{type(msg).__name__}:{msg.content}".encode("utf-8")).hexdigest()
+    return f"hash-{digest[:16]}"
+
+def _fit_tool_messages(tool_messages: list[ToolMessage], budget: int) -> list[ToolMessage]:
+    """
+    将工具消息放入token预算内
+
+    先在所有工具消息之间平均分配预算；如果平均每条低于 TOOL_MESSAGE_MIN_TOKENS，
+    则丢弃最旧的工具消息，保证留下的每条结果仍然有意义
+
+    Args:
+        tool_messages: 工具消息列表（按时间顺序）
+        budget: 工具消息的token预算
+
+    Returns:
+        放入预算后的工具消息列表
+    """
+    if not tool_messages or budget <= 0:
+        return []
+
+    total = sum(estimate_message_tokens(msg) for msg in tool_messages)
+    if total <= budget:
+        return tool_messages
+
+    max_count = max(budget // TOOL_MESSAGE_MIN_TOKENS, 1)
+    kept = tool_messages[-max_count:]
+    if len(kept) < len(tool_messages):
+        logger.info(f"工具消息预算不足，丢弃最旧的{len(tool_messages) - len(kept)}条工具结果")
+
+    # 短消息不需要压缩，把它们省下的预算分给长消息
+    remaining_budget = budget
+    remaining_count = len(kept)
+    caps = {}
+    for msg in sorted(kept, key=estimate_message_tokens):
+        cap = remaining_budget // remaining_count
+        caps[id(msg)] = cap
+        remaining_budget -= min(estimate_message_tokens(msg), cap)
+        remaining_count -= 1
+
+    fitted = [condense_message(msg, caps[id(msg)] - 4) for msg in kept]
+    logger.debug(f"工具消息压缩：{total} → {sum(estimate_message_tokens(m) for m in fitted)} token（预算{budget}）")
+    return fitted
+
+def _retrieve_tool_context(
+    state: AmusementState,
+    plan_items: list,
+    budget: int
+) -> tuple[list[BaseMessage], Optional[SystemMessage], int]:
+    """
+    按行程板块检索工具结果，替代把全部ToolMessage放进replan的prompt
+
+    Args:
+        state: 当前状态
+        plan_items: 规划条目（每条作为一个检索板块）
+        budget: 该节点的消息历史token预算
+
+    Returns:
+        (需要压缩的其余消息（包括完整保留的车次/航班/酒店结果）, 检索上下文消息, 其余消息可用的token预算)
+        会话中没有可检索的工具结果或检索失败时，返回全部消息、None和原预算
+    """
+    messages = state.get("messages", [])
+    if not any(isinstance(msg, ToolMessage) for msg in messages):
+        return messages, None, budget
+
+    # 车次/航班/酒店结果不参与检索，按结构化表格压缩后完整保留（检索的板块查询可能漏掉其中的行）
+    kept_full = {
+        id(msg) for msg in messages
+        if isinstance(msg, ToolMessage) and structured_entity(getattr(msg, "name", "")) in RETRIEVAL_FULL_CONTEXT_ENTITIES
+    }
+    retrievable = [msg for msg in messages if isinstance(msg, ToolMessage) and id(msg) not in kept_full]
+    if not retrievable:
+        return messages, None, budget
+
+    try:
+        index = build_session_index(retrievable, state.get("destination", ""), get_tool_storage())
+        context = {
+            "origin": state.get("origin", ""),
+            "destination": state.get("destination", ""),
+            "date": state.get("date", ""),
+            "preferences": state.get("preferences", ""),
+        }
+        sections = build_itinerary_sections(context, plan_items, index)
+        retrieved = index.build_context(sections, max_tokens=int(budget * MESSAGE_TYPE_BUDGET_RATIOS["tool"]))
+    except Exception as e:
+        logger.error(f"工具结果检索失败，使用全部消息: {type(e).__name__}: {str(e)}")
+        return messages, None, budget
+
+    if not retrieved:
+        return messages, None, budget
+
+    retrieved_msg = SystemMessage(content=f"【按行程板块检索到的工具结果】\n{retrieved}")
+    other_messages = [msg for msg in messages if not isinstance(msg, ToolMessage) or id(msg) in kept_full]
+    return other_messages, retrieved_msg, max(budget - estimate_message_tokens(retrieved_msg), 0)
+
+def _insert_retrieved_context(messages: list[BaseMessage], retrieved_msg: Optional[SystemMessage]) -> list[BaseMessage]:
+    """将检索上下文放在历史总结之后、其余消息之前"""
+    if retrieved_msg is None:
+        return messages
+    if messages and isinstance(messages[0], SystemMessage) and str(messages[0].content).startswith("【历史对话总结】"):
+        return [messages[0], retrieved_msg] + messages[1:]
+    return [retrieved_msg] + messages
+
+async def _itinerary_skeleton_message(state: AmusementState) -> Optional[SystemMessage]:
+    """
+    用地图助手查到的景点坐标在本地求解每日行程骨架（见 utils/itinerary_optimizer.py）
+
+    Returns:
+        写进replan提示词的行程骨架消息；景点坐标不足或求解失败时返回None
+    """
+    tool_messages = [msg for msg in state.get("messages", []) if isinstance(msg, ToolMessage)]
+    if not tool_messages:
+        return None
+    # 预算不足时不再查询路线，只用直线距离估算
+    tools = []
+    if budget_allows("行程骨架路线查询"):
+        tools = [tool for server_tools in get_mcp_manager().get_tools_by_server().values() for tool in server_tools]
+    try:
+        skeleton = await plan_itinerary_skeleton(
+            tool_messages,
+            days=state.get("days", 1),
+            destination=state.get("destination", ""),
+            start_date=state.get("date", ""),
+            tools=tools
+        )
+    except Exception as e:
+        logger.error(f"行程骨架求解失败，交给LLM安排: {type(e).__name__}: {str(e)}")
+        return None
+    if not skeleton:
+        return None
+    return SystemMessage(content=AMUSEMENT_ITINERARY_SKELETON_PROMPT.format(skeleton=skeleton))
+
+def _budget_plan_message(state: AmusementState) -> Optional[SystemMessage]:
+    """
+    用结构化的票价、房价在本地求解预算方案（见 utils/budget_optimizer.py）
+
+    Returns:
+        写进replan提示词的预算方案消息；没有价格信息或求解失败时返回None
+    """
+    tool_messages = [msg for msg in state.get("messages", []) if isinstance(msg, ToolMessage)]
+    if not tool_messages:
+        return None
+    try:
+        budget_plan = solve_budget(
+            tool_messages,
+            budget=state.get("budget", 0),
+            people=state.get("people", 1),
+            days=state.get("days", 1),
+            origin=state.get("origin", ""),
+            destination=state.get("destination", "")
+        )
+    except Exception as e:
+        logger.error(f"预算方案求解失败，交给LLM计算: {type(e).__name__}: {str(e)}")
+        return None
+    if budget_plan is None:
+        return None
+    return SystemMessage(content=AMUSEMENT_BUDGET_PLAN_PROMPT.format(budget_plan=render_budget_plan(budget_plan)))
+
 async def plan(state:AmusementState)->AmusementState:
     logger.info("=" * 80)
     logger.info("【PLAN阶段开始】旅游智能体开始规划...")
@@ -216,7 +480,7 @@ async def plan(state:AmusementState)->AmusementState:
     logger.info("Plan阶段：不绑定工具，专注于生成结构化规划")
 
     # 使用PlanWithIntervention格式，让LLM自主判断是否需要人工介入
-    parser = JsonOutputParser(pydantic_object = PlanWithIntervention)
+    parser = get_json_parser(PlanWithIntervention)
 
     # 根据模式选择不同的 prompt 和输入变量
     if is_feedback_mode:
@@ -235,15 +499,18 @@ async def plan(state:AmusementState)->AmusementState:
         else:
             original_plan_summary = "无原始计划信息"
 
-        prompt = PromptTemplate(
-            template = AMUSEMENT_SYSTEM_PLAN_FEEDBACK_TEMPLATE,
-            input_variables=["user_feedback", "original_plan_summary"],
-            partial_variables={"json_format": parser.get_format_instructions()}
+        prompt = get_chat_prompt_template(
+            AMUSEMENT_SYSTEM_PLAN_FEEDBACK_TEMPLATE,
+            pydantic_object=PlanWithIntervention
         )
 
         # 使用智能消息压缩（反馈模式下需要更少的历史消息）
         logger.info("开始压缩消息历史（反馈模式）...")
-        recent_messages = await compress_messages(state.get("messages", []), max_messages=5)
+        recent_messages, conversation_summary = await compress_messages(
+            state.get("messages", []),
+            max_tokens=get_context_budget("plan_feedback"),
+            summary=state.get("conversation_summary")
+        )
         logger.info(f"消息压缩完成，最终消息数: {len(recent_messages)}")
 
         input_data = {
@@ -299,15 +566,18 @@ async def plan(state:AmusementState)->AmusementState:
         else:
             observation_feedback = "无（首次规划或上一轮已完成）"
 
-        prompt = PromptTemplate(
-            template = AMUSEMENT_SYSTEM_PLAN_TEMPLATE,
-            input_variables=["origin","destination","date","days","people","budget","preferences","plan","replan","collected_info","observation_feedback","messages"],
-            partial_variables={"json_format":parser.get_format_instructions()},
+        prompt = get_chat_prompt_template(
+            AMUSEMENT_SYSTEM_PLAN_TEMPLATE,
+            pydantic_object=PlanWithIntervention
         )
 
         # 使用智能消息压缩，避免丢失重要信息
         logger.info("开始压缩消息历史...")
-        recent_messages = await compress_messages(state.get("messages", []), max_messages=15)
+        recent_messages, conversation_summary = await compress_messages(
+            state.get("messages", []),
+            max_tokens=get_context_budget("plan"),
+            summary=state.get("conversation_summary")
+        )
         logger.info(f"消息压缩完成，最终消息数: {len(recent_messages)}")
 
         input_data = {
@@ -342,7 +612,8 @@ async def plan(state:AmusementState)->AmusementState:
         chain.ainvoke,
         input_data,
         max_retries=1,
-        error_context="Plan阶段生成规划"
+        error_context="Plan阶段生成规划",
+        node="plan_feedback" if is_feedback_mode else "plan"
     )
 
     if response is None:
@@ -428,7 +699,8 @@ async def plan(state:AmusementState)->AmusementState:
         "intervention_count": intervention_count,
         "collected_info": collected_info,  # 保留已收集信息（包含问题历史）
         "executed_tasks": [],  # 重置已执行任务列表，因为plan重新规划了
-        "current_task_index": 0  # 重置任务索引
+        "current_task_index": 0,  # 重置任务索引
+        "conversation_summary": conversation_summary  # 滚动总结，下一轮只增量更新
     }
 
     logger.info("【PLAN阶段结束】")
@@ -553,6 +825,10 @@ async def excute(state :AmusementState)->AmusementState:
                 logger.info(f"⏭ 任务{task_idx}/{len(tasks)}已执行，跳过: {task[:50]}...")
                 continue
 
+            # 会话预算不足时不再执行剩余查询任务（不标记为已执行），直接用已有结果replan
+            if not budget_allows(f"查询任务 {category_name}-{task_idx}: {task[:30]}"):
+                continue
+
             logger.info("-" * 80)
             logger.info(f"【类别{category_name} - 查询任务 {task_idx}/{len(tasks)}】")
             logger.info(f"任务内容: {task}")
@@ -585,6 +861,8 @@ async def excute(state :AmusementState)->AmusementState:
             # 检查是否已执行
             if summary_task in executed_tasks:
                 logger.info(f"⏭ 总结任务已执行，跳过: {summary_task[:50]}...")
+            elif not budget_allows(f"总结任务 {category_name}"):
+                logger.info(f"该类别的 {len(category_tool_messages)} 个查询结果将直接交给replan")
             else:
                 logger.info("-" * 80)
                 logger.info(f"【类别{category_name} - 总结任务】")
@@ -659,7 +937,8 @@ async def _execute_single_task(
     """
     logger.info(f"【父Agent】正在分析任务，决定分配给哪个子Agent...")
 
-    dispatch_prompt = AMUSEMENT_COORDINATOR_TASK_DISPATCH_TEMPLATE.format(
+    dispatch_messages = build_layered_messages(
+        AMUSEMENT_COORDINATOR_TASK_DISPATCH_TEMPLATE,
         task=task,
         origin=context['origin'],
         destination=context['destination'],
@@ -671,14 +950,15 @@ async def _execute_single_task(
         sub_agents_info=sub_agents_info
     )
 
-    logger.debug(f"任务分发Prompt:\n{dispatch_prompt}")
+    logger.debug(f"任务分发Prompt:\n{messages_to_text(dispatch_messages)}")
 
     # 调用LLM进行任务分发决策
     dispatch_response = await retry_llm_call(
         llm.ainvoke,
-        [HumanMessage(content=dispatch_prompt)],
+        dispatch_messages,
         max_retries=1,
-        error_context=f"父Agent任务分发-{task_identifier}"
+        error_context=f"父Agent任务分发-{task_identifier}",
+        node="dispatch"
     )
 
     if dispatch_response is None:
@@ -796,6 +1076,9 @@ async def replan(state:AmusementState)->AmusementState:
         logger.info("【REPLAN阶段开始】旅游智能体重新规划并生成旅游攻略...")
 
     logger.info(f"输入参数: 目的地={state['destination']}, 天数={state['days']}, 预算={state['budget']}, 人数={state['people']}")
+    session_budget = get_session_budget()
+    if session_budget is not None and session_budget.is_low():
+        logger.warning(f"⚠️ 会话预算不足，将使用已有结果生成攻略（已跳过: {session_budget.skipped}）")
 
     # 处理plan格式（新旧兼容）
     plan_data = state.get('plan', [])
@@ -861,7 +1144,7 @@ async def replan(state:AmusementState)->AmusementState:
     logger.info("Replan阶段：不绑定工具，专注于生成优化后的规划和攻略")
 
     # 使用ReplanWithIntervention格式，让LLM自主判断是否需要人工介入
-    parser = JsonOutputParser(pydantic_object = ReplanWithIntervention)
+    parser = get_json_parser(ReplanWithIntervention)
 
     # 根据模式选择不同的 prompt 和输入变量
     if is_feedback_mode:
@@ -872,16 +1155,25 @@ async def replan(state:AmusementState)->AmusementState:
         original_amusement_info = state.get("original_amusement_info", {})
         original_amusement_info_str = json.dumps(original_amusement_info, ensure_ascii=False, indent=2)
 
-        prompt = PromptTemplate(
-            template = AMUSEMENT_SYSYRM_REPLAN_FEEDBACK_TEMPLATE,
-            input_variables=["user_feedback", "original_amusement_info", "origin", "destination", "date", "days", "people", "budget", "preferences", "messages", "plan"],
-            partial_variables={"json_format": parser.get_format_instructions()}
+        prompt = get_chat_prompt_template(
+            AMUSEMENT_SYSYRM_REPLAN_FEEDBACK_TEMPLATE,
+            pydantic_object=ReplanWithIntervention
         )
 
         # 使用智能消息压缩（反馈模式下需要保留更多历史信息以便LLM理解完整上下文）
         logger.info("开始压缩消息历史（反馈模式）...")
-        recent_messages = await compress_messages(state.get("messages", []), max_messages=20)
+        history_messages, retrieved_msg, history_budget = _retrieve_tool_context(
+            state, plan_for_display, get_context_budget("replan_feedback")
+        )
+        recent_messages, conversation_summary = await compress_messages(
+            history_messages,
+            max_tokens=history_budget,
+            summary=state.get("conversation_summary")
+        )
+        recent_messages = _insert_retrieved_context(recent_messages, retrieved_msg)
         logger.info(f"消息压缩完成，最终消息数: {len(recent_messages)}")
+        precomputed = [await _itinerary_skeleton_message(state), _budget_plan_message(state)]
+        recent_messages = recent_messages + [msg for msg in precomputed if msg is not None]
 
         input_data = {
             "user_feedback": user_feedback,
@@ -912,16 +1204,25 @@ async def replan(state:AmusementState)->AmusementState:
         else:
             collected_info_str = "尚未询问任何问题"
 
-        prompt = PromptTemplate(
-            template = AMUSEMENT_SYSYRM_REPLAN_TEMPLATE,
-            input_variables=["origin","destination","date","days","people","budget","preferences","messages","plan","collected_info"],
-            partial_variables={"json_format":parser.get_format_instructions()}
+        prompt = get_chat_prompt_template(
+            AMUSEMENT_SYSYRM_REPLAN_TEMPLATE,
+            pydantic_object=ReplanWithIntervention
         )
 
         # 使用智能消息压缩，避免丢失重要信息（特别是工具调用结果）
         logger.info("开始压缩消息历史...")
-        recent_messages = await compress_messages(state.get("messages", []), max_messages=15)
+        history_messages, retrieved_msg, history_budget = _retrieve_tool_context(
+            state, plan_for_display, get_context_budget("replan")
+        )
+        recent_messages, conversation_summary = await compress_messages(
+            history_messages,
+            max_tokens=history_budget,
+            summary=state.get("conversation_summary")
+        )
+        recent_messages = _insert_retrieved_context(recent_messages, retrieved_msg)
         logger.info(f"消息压缩完成，最终消息数: {len(recent_messages)}")
+        precomputed = [await _itinerary_skeleton_message(state), _budget_plan_message(state)]
+        recent_messages = recent_messages + [msg for msg in precomputed if msg is not None]
 
         input_data = {
             "origin": state["origin"],
@@ -953,7 +1254,8 @@ async def replan(state:AmusementState)->AmusementState:
         chain.ainvoke,
         input_data,
         max_retries=1,
-        error_context="Replan阶段生成优化规划"
+        error_context="Replan阶段生成优化规划",
+        node="replan_feedback" if is_feedback_mode else "replan"
     )
 
     # 如果重试后仍失败，提供默认响应
@@ -1140,7 +1442,8 @@ async def replan(state:AmusementState)->AmusementState:
         "intervention_count": intervention_count,
         "collected_info": collected_info,  # 保留已收集信息（包含问题历史）
         "need_supplement": need_supplement,
-        "supplement_tasks": supplement_tasks
+        "supplement_tasks": supplement_tasks,
+        "conversation_summary": conversation_summary  # 滚动总结，下一轮只增量更新
     }
 
     logger.info("【REPLAN阶段结束】")
@@ -1156,17 +1459,17 @@ async def observation(state:AmusementState) -> Command[Literal["__end__", "plan"
     logger.info("正在初始化LLM...")
     llm = await get_local_llm("observation")
 
-    content = AMUSEMENT_SYSTEM_JUDGE_TEMPLATE.format(**state)
-    human_message = HumanMessage(content=content)
+    judge_messages = build_layered_messages(AMUSEMENT_SYSTEM_JUDGE_TEMPLATE, **state)
 
     logger.info("🤖 开始调用LLM判断攻略质量...")
-    logger.debug(f"判断提示词长度: {len(content)} 字符")
+    logger.debug(f"判断提示词长度: {len(messages_to_text(judge_messages))} 字符")
 
     response = await retry_llm_call(
         llm.ainvoke,
-        [human_message],
+        judge_messages,
         max_retries=1,
-        error_context="Observation阶段判断攻略质量"
+        error_context="Observation阶段判断攻略质量",
+        node="observation"
     )
 
     if response is None:
@@ -1306,6 +1609,11 @@ async def check_supplement(state: AmusementState) -> Command[Literal["__end__",
         logger.info("=" * 80)
         return Command(goto="__end__")
 
+    if not budget_allows(f"第{supplement_count + 1}次补充执行"):
+        logger.info("【CHECK_SUPPLEMENT阶段结束】")
+        logger.info("=" * 80)
+        return Command(goto="__end__")
+
     logger.info(f"✓ 需要补充执行，准备执行第{supplement_count + 1}次补充")
     logger.info(f"补充任务类别: {[t['category'] for t in supplement_tasks]}")
     logger.info("【CHECK_SUPPLEMENT阶段结束】")
@@ -2,20 +2,40 @@
 子 Agent 定义
 每个子 Agent 负责特定类型的工具调用，避免工具误调用
 """
+import asyncio
 import logging
 from typing import List, Dict, Any, Optional
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.prompts import PromptTemplate
 
 from utils import get_llm
 from utils.agent_tools import retry_llm_call, execute_tool_calls
 from utils.tool_data_storage import get_tool_storage
-from config import get_max_rounds
+from utils.tool_projection import project_tool_output
+from utils.tool_result_filter import filter_tool_messages
+from utils.tool_selector import select_tools
+from utils.prompt_layout import build_layered_messages
+from utils.retrieval_index import ToolResultIndex
+from utils.token_counter import estimate_message_tokens
+from utils.session_budget import budget_allows
+from utils.tool_chain import resolve_prerequisites
+from utils.transport_ranking import rank_transport_options, RANKED_TRANSPORT_TOOLS
+from utils.completion_check import (
+    CompletionChecker,
+    validate_transport,
+    validate_weather,
+    validate_hotels,
+    validate_pois,
+)
+from config import get_max_rounds, get_tool_top_k
+from config.sub_agent_config import COMPLETION_CHECK_OVERLAP, TRANSPORT_RANKING_TOP_N
+from config.context_config import RETRIEVAL_SUMMARY_TASK_MIN_TOKENS, RETRIEVAL_SUMMARY_TASK_MAX_TOKENS
 from prompts import (
     SUB_AGENT_SUMMARY_TASK_PROMPT,
     SUB_AGENT_QUERY_TASK_PROMPT,
     TASK_COMPLETION_CHECK_PROMPT,
     EXTRA_TOOL_CALL_GUIDANCE_PROMPT,
+    TOOL_PREREQUISITE_RESULTS_PROMPT,
     TRANSPORT_AGENT_SUMMARY_TASK_PROMPT,
     TRANSPORT_AGENT_QUERY_TASK_PROMPT,
     MAP_AGENT_SUMMARY_TASK_PROMPT,
@@ -43,20 +63,64 @@ class BaseSubAgent:
         self.agent_type = agent_type
         self.llm = None
         self.llm_with_tools = None
-        # 从配置获取该类型agent的默认max_rounds
+        # 按工具子集缓存绑定后的LLM（key为工具名称集合）
+        self._bound_llms: Dict[frozenset, Any] = {}
+        # 按任务缓存工具选择结果
+        self._selected_tools_cache: Dict[tuple, List[Any]] = {}
+        # 按工具子集缓存工具描述文本
+        self._tools_desc_cache: Dict[tuple, str] = {}
+        # 从配置获取该类型agent的默认max_rounds和工具数量上限
         self.default_max_rounds = get_max_rounds(agent_type)
-        logger.debug(f"子Agent [{self.name}] 类型: {agent_type}, 默认max_rounds: {self.default_max_rounds}")
+        self.tool_top_k = get_tool_top_k(agent_type)
+        logger.debug(f"子Agent [{self.name}] 类型: {agent_type}, 默认max_rounds: {self.default_max_rounds}, 工具数量上限: {self.tool_top_k}")
 
     async def initialize(self):
         """初始化 LLM 和工具绑定"""
         if self.llm is None:
             self.llm = get_llm("plan")
-            self.llm_with_tools = self.llm.bind_tools(self.tools)
-            logger.info(f"子Agent [{self.name}] 初始化完成，绑定工具数: {len(self.tools)}")
+            self.llm_with_tools = self._get_llm_with_tools(self.tools)
+            logger.info(f"子Agent [{self.name}] 初始化完成，可用工具数: {len(self.tools)}")
             for tool in self.tools:
                 tool_name = tool.name if hasattr(tool, 'name') else str(tool)
                 logger.debug(f"  - {tool_name}")
 
+    def _get_llm_with_tools(self, tools: List[Any]):
+        """获取绑定了指定工具子集的LLM（按工具名称集合缓存，相同子集只绑定一次）"""
+        key = frozenset(tool.name if hasattr(tool, 'name') else str(tool) for tool in tools)
+        if key not in self._bound_llms:
+            self._bound_llms[key] = self.llm.bind_tools(tools)
+            logger.debug(f"子Agent [{self.name}] 绑定工具子集: {sorted(key)}")
+        return self._bound_llms[key]
+
+    def select_tools(self, task: str, extra_query: Optional[str] = None) -> List[Any]:
+        """
+        按任务内容选择需要绑定的工具子集（结果按任务缓存）
+
+        Args:
+            task: 任务描述
+            extra_query: 额外的查询文本（如任务未完成的原因）
+
+        Returns:
+            选中的工具列表
+        """
+        key = (task, extra_query)
+        if key not in self._selected_tools_cache:
+            if len(self._selected_tools_cache) >= 256:
+                self._selected_tools_cache.clear()
+            self._selected_tools_cache[key] = select_tools(task, self.tools, self.tool_top_k, extra_query)
+        return self._selected_tools_cache[key]
+
+    def _tools_desc(self, tools: List[Any]) -> str:
+        """构建工具描述文本（按工具子集缓存，每轮prompt不再重复拼接）"""
+        key = tuple(tool.name if hasattr(tool, 'name') else str(tool) for tool in tools)
+        if key not in self._tools_desc_cache:
+            self._tools_desc_cache[key] = "\n".join([
+                f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
+                f"{tool.description if hasattr(tool, 'description') else '无描述'}"
+                for tool in tools
+            ])
+        return self._tools_desc_cache[key]
+
     async def execute_task(
         self,
         task: str,
@@ -81,7 +145,8 @@ class BaseSubAgent:
                 "tool_messages": List[ToolMessage],
                 "summary": str,
                 "is_summary_task": bool,
-                "final_response": str
+                "final_response": str,
+                "completion_checks": Dict[str, int]  # 完成度检查次数统计（仅查询任务）
             }
         """
         await self.initialize()
@@ -115,15 +180,43 @@ class BaseSubAgent:
                 content_preview = str(msg.content)[:200]
                 logger.debug(f"  上下文 {idx}: {content_preview}...")
 
+        # 按任务选择工具子集（执行时仍然可以使用全部工具）
+        selected_tools = self.select_tools(task)
+        llm_with_tools = self._get_llm_with_tools(selected_tools)
+        if len(selected_tools) < len(self.tools):
+            logger.info(
+                f"【子Agent: {self.name}】按任务选择工具 {len(selected_tools)}/{len(self.tools)}: "
+                f"{[tool.name if hasattr(tool, 'name') else str(tool) for tool in selected_tools]}"
+            )
+
         # 构建任务提示词
         prompt = self._build_prompt(task, context, previous_tool_results)
 
+        # 查询任务：在本地并行解析选中工具的前置信息（如车站代码），LLM第一轮即可直接调用最终的查询工具
+        if not is_summary_task:
+            prerequisite_results = await resolve_prerequisites(selected_tools, self.tools, context)
+            if prerequisite_results:
+                prompt = prompt[:-1] + [HumanMessage(
+                    content=prompt[-1].content + TOOL_PREREQUISITE_RESULTS_PROMPT.format(prerequisite_results=prerequisite_results)
+                )]
+
         # 多轮对话执行
         task_messages = []
         all_tool_messages = []
         final_response_content = ""
 
+        # 任务完成度检查（本地校验 / 复用 / 与下一轮重叠，见 utils/completion_check.py）
+        checker = CompletionChecker(
+            self.name,
+            self.agent_type,
+            validate=lambda tool_messages: self.validate_completion(task, context, tool_messages),
+            llm_check=lambda tool_messages: self._check_task_completion(task, context, tool_messages)
+        )
+
         for round_num in range(1, max_rounds + 1):
+            # 第一轮必须执行，后续轮次在会话预算不足时跳过
+            if round_num > 1 and not budget_allows(f"{self.name} 第{round_num}轮"):
+                break
             logger.info(f"  [{self.name}] 第{round_num}轮")
 
             # 构建当前轮消息
@@ -133,25 +226,36 @@ class BaseSubAgent:
                 if previous_tool_results:
                     # 将工具结果内容提取为文本
                     context_info = "\n\n**之前任务的查询结果**：\n"
-                    for idx, tool_msg in enumerate(previous_tool_results, 1):
-                        tool_name = tool_msg.name if hasattr(tool_msg, 'name') else '未知工具'
-                        context_info += f"\n{idx}. [{tool_name}] 查询结果：\n{tool_msg.content}\n"
-
-                    # 将工具结果作为上下文添加到prompt中
-                    enhanced_prompt = prompt + context_info
-                    current_messages = [HumanMessage(content=enhanced_prompt)]
+                    retrieved = (
+                        self.condense_previous_results(task, context, previous_tool_results)
+                        or self._retrieve_previous_results(task, previous_tool_results)
+                    )
+                    if retrieved:
+                        context_info += retrieved
+                    else:
+                        for idx, tool_msg in enumerate(previous_tool_results, 1):
+                            tool_name = tool_msg.name if hasattr(tool_msg, 'name') else '未知工具'
+                            context_info += f"\n{idx}. [{tool_name}] 查询结果：\n{tool_msg.content}\n"
+
+                    # 将工具结果作为上下文添加到动态后缀中（静态前缀保持不变，便于命中提示词缓存）
+                    current_messages = prompt[:-1] + [HumanMessage(content=prompt[-1].content + context_info)]
                 else:
-                    current_messages = [HumanMessage(content=prompt)]
+                    current_messages = list(prompt)
             else:
                 current_messages = task_messages.copy()
 
             # 调用 LLM
-            response = await retry_llm_call(
-                self.llm_with_tools.ainvoke,
-                current_messages,
-                max_retries=1,
-                error_context=f"{self.name} 第{round_num}轮"
-            )
+            try:
+                response = await retry_llm_call(
+                    llm_with_tools.ainvoke,
+                    current_messages,
+                    max_retries=1,
+                    error_context=f"{self.name} 第{round_num}轮",
+                    node=f"sub_agent.{self.agent_type}"
+                )
+            except asyncio.CancelledError:
+                checker.discard_overlapped()
+                raise
 
             if response is None:
                 logger.error(f"  [{self.name}] LLM调用失败")
@@ -174,7 +278,10 @@ class BaseSubAgent:
                 has_tool_calls = True
                 logger.info(f"  [{self.name}] 检测到工具调用（旧格式）: {len(response.additional_kwargs['tool_calls'])}个")
 
-            if not has_tool_calls:
+            if has_tool_calls:
+                # 本轮继续调用工具，上一轮结束时预先开始的完成度检查已经过时
+                checker.discard_overlapped()
+            else:
                 # 如果是总结任务，没有工具调用是正常的
                 if is_summary_task:
                     logger.info(f"  [{self.name}] 第{round_num}轮未检测到工具调用（总结任务正常行为），任务完成")
@@ -209,7 +316,8 @@ class BaseSubAgent:
                         category=category,
                         tool_name=tool_name,
                         tool_input=tool_input,
-                        tool_output=tool_msg.content,
+                        # 保存原始输出（artifact），content是投影后的紧凑内容
+                        tool_output=tool_msg.artifact if tool_msg.artifact is not None else tool_msg.content,
                         context=context,
                         metadata={
                             "task": task,
@@ -226,14 +334,18 @@ class BaseSubAgent:
                 logger.warning(f"  [{self.name}] 达到最大轮次")
                 break
 
+            # 下一轮LLM调用的同时预先检查任务完成度（下一轮不再调用工具时直接使用结论）
+            if COMPLETION_CHECK_OVERLAP and not is_summary_task and budget_allows(f"{self.name} 预先任务完成度检查"):
+                checker.start_overlapped(all_tool_messages)
+
         # 任务完成度检查和额外轮次（仅对查询任务）
-        if not is_summary_task:
+        if not is_summary_task and budget_allows(f"{self.name} 任务完成度检查"):
             logger.info(f"  [{self.name}] 主循环结束，开始检查任务完成度")
 
             extra_rounds = 2  # 最多额外2轮
             for extra_round in range(1, extra_rounds + 1):
                 # 检查子任务是否完成
-                completion_result = await self._check_task_completion(task, context, all_tool_messages)
+                completion_result = await checker.check(all_tool_messages)
                 completion_status = completion_result["completed"]
                 completion_reason = completion_result["reason"]
 
@@ -242,6 +354,8 @@ class BaseSubAgent:
                     logger.info(f"  [{self.name}] 完成原因: {completion_reason}")
                     break
                 else:
+                    if not budget_allows(f"{self.name} 额外第{extra_round}轮"):
+                        break
                     logger.info(f"  [{self.name}] ✗ 任务未完成，开始第{extra_round}轮额外工具调用")
                     logger.info(f"  [{self.name}] 未完成原因: {completion_reason}")
 
@@ -255,11 +369,20 @@ class BaseSubAgent:
                     guidance_message = HumanMessage(content=guidance_content)
                     current_messages.append(guidance_message)
 
+                    # 按未完成原因补充可能需要的工具（保留已选工具，历史消息中的工具调用仍然有效）
+                    extra_tools = self.select_tools(task, completion_reason)
+                    extra_names = {tool.name if hasattr(tool, 'name') else str(tool) for tool in extra_tools}
+                    round_tools = extra_tools + [
+                        tool for tool in selected_tools
+                        if (tool.name if hasattr(tool, 'name') else str(tool)) not in extra_names
+                    ]
+
                     response = await retry_llm_call(
-                        self.llm_with_tools.ainvoke,
+                        self._get_llm_with_tools(round_tools).ainvoke,
                         current_messages,
                         max_retries=1,
-                        error_context=f"{self.name} 额外第{extra_round}轮"
+                        error_context=f"{self.name} 额外第{extra_round}轮",
+                        node=f"sub_agent.{self.agent_type}"
                     )
 
                     if response is None:
@@ -311,7 +434,7 @@ class BaseSubAgent:
                                 category=category,
                                 tool_name=tool_name,
                                 tool_input=tool_input,
-                                tool_output=tool_msg.content,
+                                tool_output=tool_msg.artifact if tool_msg.artifact is not None else tool_msg.content,
                                 context=context,
                                 metadata={
                                     "task": task,
@@ -327,41 +450,49 @@ class BaseSubAgent:
                     if extra_round == extra_rounds:
                         logger.warning(f"  [{self.name}] 达到额外轮次上限")
 
-            # 两次额外轮次后，再次检查任务完成度
-            final_completion_result = await self._check_task_completion(task, context, all_tool_messages)
-            final_completion_status = final_completion_result["completed"]
-            final_completion_reason = final_completion_result["reason"]
+            # 两次额外轮次后，再次检查任务完成度（会话预算不足时跳过，连同zhipu_search补全）
+            if budget_allows(f"{self.name} zhipu_search补全"):
+                final_completion_result = await checker.check(all_tool_messages)
+                final_completion_status = final_completion_result["completed"]
+                final_completion_reason = final_completion_result["reason"]
 
-            if final_completion_status == 0:
-                logger.warning(f"  [{self.name}] ⚠ 两次额外轮次后任务仍未完成，尝试使用zhipu_search补全信息")
-                logger.warning(f"  [{self.name}] 未完成原因: {final_completion_reason}")
+                if final_completion_status == 0:
+                    logger.warning(f"  [{self.name}] ⚠ 两次额外轮次后任务仍未完成，尝试使用zhipu_search补全信息")
+                    logger.warning(f"  [{self.name}] 未完成原因: {final_completion_reason}")
 
-                # 构建搜索query（传入未完成的原因）
-                search_query = await self._build_fallback_search_query(
-                    task, context, all_tool_messages, final_completion_reason
-                )
-                logger.info(f"  [{self.name}] 构建搜索query: {search_query}")
+                    # 构建搜索query（传入未完成的原因）
+                    search_query = await self._build_fallback_search_query(
+                        task, context, all_tool_messages, final_completion_reason
+                    )
+                    logger.info(f"  [{self.name}] 构建搜索query: {search_query}")
 
-                # 直接调用zhipu_search函数
-                try:
-                    from utils.tools import zhipu_search
+                    # 直接调用zhipu_search函数
+                    try:
+                        from utils.tools import zhipu_search
 
-                    # 调用zhipu_search（同步函数）
-                    search_result = zhipu_search.invoke({"query": search_query})
+                        # zhipu_search是同步函数，ainvoke会在线程池中执行，不阻塞事件循环（取消时不必等待它返回）
+                        search_result = await zhipu_search.ainvoke({"query": search_query})
 
-                    # 创建ToolMessage
-                    from langchain_core.messages import ToolMessage as LangChainToolMessage
-                    search_tool_message = LangChainToolMessage(
-                        content=str(search_result),
-                        tool_call_id=f"fallback_search_{len(all_tool_messages)}",
-                        name="zhipu_search"
-                    )
+                        # 创建ToolMessage
+                        from langchain_core.messages import ToolMessage as LangChainToolMessage
+                        search_tool_message = LangChainToolMessage(
+                            content=project_tool_output("zhipu_search", search_result),
+                            tool_call_id=f"fallback_search_{len(all_tool_messages)}",
+                            name="zhipu_search"
+                        )
 
-                    all_tool_messages.append(search_tool_message)
-                    logger.info(f"  [{self.name}] ✓ zhipu_search补全搜索完成，结果长度: {len(str(search_result))}")
+                        all_tool_messages.append(search_tool_message)
+                        logger.info(f"  [{self.name}] ✓ zhipu_search补全搜索完成，结果长度: {len(str(search_result))}")
 
-                except Exception as e:
-                    logger.error(f"  [{self.name}] ✗ zhipu_search补全搜索失败: {str(e)}")
+                    except Exception as e:
+                        logger.error(f"  [{self.name}] ✗ zhipu_search补全搜索失败: {str(e)}")
+
+        completion_checks = checker.finish() if not is_summary_task else None
+
+        # 工具结果后处理：去重、合并重复记录、过滤超出范围的内容
+        filter_stats = None
+        if not is_summary_task and all_tool_messages:
+            all_tool_messages, filter_stats = filter_tool_messages(all_tool_messages, context, task)
 
         # 生成总结
         summary = self._generate_summary(all_tool_messages)
@@ -390,20 +521,58 @@ class BaseSubAgent:
             "summary": summary,
             "agent_name": self.name,
             "is_summary_task": is_summary_task,
-            "final_response": final_response_content
+            "final_response": final_response_content,
+            "filter_stats": filter_stats,
+            "completion_checks": completion_checks
         }
 
-    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> str:
-        """构建任务提示词（子类可重写）"""
-        tools_desc = "\n".join([
-            f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
-            f"{tool.description if hasattr(tool, 'description') else '无描述'}"
-            for tool in self.tools
-        ])
+    def condense_previous_results(
+        self,
+        task: str,
+        context: Dict[str, Any],
+        previous_tool_results: List[ToolMessage]
+    ) -> Optional[str]:
+        """
+        总结任务：把之前的查询结果在本地整理成精简的上下文（子类按结构化的工具结果重写）
+
+        Returns:
+            整理后的上下文；无法整理时返回None（按检索或全部结果处理）
+        """
+        return None
+
+    def _retrieve_previous_results(self, task: str, previous_tool_results: List[ToolMessage]) -> str:
+        """
+        总结任务的工具结果过多时，按任务内容检索相关片段，而不是把全部结果放进prompt
+
+        Returns:
+            检索到的上下文；结果不多或检索失败时返回空字符串（使用全部结果）
+        """
+        total_tokens = sum(estimate_message_tokens(msg) for msg in previous_tool_results)
+        if total_tokens <= RETRIEVAL_SUMMARY_TASK_MIN_TOKENS:
+            return ""
+        try:
+            index = ToolResultIndex()
+            index.add_tool_messages(previous_tool_results)
+            retrieved = index.build_context(
+                [("与任务相关的查询结果", task)],
+                max_tokens=RETRIEVAL_SUMMARY_TASK_MAX_TOKENS,
+                top_k=len(index)
+            )
+        except Exception as e:
+            logger.warning(f"  [{self.name}] 检索之前的查询结果失败，使用全部结果: {e}")
+            return ""
+        if retrieved:
+            logger.info(f"  [{self.name}] 之前的查询结果约{total_tokens}个token，已按任务检索相关片段")
+        return retrieved
+
+    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> List[BaseMessage]:
+        """构建任务提示词（子类可重写），返回 [静态前缀SystemMessage, 动态后缀HumanMessage]"""
+        tools_desc = self._tools_desc(self.select_tools(task))
 
         # 如果有之前的工具调用结果，说明这是总结任务
         if previous_tool_results:
-            return SUB_AGENT_SUMMARY_TASK_PROMPT.format(
+            return build_layered_messages(
+                SUB_AGENT_SUMMARY_TASK_PROMPT,
                 description=self.description,
                 task=task,
                 origin=context.get('origin', '未知'),
@@ -417,7 +586,8 @@ class BaseSubAgent:
             )
         else:
             # 查询任务
-            return SUB_AGENT_QUERY_TASK_PROMPT.format(
+            return build_layered_messages(
+                SUB_AGENT_QUERY_TASK_PROMPT,
                 description=self.description,
                 task=task,
                 origin=context.get('origin', '未知'),
@@ -430,6 +600,20 @@ class BaseSubAgent:
                 tools_desc=tools_desc
             )
 
+    def validate_completion(
+        self,
+        task: str,
+        context: Dict[str, Any],
+        all_tool_messages: List[ToolMessage]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        本地校验任务是否完成（不调用LLM，子类按结构化的工具结果重写）
+
+        Returns:
+            {"completed": int, "reason": str}；无法判断时返回None（交给LLM检查）
+        """
+        return None
+
     async def _check_task_completion(
         self,
         task: str,
@@ -445,7 +629,7 @@ class BaseSubAgent:
                 "reason": str      # 完成/未完成的原因
             }
         """
-        # 构建工具结果摘要（返回完整内容，不截断）
+        # 构建工具结果摘要（工具结果已经过投影压缩，这里不再截断）
         tool_results_summary = ""
         if all_tool_messages:
             tool_results_summary = "\n".join([
@@ -456,7 +640,8 @@ class BaseSubAgent:
             tool_results_summary = "（暂无工具调用结果）"
 
         # 构建判断提示词
-        check_prompt = TASK_COMPLETION_CHECK_PROMPT.format(
+        check_message = build_layered_messages(
+            TASK_COMPLETION_CHECK_PROMPT,
             task=task,
             origin=context.get('origin', '未知'),
             destination=context.get('destination', '未知'),
@@ -468,14 +653,13 @@ class BaseSubAgent:
             tool_results_summary=tool_results_summary
         )
 
-        check_message = [HumanMessage(content=check_prompt)]
-
         try:
             response = await retry_llm_call(
                 self.llm.ainvoke,
                 check_message,
                 max_retries=1,
-                error_context=f"{self.name} 任务完成度检查"
+                error_context=f"{self.name} 任务完成度检查",
+                node=f"completion_check.{self.agent_type}"
             )
 
             if response is None:
@@ -672,15 +856,12 @@ class TransportSubAgent(BaseSubAgent):
             agent_type="transport"
         )
 
-    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> str:
-        tools_desc = "\n".join([
-            f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
-            f"{tool.description if hasattr(tool, 'description') else '无描述'}"
-            for tool in self.tools
-        ])
+    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> List[BaseMessage]:
+        tools_desc = self._tools_desc(self.select_tools(task))
 
         if previous_tool_results:
-            return TRANSPORT_AGENT_SUMMARY_TASK_PROMPT.format(
+            return build_layered_messages(
+                TRANSPORT_AGENT_SUMMARY_TASK_PROMPT,
                 task=task,
                 origin=context.get('origin', '未知'),
                 destination=context.get('destination', '未知'),
@@ -689,7 +870,8 @@ class TransportSubAgent(BaseSubAgent):
                 num_results=len(previous_tool_results)
             )
         else:
-            return TRANSPORT_AGENT_QUERY_TASK_PROMPT.format(
+            return build_layered_messages(
+                TRANSPORT_AGENT_QUERY_TASK_PROMPT,
                 task=task,
                 origin=context.get('origin', '未知'),
                 destination=context.get('destination', '未知'),
@@ -698,6 +880,35 @@ class TransportSubAgent(BaseSubAgent):
                 tools_desc=tools_desc
             )
 
+    def validate_completion(
+        self,
+        task: str,
+        context: Dict[str, Any],
+        all_tool_messages: List[ToolMessage]
+    ) -> Optional[Dict[str, Any]]:
+        return validate_transport(task, context, all_tool_messages)
+
+    def condense_previous_results(
+        self,
+        task: str,
+        context: Dict[str, Any],
+        previous_tool_results: List[ToolMessage]
+    ) -> Optional[str]:
+        """车次/航班按偏好筛选排序后只保留前N条（见 utils/transport_ranking.py），其他工具结果原样附上"""
+        try:
+            ranked = rank_transport_options(previous_tool_results, context, top_n=TRANSPORT_RANKING_TOP_N)
+        except Exception as e:
+            logger.warning(f"  [{self.name}] 车次/航班排序失败，使用全部结果: {e}")
+            return None
+        if not ranked:
+            return None
+        others = [
+            f"[{msg.name}] 查询结果：\n{msg.content}"
+            for msg in previous_tool_results
+            if msg.name not in RANKED_TRANSPORT_TOOLS
+        ]
+        return "\n\n".join([ranked] + others)
+
 
 class MapSubAgent(BaseSubAgent):
     """地图子Agent：负责高德地图相关查询"""
@@ -710,28 +921,34 @@ class MapSubAgent(BaseSubAgent):
             agent_type="map"
         )
 
-    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> str:
-        tools_desc = "\n".join([
-            f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
-            f"{tool.description if hasattr(tool, 'description') else '无描述'}"
-            for tool in self.tools
-        ])
+    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> List[BaseMessage]:
+        tools_desc = self._tools_desc(self.select_tools(task))
 
         if previous_tool_results:
-            return MAP_AGENT_SUMMARY_TASK_PROMPT.format(
+            return build_layered_messages(
+                MAP_AGENT_SUMMARY_TASK_PROMPT,
                 task=task,
                 destination=context.get('destination', '未知'),
                 preferences=context.get('preferences', '未知'),
                 num_results=len(previous_tool_results)
             )
         else:
-            return MAP_AGENT_QUERY_TASK_PROMPT.format(
+            return build_layered_messages(
+                MAP_AGENT_QUERY_TASK_PROMPT,
                 task=task,
                 destination=context.get('destination', '未知'),
                 preferences=context.get('preferences', '未知'),
                 tools_desc=tools_desc
             )
 
+    def validate_completion(
+        self,
+        task: str,
+        context: Dict[str, Any],
+        all_tool_messages: List[ToolMessage]
+    ) -> Optional[Dict[str, Any]]:
+        return validate_pois(task, context, all_tool_messages)
+
 
 class SearchSubAgent(BaseSubAgent):
     """搜索子Agent：负责互联网搜索"""
@@ -744,22 +961,20 @@ class SearchSubAgent(BaseSubAgent):
             agent_type="search"
         )
 
-    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> str:
-        tools_desc = "\n".join([
-            f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
-            f"{tool.description if hasattr(tool, 'description') else '无描述'}"
-            for tool in self.tools
-        ])
+    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> List[BaseMessage]:
+        tools_desc = self._tools_desc(self.select_tools(task))
 
         if previous_tool_results:
-            return SEARCH_AGENT_SUMMARY_TASK_PROMPT.format(
+            return build_layered_messages(
+                SEARCH_AGENT_SUMMARY_TASK_PROMPT,
                 task=task,
                 destination=context.get('destination', '未知'),
                 preferences=context.get('preferences', '未知'),
                 num_results=len(previous_tool_results)
             )
         else:
-            return SEARCH_AGENT_QUERY_TASK_PROMPT.format(
+            return build_layered_messages(
+                SEARCH_AGENT_QUERY_TASK_PROMPT,
                 task=task,
                 destination=context.get('destination', '未知'),
                 origin=context.get('origin', '未知'),
@@ -783,20 +998,18 @@ class FileSubAgent(BaseSubAgent):
             agent_type="file"
         )
 
-    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> str:
-        tools_desc = "\n".join([
-            f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
-            f"{tool.description if hasattr(tool, 'description') else '无描述'}"
-            for tool in self.tools
-        ])
+    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> List[BaseMessage]:
+        tools_desc = self._tools_desc(self.select_tools(task))
 
         if previous_tool_results:
-            return FILE_AGENT_SUMMARY_TASK_PROMPT.format(
+            return build_layered_messages(
+                FILE_AGENT_SUMMARY_TASK_PROMPT,
                 task=task,
                 num_results=len(previous_tool_results)
             )
         else:
-            return FILE_AGENT_QUERY_TASK_PROMPT.format(
+            return build_layered_messages(
+                FILE_AGENT_QUERY_TASK_PROMPT,
                 task=task,
                 tools_desc=tools_desc
             )
@@ -813,15 +1026,12 @@ class WeatherSubAgent(BaseSubAgent):
             agent_type="weather"
         )
 
-    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> str:
-        tools_desc = "\n".join([
-            f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
-            f"{tool.description if hasattr(tool, 'description') else '无描述'}"
-            for tool in self.tools
-        ])
+    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> List[BaseMessage]:
+        tools_desc = self._tools_desc(self.select_tools(task))
 
         if previous_tool_results:
-            return WEATHER_AGENT_SUMMARY_TASK_PROMPT.format(
+            return build_layered_messages(
+                WEATHER_AGENT_SUMMARY_TASK_PROMPT,
                 task=task,
                 destination=context.get('destination', '未知'),
                 date=context.get('date', '未知'),
@@ -829,7 +1039,8 @@ class WeatherSubAgent(BaseSubAgent):
                 num_results=len(previous_tool_results)
             )
         else:
-            return WEATHER_AGENT_QUERY_TASK_PROMPT.format(
+            return build_layered_messages(
+                WEATHER_AGENT_QUERY_TASK_PROMPT,
                 task=task,
                 destination=context.get('destination', '未知'),
                 date=context.get('date', '未知'),
@@ -837,6 +1048,14 @@ class WeatherSubAgent(BaseSubAgent):
                 tools_desc=tools_desc
             )
 
+    def validate_completion(
+        self,
+        task: str,
+        context: Dict[str, Any],
+        all_tool_messages: List[ToolMessage]
+    ) -> Optional[Dict[str, Any]]:
+        return validate_weather(task, context, all_tool_messages)
+
 
 class HotelSubAgent(BaseSubAgent):
     """酒店子Agent：负责酒店查询"""
@@ -849,15 +1068,12 @@ class HotelSubAgent(BaseSubAgent):
             agent_type="hotel"
         )
 
-    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> str:
-        tools_desc = "\n".join([
-            f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
-            f"{tool.description if hasattr(tool, 'description') else '无描述'}"
-            for tool in self.tools
-        ])
+    def _build_prompt(self, task: str, context: Dict[str, Any], previous_tool_results: Optional[List[ToolMessage]] = None) -> List[BaseMessage]:
+        tools_desc = self._tools_desc(self.select_tools(task))
 
         if previous_tool_results:
-            return HOTEL_AGENT_SUMMARY_TASK_PROMPT.format(
+            return build_layered_messages(
+                HOTEL_AGENT_SUMMARY_TASK_PROMPT,
                 task=task,
                 destination=context.get('destination', '未知'),
                 date=context.get('date', '未知'),
@@ -867,7 +1083,8 @@ class HotelSubAgent(BaseSubAgent):
                 num_results=len(previous_tool_results)
             )
         else:
-            return HOTEL_AGENT_QUERY_TASK_PROMPT.format(
+            return build_layered_messages(
+                HOTEL_AGENT_QUERY_TASK_PROMPT,
                 task=task,
                 destination=context.get('destination', '未知'),
                 date=context.get('date', '未知'),
@@ -877,6 +1094,14 @@ class HotelSubAgent(BaseSubAgent):
                 tools_desc=tools_desc
             )
 
+    def validate_completion(
+        self,
+        task: str,
+        context: Dict[str, Any],
+        all_tool_messages: List[ToolMessage]
+    ) -> Optional[Dict[str, Any]]:
+        return validate_hotels(task, context, all_tool_messages)
+
 
 # 子 Agent 工厂函数
 async def create_sub_agents(
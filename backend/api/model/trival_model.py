@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Annotated, Optional, List, Dict, Any
+from config.api_config import FLEXIBLE_DATE_MAX_DAYS
 
 class TrivalFormat(BaseModel):
     date :Annotated[str,Field(description="用户的出发日期")]
@@ -9,6 +10,9 @@ class TrivalFormat(BaseModel):
     budget:Annotated[float,Field(description="用户的预算")]
     preferences:Annotated[str,Field(description="用户的兴趣偏好")]
     people:Annotated[int,Field(description="用户的出行人数")]
+    deadline_seconds:Annotated[Optional[float],Field(default=None,gt=0,description="截止时间（秒），超时后返回已完成部分的攻略")]
+    session_id:Annotated[Optional[str],Field(default=None,description="客户端生成的会话ID（可选），用于在返回前通过/cancel取消；已存在的会话ID返回409")]
+    flexible_days:Annotated[int,Field(default=0,ge=0,le=FLEXIBLE_DATE_MAX_DAYS,description="出发日期可以前后浮动的天数（弹性日期），大于0时先比较各日期的交通再为最合适的日期规划")]
 
 class InterventionResponseModel(BaseModel):
     """用户对人工介入的响应"""
@@ -19,7 +23,7 @@ class InterventionResponseModel(BaseModel):
 class TravelResponse(BaseModel):
     """旅游规划API响应"""
     session_id: str = Field(description="会话ID，用于后续恢复")
-    status: str = Field(description="状态: completed/need_intervention")
+    status: str = Field(description="状态: completed/need_intervention/partial/cancelled")
 
     # 如果需要人工介入
     need_intervention: bool = Field(default=False, description="是否需要人工介入")
@@ -30,6 +34,13 @@ class TravelResponse(BaseModel):
     replan: Optional[List[str]] = Field(default=None, description="优化后的规划")
     amusement_info: Optional[Dict[str, Any]] = Field(default=None, description="旅游攻略信息")
 
+    # 如果超过截止时间（status=partial）
+    incomplete_sections: Optional[List[str]] = Field(default=None, description="未完成的攻略板块（AmusementFormat字段名）")
+
+    # 弹性日期（flexible_days > 0）
+    selected_date: Optional[str] = Field(default=None, description="按交通比价选中的出发日期")
+    date_calendar: Optional[List[Dict[str, Any]]] = Field(default=None, description="各出发日期的交通价格/历时日历")
+
 class FeedbackRequestModel(BaseModel):
     """用户对旅游计划的反馈请求"""
     session_id: str = Field(description="会话ID")
@@ -1,13 +1,34 @@
 import uuid
+import asyncio
 import logging
 import json
 import os
-from typing import Dict, Any
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+from fastapi import HTTPException, Request, Header
 from fastapi.routing import APIRouter
 from .model.trival_model import TrivalFormat, InterventionResponseModel, TravelResponse, FeedbackRequestModel
 from agent.amusement_agent import get_graph
 from logging_config import setup_session_logging, cleanup_session_logging
 from langchain_core.messages import messages_to_dict, messages_from_dict, BaseMessage
+from utils.llm_usage import SessionUsage, set_session_usage, reset_session_usage
+from utils.session_budget import SessionBudget, set_session_budget, reset_session_budget
+from utils.partial_result import set_tool_collector, reset_tool_collector, build_partial_amusement_info, find_incomplete_sections
+from utils.run_control import (
+    RunCancelledError,
+    CANCEL_CLIENT_DISCONNECT,
+    CANCEL_USER_REQUEST,
+    get_run_registry,
+    get_cancellation_stats,
+)
+from utils.idempotency import get_travel_single_flight
+from utils.admission import AdmissionRejected, get_admission_controller
+from utils.completion_check import get_completion_check_stats
+from utils.code_index import get_code_index
+from utils.poi_store import get_poi_store
+from utils.date_fanout import search_date_calendar
+from utils.prefetch import start_prefetch, stop_prefetch, get_prefetch_stats
+from utils.mcp_manager import get_mcp_manager
+from config.api_config import DISCONNECT_POLL_SECONDS
 
 trival_route = APIRouter(tags=["trival"])
 logger = logging.getLogger(__name__)
@@ -88,6 +109,10 @@ def serialize_state(state: Dict[str, Any]) -> Dict[str, Any]:
                     message_objects = [m for m in messages if isinstance(m, BaseMessage)]
                     if message_objects:
                         serialized['messages'] = messages_to_dict(message_objects)
+                        # 工具原始输出（artifact）已保存在data/tool_executions中，会话存储只保留投影后的内容
+                        for message_dict in serialized['messages']:
+                            if message_dict.get('type') == 'tool':
+                                message_dict.get('data', {}).pop('artifact', None)
                     else:
                         # 如果全是字典，说明已经序列化，直接使用
                         serialized['messages'] = messages
@@ -194,12 +219,220 @@ def save_session_store(store: Dict[str, dict]):
         logger.error(f"保存会话存储到文件时出错: {e}")
         raise
 
+async def run_graph(
+    graph,
+    state: Dict[str, Any],
+    deadline_seconds: Optional[float] = None,
+    session_id: Optional[str] = None,
+    request: Optional[Request] = None,
+    priority: str = "travel",
+    before_graph: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+) -> Tuple[Dict[str, Any], Optional[List[str]]]:
+    """
+    执行工作流，并统计本次执行的LLM用量
+
+    用量在会话原有的 llm_usage 基础上累加（resume/feedback继续累计），写回 final_state["llm_usage"] 随会话保存；
+    每次执行使用一份新的会话预算（见 utils/session_budget.py），预算不足时各节点跳过可选工作。
+
+    设置了截止时间时，超时后取消正在执行的节点（子Agent的LLM调用和工具调用随之取消），
+    用最近一次完成的节点状态和已经拿到的工具结果生成部分攻略（见 utils/partial_result.py）。
+
+    提供session_id时，执行登记到 RunRegistry，可以通过 /cancel 取消；同时提供request时，
+    客户端断开连接后自动取消（见 utils/run_control.py）
+
+    执行前先经过准入控制（见 utils/admission.py）：并发执行数已满时按优先级排队，
+    排队期间同样可以被取消，截止时间也包含排队时间；队列已满时抛出 AdmissionRejected
+
+    Args:
+        graph: 工作流图
+        state: 输入状态
+        deadline_seconds: 截止时间（秒），None表示不限制
+        session_id: 会话ID
+        request: 当前HTTP请求（用于检测客户端断开连接）
+        priority: 排队优先级对应的请求类型（resume/feedback/travel）
+        before_graph: 准入后、graph执行前运行的准备步骤（可修改输入状态，如弹性日期比价），
+            与graph一样可以被取消、计入截止时间
+
+    Returns:
+        (执行后的状态, 未完成的板块列表)；未超时时未完成板块为None
+
+    Raises:
+        RunCancelledError: 执行被取消（客户端断开连接或用户主动取消）
+        AdmissionRejected: 排队已满
+    """
+    session_usage = SessionUsage.from_dict(state.get("llm_usage"))
+    session_budget = SessionBudget(deadline_seconds=deadline_seconds) if deadline_seconds else SessionBudget()
+    collected_tool_messages: List[BaseMessage] = []
+    latest_state: Dict[str, Any] = dict(state)
+    registry = get_run_registry()
+
+    async def _stream():
+        async with get_admission_controller().admit(priority):
+            if not deadline_seconds:
+                # 没有用户截止时间时，会话预算从准入后开始计时（用户截止时间包含排队时间）
+                session_budget.restart_clock()
+            if before_graph is not None:
+                await before_graph(state)
+                latest_state.update(state)
+            # stream_mode="values" 每个节点完成后输出完整状态，超时取消时保留最近一次的状态
+            async for values in graph.astream(state, stream_mode="values"):
+                latest_state.clear()
+                latest_state.update(values)
+
+    usage_token = set_session_usage(session_usage)
+    budget_token = set_session_budget(session_budget)
+    collector_token = set_tool_collector(collected_tool_messages)
+    # 先设置contextvar再创建任务，任务会继承这些统计对象
+    run_task = asyncio.create_task(_stream())
+    watcher = None
+    if session_id:
+        registry.register(session_id, run_task)
+        if request is not None:
+            watcher = asyncio.create_task(_watch_disconnect(request, session_id))
+
+    incomplete_sections = None
+    cancel_reason = None
+    try:
+        await asyncio.wait_for(run_task, timeout=deadline_seconds)
+        final_state = latest_state
+    except asyncio.TimeoutError:
+        logger.warning(f"⚠️ 工作流超过截止时间（{deadline_seconds}秒），已取消，使用已有结果生成部分攻略")
+        final_state, incomplete_sections = _build_partial_state(latest_state, collected_tool_messages)
+    except asyncio.CancelledError:
+        cancel_reason = registry.unregister(session_id, run_task) if session_id else None
+        if cancel_reason is None:
+            raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if session_id and cancel_reason is None:
+            registry.unregister(session_id, run_task)
+        reset_tool_collector(collector_token)
+        reset_session_budget(budget_token)
+        reset_session_usage(usage_token)
+        logger.info(f"【LLM用量】{session_usage.summary_text()}")
+        logger.info(f"【会话预算】{session_budget.to_dict()}")
+
+    run_cost = {
+        "llm_calls": session_budget.llm_calls,
+        "tokens": session_budget.tokens,
+        "seconds": session_budget.elapsed(),
+        "tool_calls": len(collected_tool_messages),
+    }
+    if cancel_reason is not None:
+        saved = get_cancellation_stats().record_cancelled(cancel_reason, run_cost)
+        logger.warning(
+            f"⚠️ 【取消执行】会话 {session_id} 已取消（{cancel_reason}），已花费 {run_cost}，"
+            f"估计节省 LLM调用{saved['llm_calls']:.1f}次、token {saved['tokens']:.0f}、耗时{saved['seconds']:.1f}s、工具调用{saved['tool_calls']:.1f}次"
+        )
+        raise RunCancelledError(session_id, cancel_reason)
+    if incomplete_sections is None:
+        get_cancellation_stats().record_completed(run_cost)
+
+    final_state["llm_usage"] = session_usage.to_dict()
+    return final_state, incomplete_sections
+
+async def _watch_disconnect(request: Request, session_id: str):
+    """轮询客户端连接状态，断开后取消会话的执行"""
+    while True:
+        if await request.is_disconnected():
+            logger.warning(f"⚠️ 客户端已断开连接，取消会话 {session_id} 的执行")
+            get_run_registry().cancel(session_id, CANCEL_CLIENT_DISCONNECT)
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+def _build_partial_state(latest_state: Dict[str, Any], collected_tool_messages: List[BaseMessage]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    超时后生成部分结果：已有攻略（如补充循环中已经完成过replan）直接使用，否则由工具结果拼出攻略
+
+    Args:
+        latest_state: 最近一次完成的节点输出的状态
+        collected_tool_messages: 正在执行的节点中已经完成的工具调用结果
+
+    Returns:
+        (部分结果状态, 未完成的板块列表)
+    """
+    partial_state = dict(latest_state)
+    messages = list(partial_state.get("messages") or [])
+    known_ids = {id(msg) for msg in messages}
+    new_tool_messages = [msg for msg in collected_tool_messages if id(msg) not in known_ids]
+    partial_state["messages"] = messages + new_tool_messages
+
+    amusement_info = partial_state.get("amusement_info")
+    if hasattr(amusement_info, "model_dump"):
+        amusement_info = amusement_info.model_dump()
+    if amusement_info:
+        incomplete_sections = find_incomplete_sections(amusement_info)
+    else:
+        amusement_info, incomplete_sections = build_partial_amusement_info(partial_state, partial_state["messages"])
+
+    partial_state["amusement_info"] = amusement_info
+    partial_state["need_intervention"] = False
+    partial_state["intervention_request"] = None
+    return partial_state, incomplete_sections
+
+def _admission_rejected(error: AdmissionRejected) -> HTTPException:
+    """排队已满时的429响应（Retry-After为估算的重试等待时间）"""
+    logger.warning(f"⚠️ {error}")
+    logger.info("=" * 80)
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+def _cancelled_response(error: RunCancelledError) -> TravelResponse:
+    """执行被取消时的响应（会话状态保持执行前的样子，不保存中间结果）"""
+    logger.warning(f"⚠️ {error}")
+    logger.info("=" * 80)
+    return TravelResponse(session_id=error.session_id, status="cancelled")
+
 @trival_route.post("/travel", response_model=TravelResponse)
-async def travel(data: TrivalFormat):
+async def travel(
+    data: TrivalFormat,
+    request: Request,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")
+):
     """
     开始旅游规划流程
     如果需要人工介入，返回intervention_request并暂停
     否则返回完整的旅游规划结果
+
+    重复提交（相同的Idempotency-Key请求头，或幂等窗口内相同的请求内容）复用同一次执行，返回同一个会话
+    """
+    single_flight = get_travel_single_flight()
+    key = single_flight.make_key(idempotency_key, data.model_dump(exclude={"session_id", "deadline_seconds"}))
+    flight = single_flight.get(key)
+    if flight is not None:
+        logger.info(
+            f"【API /travel】重复提交（{'Idempotency-Key' if idempotency_key else '相同请求内容'}），"
+            f"复用会话 {flight.session_id} 的执行（该执行已被复用{flight.joined}次）"
+        )
+    else:
+        # 生成会话ID（客户端可以自带会话ID，以便在返回前通过/cancel取消）
+        session_id = data.session_id or str(uuid.uuid4())
+        if data.session_id and (
+            session_id in load_session_store()
+            or get_run_registry().is_running(session_id)
+            or single_flight.session_in_use(session_id)
+        ):
+            # 自带的会话ID已被使用：拒绝，避免覆盖其他会话保存的状态
+            logger.warning(f"⚠️ 【API /travel】会话ID {session_id} 已存在，拒绝请求")
+            raise HTTPException(status_code=409, detail=f"会话ID {session_id} 已存在，请使用新的会话ID或不提供会话ID")
+        flight = single_flight.start(key, session_id, _run_travel(data, session_id))
+
+    response = await single_flight.wait(flight, request)
+    if response is None:
+        # 当前客户端已断开，响应不会被读取
+        return TravelResponse(session_id=flight.session_id, status="cancelled")
+    return response
+
+async def _run_travel(data: TrivalFormat, session_id: str) -> TravelResponse:
+    """
+    执行一次新的旅游规划（由 /travel 的共享执行调用）
+
+    Args:
+        data: 请求内容
+        session_id: 会话ID
+
+    Returns:
+        TravelResponse
     """
     logger.info("=" * 80)
     logger.info("【API /travel】收到新的旅游规划请求")
@@ -208,8 +441,6 @@ async def travel(data: TrivalFormat):
     logger.debug(f"用户偏好: {data.preferences}")
 
     try:
-        # 生成会话ID
-        session_id = str(uuid.uuid4())
         logger.info(f"✓ 创建新会话: {session_id}")
 
         # 为该会话创建独立的日志文件
@@ -238,11 +469,47 @@ async def travel(data: TrivalFormat):
         }
         logger.debug(f"初始状态已构建")
 
+        tools = [tool for server_tools in get_mcp_manager().get_tools_by_server().values() for tool in server_tools]
+
+        date_fields = {}
+        prefetch_tasks = []
+
+        async def _before_graph(state: Dict[str, Any]):
+            """
+            在准入后、可取消且受截止时间限制的执行中，于graph之前运行：
+            弹性日期先并发比较前后几天的交通，只为选中的日期执行规划流程；
+            然后开始推测性预取（plan的LLM调用期间先查询天气、去程车票和酒店写入工具缓存，子Agent的相同调用直接命中）
+            """
+            if data.flexible_days:
+                calendar = await search_date_calendar(
+                    data.origin,
+                    data.destination,
+                    data.date,
+                    data.flexible_days,
+                    tools=tools,
+                    preferences=data.preferences,
+                    budget=data.budget,
+                    people=data.people
+                )
+                if calendar is not None:
+                    state["date"] = calendar["selected_date"]
+                    date_fields.update(selected_date=calendar["selected_date"], date_calendar=calendar["calendar"])
+                    logger.info(f"弹性日期：出发日期 {data.date} → {calendar['selected_date']}")
+            prefetch_tasks.append(start_prefetch(state, tools, session_id))
+
         # 获取并执行graph
         logger.info("正在获取工作流图...")
         graph = await get_graph()
         logger.info("🚀 开始执行旅游规划流程...")
-        final_state = await graph.ainvoke(initial_state)
+        try:
+            # 客户端断开由共享执行统一检测（所有等待的客户端都断开后才取消），这里不传request
+            final_state, incomplete_sections = await run_graph(
+                graph, initial_state, deadline_seconds=data.deadline_seconds, session_id=session_id, priority="travel",
+                before_graph=_before_graph
+            )
+        finally:
+            for prefetch in prefetch_tasks:
+                await stop_prefetch(prefetch)
         logger.info("✅ 工作流执行完成")
 
         # 保存会话状态
@@ -268,7 +535,8 @@ async def travel(data: TrivalFormat):
                 session_id=session_id,
                 status="need_intervention",
                 need_intervention=True,
-                intervention_request=intervention_req
+                intervention_request=intervention_req,
+                **date_fields
             )
             logger.info(f"✓ 返回人工介入响应，等待用户通过/resume接口继续")
             logger.info("=" * 80)
@@ -347,18 +615,39 @@ async def travel(data: TrivalFormat):
             logger.info(f"优化规划步骤数: {len(replan_list) if replan_list else 0}")
             logger.info(f"攻略信息: {'已生成' if amusement_info_dict else '未生成'}")
 
+            if incomplete_sections is not None:
+                # 超过截止时间：返回部分结果，并标出未完成的板块
+                response = TravelResponse(
+                    session_id=session_id,
+                    status="partial",
+                    need_intervention=False,
+                    plan=plan_list,
+                    replan=replan_list,
+                    amusement_info=amusement_info_dict,
+                    incomplete_sections=incomplete_sections,
+                    **date_fields
+                )
+                logger.info(f"✓ 返回部分旅游规划结果，未完成板块: {incomplete_sections}")
+                logger.info("=" * 80)
+                return response
+
             response = TravelResponse(
                 session_id=session_id,
                 status="completed",
                 need_intervention=False,
                 plan=plan_list,
                 replan=replan_list,
-                amusement_info=amusement_info_dict
+                amusement_info=amusement_info_dict,
+                **date_fields
             )
             logger.info("✓ 返回完整旅游规划结果")
             logger.info("=" * 80)
             return response
 
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    except RunCancelledError as e:
+        return _cancelled_response(e)
     except Exception as e:
         logger.error("=" * 80)
         logger.error(f"❌ 执行旅游规划时出错: {str(e)}")
@@ -368,7 +657,7 @@ async def travel(data: TrivalFormat):
         raise
 
 @trival_route.post("/resume", response_model=TravelResponse)
-async def resume_travel(data: InterventionResponseModel):
+async def resume_travel(data: InterventionResponseModel, request: Request):
     """
     恢复被人工介入暂停的旅游规划流程
     接收用户的响应并继续执行
@@ -415,7 +704,7 @@ async def resume_travel(data: InterventionResponseModel):
 
         # 重新执行（从plan或replan继续）
         logger.info(f"🚀 从 {intervention_stage} 阶段恢复执行...")
-        final_state = await graph.ainvoke(state)
+        final_state, _ = await run_graph(graph, state, session_id=session_id, request=request, priority="resume")
         logger.info("✅ 恢复执行完成")
 
         # 更新会话状态
@@ -531,6 +820,10 @@ async def resume_travel(data: InterventionResponseModel):
             logger.info("=" * 80)
             return response
 
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    except RunCancelledError as e:
+        return _cancelled_response(e)
     except Exception as e:
         logger.error("=" * 80)
         logger.error(f"❌ 恢复会话时出错: {str(e)}")
@@ -540,7 +833,7 @@ async def resume_travel(data: InterventionResponseModel):
         raise
 
 @trival_route.post("/feedback", response_model=TravelResponse)
-async def submit_feedback(data: FeedbackRequestModel):
+async def submit_feedback(data: FeedbackRequestModel, request: Request):
     """
     接收用户对已完成的旅游计划的反馈
     根据反馈调整计划并返回新的结果
@@ -595,7 +888,7 @@ async def submit_feedback(data: FeedbackRequestModel):
 
         # 重新执行工作流（反馈调整模式）
         logger.info("🚀 开始执行反馈调整流程...")
-        final_state = await graph.ainvoke(state)
+        final_state, _ = await run_graph(graph, state, session_id=session_id, request=request, priority="feedback")
         logger.info("✅ 反馈调整执行完成")
 
         # 更新会话状态
@@ -664,10 +957,78 @@ async def submit_feedback(data: FeedbackRequestModel):
             logger.info("=" * 80)
             return response
 
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    except RunCancelledError as e:
+        return _cancelled_response(e)
     except Exception as e:
         logger.error("=" * 80)
         logger.error(f"❌ 处理反馈时出错: {str(e)}")
         logger.error(f"错误类型: {type(e).__name__}")
         logger.exception("完整错误堆栈:")
         logger.error("=" * 80)
-        raise
\ No newline at end of file
+        raise
+@trival_route.get("/usage/{session_id}")
+async def get_session_usage_stats(session_id: str):
+    """
+    查询会话的LLM用量统计
+    返回总计、按节点、按子Agent的调用次数、token用量（输入/输出/缓存命中/推理）和耗时
+    """
+    store = load_session_store()
+    if session_id not in store:
+        logger.warning(f"⚠️ 查询用量失败，会话 {session_id} 不存在或已过期")
+        raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在或已过期")
+
+    usage = store[session_id].get("llm_usage") or SessionUsage().to_dict()
+    return {"session_id": session_id, **usage}
+
+@trival_route.post("/cancel/{session_id}")
+async def cancel_session_run(session_id: str):
+    """
+    取消会话正在执行的规划流程（/travel、/resume、/feedback）
+    被取消的请求返回 status=cancelled，会话状态保持执行前的样子
+    """
+    cancelled = get_run_registry().cancel(session_id, CANCEL_USER_REQUEST)
+    if not cancelled:
+        logger.info(f"会话 {session_id} 没有正在执行的流程，无需取消")
+    return {"session_id": session_id, "cancelled": cancelled}
+
+@trival_route.get("/metrics/cancellation")
+async def get_cancellation_metrics():
+    """
+    查询取消执行的统计
+    包括完整执行的平均开销、取消次数（按原因）、取消前已花费的开销和估计节省的开销
+    """
+    return get_cancellation_stats().summary()
+
+@trival_route.get("/metrics/admission")
+async def get_admission_metrics():
+    """
+    查询准入控制的状态
+    包括正在执行和排队中的请求数、上限、被拒绝的次数和平均执行耗时
+    """
+    return get_admission_controller().summary()
+
+@trival_route.get("/metrics/completion-checks")
+async def get_completion_check_metrics():
+    """
+    查询子Agent任务完成度检查的统计
+    包括LLM检查次数、本地校验/复用省掉的次数、与下一轮重叠执行和被丢弃的预先检查次数（总计和按子Agent）
+    """
+    return get_completion_check_stats().summary()
+
+@trival_route.get("/metrics/local-index")
+async def get_local_index_metrics():
+    """
+    查询本地索引的状态
+    包括车站/机场代码索引和POI/地理编码存储的条目数、命中与未命中次数
+    """
+    return {"code_index": get_code_index().summary(), "poi_store": get_poi_store().summary()}
+
+@trival_route.get("/metrics/prefetch")
+async def get_prefetch_metrics():
+    """
+    查询推测性预取的统计
+    包括预取次数、被子Agent用到和浪费的次数（总计和按工具）、因已有缓存跳过、失败和取消的次数
+    """
+    return get_prefetch_stats().summary()
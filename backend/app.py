@@ -5,11 +5,14 @@ from fastapi.responses import FileResponse
 from contextlib import asynccontextmanager
 import uvicorn
 import os
+import asyncio
 import logging
 
 from api.trival import trival_route
 from logging_config import setup_logging
 from utils.mcp_manager import initialize_mcp_manager
+from utils.code_index import refresh_code_index_periodically
+from utils.poi_store import get_poi_store
 
 # 初始化日志系统
 setup_logging()
@@ -35,6 +38,11 @@ async def lifespan(_app: FastAPI):
     else:
         logger.warning("⚠️ MCP初始化失败，系统将在无MCP工具的情况下运行")
 
+    # 加载车站代码/机场代码索引，并在后台定时刷新
+    code_index_refresher = asyncio.create_task(refresh_code_index_periodically())
+    # 预先加载POI/地理编码存储（过期数据在使用时后台刷新）
+    await asyncio.to_thread(get_poi_store().load)
+
     logger.info("=" * 80)
     logger.info("【应用启动】初始化完成，服务已就绪")
     logger.info("=" * 80)
@@ -43,6 +51,9 @@ async def lifespan(_app: FastAPI):
 
     # 关闭时执行（如果需要清理资源）
     logger.info("应用关闭中...")
+    code_index_refresher.cancel()
+    # 写入POI存储中还没有保存的修改
+    await asyncio.to_thread(get_poi_store().flush)
 
 app = FastAPI(title="旅游助手", lifespan=lifespan)
 
@@ -53,6 +64,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # 允许所有请求方法，如 GET、POST、PUT、DELETE
     allow_headers=["*"],  # 允许所有请求头
+    expose_headers=["Retry-After"],  # 429响应的重试等待时间需要暴露给前端
 )
 
 # 注册API路由
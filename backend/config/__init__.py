@@ -1,10 +1,20 @@
 from .mcp import trival_mcp_config,  mcp_to_agent_mapping
-from .sub_agent_config import SUB_AGENT_MAX_ROUNDS, DEFAULT_MAX_ROUNDS, get_max_rounds
+from .sub_agent_config import SUB_AGENT_MAX_ROUNDS, DEFAULT_MAX_ROUNDS, get_max_rounds, get_tool_top_k
+from .context_config import CONTEXT_TOKEN_BUDGETS, DEFAULT_CONTEXT_TOKEN_BUDGET, get_context_budget
+from .budget_config import SESSION_DEADLINE_SECONDS, SESSION_MAX_LLM_CALLS, SESSION_MAX_TOKENS, BUDGET_RESERVE
 
 __all__ = [
     "trival_mcp_config",
     "mcp_to_agent_mapping",
     "SUB_AGENT_MAX_ROUNDS",
     "DEFAULT_MAX_ROUNDS",
-    "get_max_rounds"
-]
\ No newline at end of file
+    "get_max_rounds",
+    "get_tool_top_k",
+    "CONTEXT_TOKEN_BUDGETS",
+    "DEFAULT_CONTEXT_TOKEN_BUDGET",
+    "get_context_budget",
+    "SESSION_DEADLINE_SECONDS",
+    "SESSION_MAX_LLM_CALLS",
+    "SESSION_MAX_TOKENS",
+    "BUDGET_RESERVE"
+]
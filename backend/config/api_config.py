@@ -0,0 +1,61 @@
+"""
+API层配置文件
+用于配置请求去重（幂等）、客户端断开检测、准入控制和弹性日期等参数
+"""
+
+# 检测客户端断开连接的轮询间隔（秒）
+DISCONNECT_POLL_SECONDS = 1.0
+
+# /travel 幂等窗口（秒）：窗口内相同 Idempotency-Key 的重复提交复用同一次执行的结果
+# （按请求内容识别的重复提交只在执行中和完成后的 IDEMPOTENCY_ABANDON_GRACE_SECONDS 内复用）
+IDEMPOTENCY_WINDOW_SECONDS = 600
+
+# 所有等待同一次执行的客户端都断开后，再等待多久才取消执行（秒）
+# 前端超时重试时，旧连接断开和新请求到达之间有短暂间隔，宽限期内到达的重试可以直接复用执行
+IDEMPOTENCY_ABANDON_GRACE_SECONDS = 10
+
+# ========================================
+# 准入控制（见 utils/admission.py）
+# ========================================
+
+# 同时执行规划流程的最大会话数（各会话共享LLM和MCP配额，同时执行太多会让所有会话都变慢）
+ADMISSION_MAX_ACTIVE_SESSIONS = 4
+
+# 排队等待的最大请求数，超出时返回429
+ADMISSION_MAX_QUEUE = 16
+
+# 排队优先级（数值越小越优先）：正在等待人工介入结果的用户（resume）优先于反馈调整，新的规划请求最后
+ADMISSION_PRIORITIES = {
+    "resume": 0,
+    "feedback": 1,
+    "travel": 2,
+}
+
+# 429响应的Retry-After（秒）：还没有执行耗时统计时使用该值，之后按平均执行耗时和排队长度估算
+ADMISSION_DEFAULT_RETRY_AFTER_SECONDS = 30
+
+# ========================================
+# 弹性日期（见 utils/date_fanout.py）
+# ========================================
+
+# /travel 的 flexible_days 上限：最多在出发日期前后各这么多天内比较交通
+FLEXIBLE_DATE_MAX_DAYS = 3
+
+# 同时查询的日期数（12306/航班接口有频率限制）
+FLEXIBLE_DATE_CONCURRENCY = 3
+
+# 两次查询发起之间的最小间隔（秒）
+FLEXIBLE_DATE_MIN_INTERVAL_SECONDS = 0.3
+
+# 弹性日期查询的总超时（秒），超时未返回的日期不参与比较
+FLEXIBLE_DATE_TIMEOUT_SECONDS = 30
+
+# ========================================
+# 推测性预取（见 utils/prefetch.py）
+# ========================================
+
+# 是否在 /travel 入口与plan并发预取目的地天气、去程车票和目的地酒店
+PREFETCH_ENABLED = True
+
+# 预取的总超时（秒）
+PREFETCH_TIMEOUT_SECONDS = 30
@@ -0,0 +1,26 @@
+"""
+会话预算配置文件
+限制单次请求（/travel、/resume、/feedback 各自一次graph执行）的总耗时、LLM调用次数和token用量，
+避免max_rounds、额外轮次、zhipu_search补全、补充循环叠加后出现过长的尾延迟
+"""
+
+# 单次执行的最长耗时（秒）
+SESSION_DEADLINE_SECONDS = 300
+
+# 单次执行的最大LLM调用次数
+SESSION_MAX_LLM_CALLS = 60
+
+# 单次执行的最大token用量（输入 + 输出）
+SESSION_MAX_TOKENS = 400000
+
+# 为replan预留的预算：剩余预算低于预留值时视为"预算不足"，
+# 跳过可选工作（子Agent后续轮次、额外轮次、zhipu_search补全、剩余查询任务、补充循环），直接用已有结果生成攻略
+BUDGET_RESERVE = {
+    "seconds": 90,
+    "llm_calls": 3,
+    "tokens": 50000,
+}
+
+# 时间预留最多占截止时间的比例：用户给出较短的 deadline_seconds 时按比例缩小预留，
+# 避免截止时间小于固定预留（90s）时从一开始就判定为预算不足、跳过全部查询任务
+BUDGET_RESERVE_MAX_DEADLINE_RATIO = 0.3
@@ -0,0 +1,83 @@
+"""
+上下文压缩配置文件
+用于配置各节点消息历史的token预算，以及每类消息在预算中的占比
+token数均为本地估算值（见 utils/token_counter.py），不依赖模型服务
+"""
+
+# 各节点传给LLM的消息历史token预算
+# 无论执行了多少次工具调用，进入prompt的消息历史都不会超过这里的预算
+CONTEXT_TOKEN_BUDGETS = {
+    # 正常规划：只需要知道大致的历史和已查询到的信息
+    "plan": 6000,
+    # 反馈模式规划：与原计划隔离，只需要很少的历史
+    "plan_feedback": 2500,
+    # 重新规划：需要基于工具结果生成完整攻略，预算最大
+    "replan": 24000,
+    # 反馈模式重新规划：原始攻略单独传入，历史消息预算可以小一些
+    "replan_feedback": 16000,
+}
+
+# 默认预算（当某个节点未在上面配置时使用）
+DEFAULT_CONTEXT_TOKEN_BUDGET = 8000
+
+# 每类消息在预算中的占比
+# tool: 工具调用结果；summary: 历史对话总结；剩余部分（0.3）给其他消息（模型回复、用户回答等）
+MESSAGE_TYPE_BUDGET_RATIOS = {
+    "tool": 0.6,
+    "summary": 0.1,
+}
+
+# 单条工具消息的token上限，超过则压缩（保留开头和结尾）
+TOOL_MESSAGE_MAX_TOKENS = 1500
+
+# 单条工具消息压缩后的最小保留token数，预算不足时宁可丢弃最旧的工具消息，也不把每条都压缩到无意义
+TOOL_MESSAGE_MIN_TOKENS = 120
+
+# 单条非工具消息的token上限
+OTHER_MESSAGE_MAX_TOKENS = 800
+
+# 送入总结LLM的旧消息token上限
+SUMMARY_INPUT_MAX_TOKENS = 4000
+
+
+def get_context_budget(node: str) -> int:
+    """
+    获取指定节点的消息历史token预算
+
+    Args:
+        node: 节点名称 (plan/plan_feedback/replan/replan_feedback)
+
+    Returns:
+        该节点配置的token预算
+    """
+    return CONTEXT_TOKEN_BUDGETS.get(node, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+# ========================================
+# 工具结果检索配置（见 utils/retrieval_index.py）
+# ========================================
+
+# replan按行程板块检索工具结果时，每个板块返回的片段数
+RETRIEVAL_TOP_K_PER_SECTION = 8
+
+# replan检索时不参与检索、按结构化表格压缩后完整保留的工具结果类型（车次、航班、酒店的每一行都可能被选用，
+# 板块查询漏掉的行不能丢）
+RETRIEVAL_FULL_CONTEXT_ENTITIES = ("train", "flight", "hotel")
+
+# 子Agent总结任务：工具结果超过该token数时才按任务检索，否则直接使用全部结果
+RETRIEVAL_SUMMARY_TASK_MIN_TOKENS = 6000
+
+# 子Agent总结任务检索结果的token上限
+RETRIEVAL_SUMMARY_TASK_MAX_TOKENS = 5000
+
+# 可以从 data/tool_executions 历史记录中复用的工具（结果不随日期变化，如POI信息）
+RETRIEVAL_HISTORY_TOOLS = [
+    "maps_text_search",
+    "maps_around_search",
+    "maps_search_detail",
+    "maps_geo",
+    "zhipu_search",
+]
+
+# 历史记录的最大有效天数，超过则不再加入检索索引
+RETRIEVAL_HISTORY_MAX_AGE_DAYS = 30
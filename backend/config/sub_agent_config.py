@@ -27,6 +27,41 @@ SUB_AGENT_MAX_ROUNDS = {
 # 默认最大轮次（当某个agent类型未在上面配置时使用）
 DEFAULT_MAX_ROUNDS = 3
 
+# 每次任务绑定给子Agent的工具数量上限（按任务内容挑选最相关的工具，见 utils/tool_selector.py）
+# 工具数不超过该值的Agent会绑定全部工具
+SUB_AGENT_TOOL_TOP_K = {
+    # 交通助手：12306 + 航班工具较多，需要同时保留车站代码、日期等前置工具
+    "transport": 4,
+
+    # 地图助手：高德工具最多（搜索、路线、地理编码等），每次任务通常只用到其中几个
+    "map": 4,
+
+    # 酒店助手
+    "hotel": 3,
+}
+
+# 默认工具数量上限（当某个agent类型未在上面配置时使用）
+DEFAULT_TOOL_TOP_K = 5
+
+# 工具的前置/配套工具：选中左侧工具时同时绑定右侧工具
+TOOL_COMPANIONS = {
+    "get-tickets": ["get-station-code-of-citys", "get-current-date"],
+    "get-interline-tickets": ["get-station-code-of-citys", "get-current-date"],
+    "maps_direction_driving": ["maps_geo"],
+    "maps_direction_walking": ["maps_geo"],
+    "maps_direction_transit_integrated": ["maps_geo"],
+    "maps_bicycling": ["maps_geo"],
+    "maps_around_search": ["maps_geo"],
+    "maps_search_detail": ["maps_text_search"],
+}
+
+# 查询任务每轮工具调用完成后，在发起下一轮LLM调用的同时预先检查任务完成度（见 utils/completion_check.py）
+# 下一轮不再调用工具时直接使用检查结论，节省一次串行的LLM调用耗时；下一轮继续调用工具时丢弃（会多花一次检查的token）
+COMPLETION_CHECK_OVERLAP = True
+
+# 交通助手总结任务：车次/航班按用户偏好筛选排序后，每个方向、每个日期只保留前N条（见 utils/transport_ranking.py）
+TRANSPORT_RANKING_TOP_N = 10
+
 # Replan → Execute 补充循环的最大次数
 # 当Replan发现数据缺失时，会生成补充任务让Execute执行
 # 这个参数限制了这种补充循环的最大次数，避免无限循环
@@ -44,3 +79,16 @@ def get_max_rounds(agent_type: str) -> int:
         该Agent类型配置的最大轮次数
     """
     return SUB_AGENT_MAX_ROUNDS.get(agent_type, DEFAULT_MAX_ROUNDS)
+
+
+def get_tool_top_k(agent_type: str) -> int:
+    """
+    获取指定类型子Agent每次任务绑定的工具数量上限
+
+    Args:
+        agent_type: 子Agent类型 (transport/map/search/file/weather/hotel)
+
+    Returns:
+        该Agent类型配置的工具数量上限
+    """
+    return SUB_AGENT_TOOL_TOP_K.get(agent_type, DEFAULT_TOOL_TOP_K)
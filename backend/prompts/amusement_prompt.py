@@ -936,6 +936,26 @@ SUMMARY_PROMPT = """
 关键信息总结：
 """
 
+# 滚动总结提示词：只把新移出上下文窗口的消息合并进已有总结
+ROLLING_SUMMARY_PROMPT = """
+你是一个专业的对话历史总结助手。下面是之前对话的总结，以及之后新产生的对话内容，请将新内容合并进总结。
+
+要求：
+1. 保留已有总结中的所有偏好、选择、数字、日期、地点等关键信息
+2. 将新对话中的关键信息补充进去，与已有信息冲突时以新信息为准
+3. 保留用户的关键决策和确认
+4. 用简洁的列表形式输出，便于后续参考
+5. 如果有重复信息，只保留最新的
+
+已有总结：
+{previous_summary}
+
+新增对话：
+{new_messages_text}
+
+更新后的关键信息总结：
+"""
+
 # ========================================
 # 子Agent Prompts
 # ========================================
@@ -1077,6 +1097,13 @@ EXTRA_TOOL_CALL_GUIDANCE_PROMPT = """**任务完成度检查结果**：任务尚
 3. 如果之前的工具调用失败或结果不完整，可以尝试使用不同的参数或其他工具
 """
 
+# 查询任务的前置信息（见 utils/tool_chain.py，追加在查询任务提示词的末尾）
+TOOL_PREREQUISITE_RESULTS_PROMPT = """
+
+**已预先查询的前置信息**（已经是真实的工具结果，不需要再调用对应的前置工具，请直接调用最终的查询工具）：
+{prerequisite_results}
+"""
+
 # ========================================
 # 各个子Agent的特定Prompt（覆盖基础模板）
 # ========================================
@@ -1736,4 +1763,21 @@ SYSYRM_REPLAN_FEEDBACK_TEMPLATE = """
 - "其他部分（交通、景点）保持不变"
 
 现在开始执行调整任务。
-"""
\ No newline at end of file
+"""
+# ========================================
+# Replan 阶段本地预先计算的结果
+# ========================================
+
+# 每日行程骨架（见 utils/itinerary_optimizer.py）
+ITINERARY_SKELETON_PROMPT = """【每日行程骨架（已按景点坐标在本地预先求解）】
+景点已按地理位置分到每一天，并排好了游览顺序（路程最短）；相邻景点之间的交通方式和时间来自高德路线规划，标注"直线估算"的为按直线距离估算的值。
+生成 daily_itinerary 和 path 时请直接沿用这里的分天和顺序，在此基础上安排餐饮、休息和游玩描述，不需要再自行推算景点顺序和路线：
+{skeleton}
+"""
+
+# 预算方案（见 utils/budget_optimizer.py）
+BUDGET_PLAN_PROMPT = """【预算方案（已用查到的票价、房价在本地计算）】
+以下交通和酒店组合是在预算内体验最好的选择，各项金额已经算好且相加一致。
+生成 budget_breakdown 时请直接使用这里的金额（不要重新计算），交通和住宿推荐优先采用这里选中的车次/航班和酒店：
+{budget_plan}
+"""
@@ -0,0 +1,105 @@
+"""
+Prompt组装缓存的微基准测试
+对比每次调用都重新构建 JsonOutputParser + 格式说明 + 分层ChatPromptTemplate（原实现）与使用 utils/prompt_cache.py 的耗时，
+以及子Agent/协调器每次调用 build_layered_messages 时拆分模板（有无 split_template 缓存）的耗时
+
+运行方式（在backend目录下）：
+    python scripts/bench_prompt_cache.py
+"""
+import os
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from formatters.amusement_format import PlanWithIntervention, ReplanWithIntervention
+from prompts import AMUSEMENT_SYSTEM_PLAN_TEMPLATE, AMUSEMENT_SYSYRM_REPLAN_TEMPLATE, AMUSEMENT_COORDINATOR_TASK_DISPATCH_TEMPLATE
+from utils.prompt_cache import get_chat_prompt_template
+from utils.prompt_layout import split_template, build_layered_messages
+
+ITERATIONS = 200
+_PLACEHOLDER_RE = re.compile(r"(?<!\{)\{(\w+)\}(?!\})")
+
+
+def build_uncached():
+    """原实现：每次调用都重新创建parser、生成格式说明、拆分模板并创建ChatPromptTemplate"""
+    for template, model in (
+        (AMUSEMENT_SYSTEM_PLAN_TEMPLATE, PlanWithIntervention),
+        (AMUSEMENT_SYSYRM_REPLAN_TEMPLATE, ReplanWithIntervention),
+    ):
+        parser = JsonOutputParser(pydantic_object=model)
+        static_template, dynamic_template = split_template.__wrapped__(template)
+        ChatPromptTemplate.from_messages([
+            ("system", static_template),
+            ("human", dynamic_template),
+        ]).partial(json_format=parser.get_format_instructions())
+
+
+def build_cached():
+    """缓存实现（与 plan/replan 节点的调用方式一致）"""
+    for template, model in (
+        (AMUSEMENT_SYSTEM_PLAN_TEMPLATE, PlanWithIntervention),
+        (AMUSEMENT_SYSYRM_REPLAN_TEMPLATE, ReplanWithIntervention),
+    ):
+        get_chat_prompt_template(template, pydantic_object=model)
+
+
+def layered_uncached(template, values):
+    """每次调用都重新拆分模板"""
+    static_template, dynamic_template = split_template.__wrapped__(template)
+    return [
+        SystemMessage(content=static_template.format(**values)),
+        HumanMessage(content=dynamic_template.format(**values)),
+    ]
+
+
+def build_tools_desc(tools):
+    """原实现：每轮拼接工具描述"""
+    return "\n".join([
+        f"- {tool.name if hasattr(tool, 'name') else str(tool)}: "
+        f"{tool.description if hasattr(tool, 'description') else '无描述'}"
+        for tool in tools
+    ])
+
+
+def bench(name, func, iterations=ITERATIONS):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = (time.perf_counter() - start) / iterations * 1000
+    print(f"{name:<40} {elapsed:8.3f} ms/次")
+    return elapsed
+
+
+if __name__ == "__main__":
+    print(f"迭代次数: {ITERATIONS}（plan + replan 各构建一次为一次迭代）")
+    before = bench("无缓存 parser+格式说明+分层模板", build_uncached)
+    build_cached()  # 预热缓存
+    after = bench("缓存 get_chat_prompt_template", build_cached)
+    print(f"加速: {before / max(after, 1e-9):.0f}x\n")
+
+    template = AMUSEMENT_COORDINATOR_TASK_DISPATCH_TEMPLATE
+    values = {name: f"<{name}>" for name in _PLACEHOLDER_RE.findall(template)}
+    before = bench("无缓存 拆分+格式化（任务分派）", lambda: layered_uncached(template, values), 2000)
+    build_layered_messages(template, **values)  # 预热缓存
+    after = bench("缓存 build_layered_messages（任务分派）", lambda: build_layered_messages(template, **values), 2000)
+    print(f"加速: {before / max(after, 1e-9):.1f}x\n")
+
+    tools = [SimpleNamespace(name=f"tool_{i}", description="工具描述" * 40) for i in range(12)]
+    desc_cache = {}
+
+    def cached_desc():
+        key = tuple(tool.name for tool in tools)
+        if key not in desc_cache:
+            desc_cache[key] = build_tools_desc(tools)
+        return desc_cache[key]
+
+    before = bench("无缓存 tools_desc（12个工具）", lambda: build_tools_desc(tools), 20000)
+    after = bench("缓存 tools_desc（12个工具）", cached_desc, 20000)
+    print(f"加速: {before / max(after, 1e-9):.1f}x")
@@ -0,0 +1,149 @@
+"""
+准入控制
+限制同时执行规划流程的会话数，超出的请求按优先级排队（resume > feedback > travel），
+队列满时拒绝（API返回429 + Retry-After）。
+
+排队发生在工作流任务内部（见 api/trival.py 的 run_graph），排队期间同样可以被取消，
+截止时间也包含排队时间。
+"""
+import math
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import List, Tuple
+
+from config.api_config import (
+    ADMISSION_MAX_ACTIVE_SESSIONS,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_PRIORITIES,
+    ADMISSION_DEFAULT_RETRY_AFTER_SECONDS,
+)
+
+logger = logging.getLogger("utils.admission")
+
+
+class AdmissionRejected(Exception):
+    """排队已满，拒绝执行"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"当前规划请求过多，请在{retry_after}秒后重试")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """最大并发 + 有界优先级队列"""
+
+    def __init__(
+        self,
+        max_active: int = ADMISSION_MAX_ACTIVE_SESSIONS,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        priorities: dict = ADMISSION_PRIORITIES
+    ):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.priorities = priorities
+        self.active = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._avg_run_seconds = 0.0
+        self._finished_runs = 0
+        self.rejected = 0
+
+    @property
+    def queued(self) -> int:
+        """排队中的请求数"""
+        return sum(1 for _, _, waiter in self._queue if not waiter.done())
+
+    def retry_after(self) -> int:
+        """估算的重试等待时间（秒）：排在队尾的请求大约需要等待的时间"""
+        if not self._finished_runs:
+            return ADMISSION_DEFAULT_RETRY_AFTER_SECONDS
+        rounds = (self.queued + 1) / max(self.max_active, 1)
+        return max(1, math.ceil(self._avg_run_seconds * rounds))
+
+    async def acquire(self, kind: str):
+        """
+        申请执行名额，名额不足时按优先级排队
+
+        Args:
+            kind: 请求类型（resume/feedback/travel）
+
+        Raises:
+            AdmissionRejected: 队列已满
+        """
+        if self.active < self.max_active and not self.queued:
+            self.active += 1
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            retry_after = self.retry_after()
+            logger.warning(f"⚠️ 【准入控制】队列已满（执行中{self.active}，排队{self.queued}），拒绝{kind}请求，Retry-After={retry_after}s")
+            raise AdmissionRejected(retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (self.priorities.get(kind, max(self.priorities.values(), default=0)), next(self._seq), waiter))
+        logger.info(f"【准入控制】{kind}请求排队等待（执行中{self.active}，排队{self.queued}）")
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已经转交给本请求，但请求被取消了，把名额交给下一个
+                self.release()
+            raise
+
+    def release(self, run_seconds: float = None):
+        """
+        归还执行名额，转交给优先级最高的排队请求
+
+        Args:
+            run_seconds: 本次执行耗时（用于估算Retry-After）
+        """
+        if run_seconds is not None:
+            self._finished_runs += 1
+            self._avg_run_seconds += (run_seconds - self._avg_run_seconds) / self._finished_runs
+
+        while self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                # 名额直接转交，active不变
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def admit(self, kind: str):
+        """
+        在准入控制下执行
+
+        Args:
+            kind: 请求类型（resume/feedback/travel）
+        """
+        await self.acquire(kind)
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        try:
+            yield
+        finally:
+            self.release(loop.time() - started_at)
+
+    def summary(self) -> dict:
+        """当前状态"""
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "avg_run_seconds": round(self._avg_run_seconds, 1),
+        }
+
+
+_admission_controller = AdmissionController()
+
+
+def get_admission_controller() -> AdmissionController:
+    """获取准入控制器单例"""
+    return _admission_controller
@@ -1,10 +1,18 @@
 import os
 import logging
 import asyncio
+import time
 from typing import Any, Callable, Optional
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 
+from utils.llm_usage import UsageCallbackHandler, get_session_usage
+from utils.session_budget import get_session_budget
+from utils.partial_result import collect_tool_messages
+from utils.code_index import get_code_index, STATION_CODE_TOOL, FLIGHT_TOOLS
+from utils.poi_store import get_poi_store, POI_STORE_TOOLS
+from utils.prefetch import get_prefetch_stats
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -16,6 +24,7 @@ async def retry_llm_call(
     retry_delay: float = 0.5,
     error_context: str = "LLM调用",
     fallback_model: Optional[list[str]] = None,
+    node: Optional[str] = None,
     **kwargs
 ) -> Optional[Any]:
     """
@@ -28,6 +37,7 @@ async def retry_llm_call(
         retry_delay: 重试间隔秒数（默认1秒）
         error_context: 错误上下文描述，用于日志
         fallback_model: 降级模型列表（按顺序依次尝试），如果为None则使用默认列表["gpt-4.1"]
+        node: 调用所属的节点名称（如 plan、replan、sub_agent.map），提供时按节点统计token用量、耗时和提示词缓存命中率
         **kwargs: 传递给llm_func的关键字参数
 
     Returns:
@@ -43,7 +53,14 @@ async def retry_llm_call(
     for attempt in range(max_retries + 1):
         try:
             logger.debug(f"{error_context}: 第 {attempt + 1}/{max_retries + 1} 次尝试")
-            response = await llm_func(*args, **kwargs)
+            usage_handler = UsageCallbackHandler(node) if node else None
+            started_at = time.perf_counter()
+            try:
+                response = await llm_func(*args, **_with_usage_callback(kwargs, usage_handler))
+            except Exception:
+                _record_session_usage(node, usage_handler, time.perf_counter() - started_at, success=False)
+                raise
+            _record_session_usage(node, usage_handler, time.perf_counter() - started_at, success=response is not None)
 
             # 检查响应是否有效
             if response is None:
@@ -104,6 +121,27 @@ async def retry_llm_call(
 
     return None
 
+def _with_usage_callback(kwargs: dict, usage_handler: Optional[UsageCallbackHandler]) -> dict:
+    """为调用注入用量统计回调（不修改原kwargs，模型降级逻辑仍然基于原kwargs判断）"""
+    if usage_handler is None:
+        return kwargs
+
+    call_kwargs = dict(kwargs)
+    config = dict(call_kwargs.get("config") or {})
+    config["callbacks"] = list(config.get("callbacks") or []) + [usage_handler]
+    call_kwargs["config"] = config
+    return call_kwargs
+
+def _record_session_usage(node: Optional[str], usage_handler: Optional[UsageCallbackHandler], elapsed: float, success: bool):
+    """将一次调用的token用量和耗时计入当前会话的统计，并扣减会话预算（不在会话中时忽略）"""
+    usage = usage_handler.usage if usage_handler is not None else {}
+    session_budget = get_session_budget()
+    if session_budget is not None:
+        session_budget.charge(usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+    session_usage = get_session_usage()
+    if session_usage is not None and node:
+        session_usage.record(node, usage, elapsed, success=success)
+
 def get_llm(node):
     model = os.getenv("MODEL_NAME")
     api_key = os.getenv("MODEL_API_KEY")
@@ -134,6 +172,7 @@ async def execute_tool_calls(
         包含ToolMessage的列表
     """
     from langchain_core.messages import ToolMessage
+    from utils.tool_projection import extract_text, project_tool_output
     import json
 
     log = logger_instance if logger_instance else logger
@@ -191,9 +230,17 @@ async def execute_tool_calls(
             )
             continue
 
+        # 车站代码、高德POI/地理编码优先从本地索引返回（见 utils/code_index.py、utils/poi_store.py）
+        tool = tool_map[tool_name]
+        indexed_result = None
+        if tool_name == STATION_CODE_TOOL:
+            indexed_result = get_code_index().lookup_station_codes(tool_args.get("citys"))
+        elif tool_name in POI_STORE_TOOLS:
+            indexed_result = get_poi_store().answer(tool_name, tool_args, tool)
+
         # 检查缓存（如果提供了category和storage）
         cached_result = None
-        if category and storage:
+        if category and storage and indexed_result is None:
             cached_result = storage.find_cached_execution(
                 category=category,
                 tool_name=tool_name,
@@ -202,14 +249,20 @@ async def execute_tool_calls(
             )
 
         # 执行工具
-        tool = tool_map[tool_name]
         try:
-            if cached_result:
+            if indexed_result is not None:
+                result = indexed_result
+                log.info(f"✅ 使用本地索引结果（未调用工具）: {str(result)[:500]}")
+            elif cached_result:
                 # 使用缓存结果
                 cache_hits += 1
                 result = cached_result.get("tool_output", "")
                 log.info(f"✅ 使用缓存结果（缓存命中）")
                 log.info(f"缓存时间戳: {cached_result.get('timestamp', '未知')}")
+                prefetch_id = (cached_result.get("metadata") or {}).get("prefetch_id")
+                if prefetch_id:
+                    # 命中推测性预取的结果（见 utils/prefetch.py）
+                    get_prefetch_stats().mark_used(prefetch_id)
                 log.info(f"工具返回结果（前500字符）: {str(result)[:500]}")
             else:
                 # 调用工具（始终使用异步调用）
@@ -217,14 +270,21 @@ async def execute_tool_calls(
                 log.info(f"🔧 开始执行工具: {tool_name}")
                 result = await tool.ainvoke(tool_args)
                 log.info(f"✅ 工具执行成功")
+                if tool_name == STATION_CODE_TOOL or tool_name in FLIGHT_TOOLS:
+                    get_code_index().learn(tool_name, extract_text(result))
+                elif tool_name in POI_STORE_TOOLS:
+                    get_poi_store().learn(tool_name, tool_args, extract_text(result))
                 log.info(f"工具返回结果（前500字符）: {str(result)[:500]}")
 
-            # 创建ToolMessage
+            # 创建ToolMessage：content为投影后的紧凑内容（传给LLM），artifact保留原始输出（用于存储），
+            # 调用参数（如查询日期）用于子Agent本地校验任务完成度（见 utils/completion_check.py）
             tool_messages.append(
                 ToolMessage(
-                    content=str(result),
+                    content=project_tool_output(tool_name, result),
+                    artifact=extract_text(result),
                     tool_call_id=tool_id,
-                    name=tool_name
+                    name=tool_name,
+                    additional_kwargs={"tool_args": tool_args}
                 )
             )
 
@@ -254,4 +314,7 @@ async def execute_tool_calls(
     log.info(f"所有工具执行完成，共执行 {len(tool_messages)} 个工具")
     log.info(f"=" * 60)
 
+    # 登记到当前执行的收集器，超时取消时用于生成部分结果
+    collect_tool_messages(tool_messages)
+
     return tool_messages
\ No newline at end of file
@@ -0,0 +1,314 @@
+"""
+预算方案本地求解
+原来预算明细（BudgetBreakdownFormat）由replan的LLM从文本中的票价、房价自行相加得出，既慢又经常算错，
+数字对不上时还会触发补充循环。
+
+这里用结构化的工具结果在本地求解：
+- 去程/返程候选：火车票（每个有余票的席别一个候选）和航班，只保留价格和耗时上不被其他候选同时超过的方案
+- 酒店候选：有价格的酒店（每晚房价 × 房间数 × 晚数）
+- 景点门票：高德POI的人均消费，没有时按默认值估算；餐饮、市内交通按人均每天估算；另加预备金
+
+在全部（去程, 返程, 酒店）组合中挑选总价不超过 budget、体验最好（交通耗时短、酒店评分高）的组合，
+都超出预算时取最便宜的组合并注明超出金额。结果作为固定数字写进replan的提示词，LLM只需要组织文字。
+"""
+import re
+import math
+import logging
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import ToolMessage
+
+from utils.completion_check import iter_structured_records, same_place
+from utils.itinerary_optimizer import is_attraction
+from utils.transport_ranking import duration_hours, flight_hours
+from utils.tool_projection import hotel_price_per_night
+
+logger = logging.getLogger("utils.budget_optimizer")
+
+# 餐饮（元/人/天）
+MEAL_COST_PER_PERSON_DAY = 150
+# 市内交通（元/人/天）
+LOCAL_TRANSPORT_PER_PERSON_DAY = 40
+# 景点门票：没有价格信息时的估算值（元/人/个）、每天游览的景点数
+ATTRACTION_TICKET_ESTIMATE = 60
+ATTRACTIONS_PER_DAY = 3
+# 预备金占其余费用的比例
+CONTINGENCY_RATIO = 0.1
+# 每间房入住人数
+PEOPLE_PER_ROOM = 2
+# 每类候选最多保留的数量（组合数为三者之积）
+MAX_OPTIONS = 8
+# 体验评分的权重：交通每小时耗时扣分、酒店每一分评分加分
+HOUR_PENALTY = 1.0
+HOTEL_SCORE_WEIGHT = 2.0
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_SOLD_OUT = {"无", "0", "--", "-", "*"}
+
+
+@dataclass
+class Option:
+    """一个交通或住宿候选"""
+    label: str
+    price: float
+    hours: Optional[float] = None
+    score: Optional[float] = None
+    detail: str = ""
+
+
+@dataclass
+class BudgetPlan:
+    """预算方案：选中的交通和酒店，以及各项费用"""
+    budget: float
+    people: int
+    days: int
+    outbound: Optional[Option]
+    return_trip: Optional[Option]
+    hotel: Optional[Option]
+    breakdown: Dict[str, float] = field(default_factory=dict)
+    notes: List[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> float:
+        return self.breakdown.get("total", 0.0)
+
+    @property
+    def within_budget(self) -> bool:
+        return self.total <= self.budget
+
+
+def _number(value: Any) -> Optional[float]:
+    """从 "¥350"、"553.5元" 等字符串中取出数字"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value or ""))
+    return float(match.group()) if match else None
+
+
+def _pareto(options: List[Option]) -> List[Option]:
+    """只保留价格和耗时上不被其他候选同时超过的候选（按价格排序，最多 MAX_OPTIONS 个）"""
+    options = sorted(options, key=lambda o: (o.price, o.hours if o.hours is not None else math.inf))
+    frontier, best_hours = [], math.inf
+    for option in options:
+        hours = option.hours if option.hours is not None else math.inf
+        if hours < best_hours or not frontier:
+            frontier.append(option)
+            best_hours = min(best_hours, hours)
+    if len(frontier) <= MAX_OPTIONS:
+        return frontier
+    # 按价格均匀抽取，保留最便宜和最快的
+    step = (len(frontier) - 1) / (MAX_OPTIONS - 1)
+    return [frontier[round(i * step)] for i in range(MAX_OPTIONS)]
+
+
+def collect_options(tool_messages: List[ToolMessage], origin: str, destination: str) -> Dict[str, List[Option]]:
+    """
+    从工具结果中收集去程、返程和酒店候选
+
+    Args:
+        tool_messages: 工具调用结果
+        origin: 出发地
+        destination: 目的地
+
+    Returns:
+        {"outbound": [...], "return": [...], "hotel": [...]}，交通候选的价格为每人价格，酒店为每间每晚价格
+    """
+    options: Dict[str, List[Option]] = {"outbound": [], "return": [], "hotel": []}
+    seen = set()
+    for entity, record, args in iter_structured_records(tool_messages):
+        if entity == "train":
+            direction = "return" if same_place(record.get("from_station"), destination) and not same_place(record.get("from_station"), origin) else "outbound"
+            hours = duration_hours(record.get("duration"))
+            date = args.get("date") or record.get("start_date") or ""
+            for seat in record.get("seats") or []:
+                price = _number(seat.get("price"))
+                if price is None or str(seat.get("num") or "").strip() in _SOLD_OUT:
+                    continue
+                label = f"{record['train_code']} {seat.get('name') or ''}".strip()
+                key = (direction, label, date)
+                if key in seen:
+                    continue
+                seen.add(key)
+                options[direction].append(Option(
+                    label=label,
+                    price=price,
+                    hours=hours,
+                    detail=f"{date} {record.get('from_station')}→{record.get('to_station')}，{record.get('start_time')}出发，{record.get('arrive_time')}到达".strip(),
+                ))
+        elif entity == "flight":
+            price = _number(record.get("price"))
+            if price is None:
+                continue
+            # 机场名（如“浦东国际机场”）不含城市名，优先按出发城市判断方向
+            departure = record.get("dep_city") or record.get("dep_airport")
+            direction = "return" if same_place(departure, destination) and not same_place(departure, origin) else "outbound"
+            key = (direction, record.get("flight_no"), record.get("dep_time"))
+            if key in seen:
+                continue
+            seen.add(key)
+            options[direction].append(Option(
+                label=f"{record.get('flight_no')} 航班",
+                price=price,
+                hours=flight_hours(record.get("dep_time"), record.get("arr_time")),
+                detail=f"{record.get('dep_airport')}→{record.get('arr_airport')}，{record.get('dep_time')}出发",
+            ))
+        elif entity == "hotel":
+            # 酒店工具返回的是入住晚数的总价，折算成每晚价格（cost()按晚数计算）
+            price = hotel_price_per_night(record)
+            if price is None or not record.get("name") or record["name"] in seen:
+                continue
+            seen.add(record["name"])
+            score = _number(record.get("score"))
+            star = _number(record.get("star"))
+            options["hotel"].append(Option(
+                label=str(record["name"]),
+                price=price,
+                score=score if score is not None else star,
+                detail=str(record.get("address") or ""),
+            ))
+
+    options["outbound"] = _pareto(options["outbound"])
+    options["return"] = _pareto(options["return"])
+    # 酒店按价格和评分取帕累托前沿（评分越高越好，用负评分代替耗时）
+    hotels = _pareto([Option(o.label, o.price, hours=-(o.score or 0), score=o.score, detail=o.detail) for o in options["hotel"]])
+    options["hotel"] = [Option(o.label, o.price, score=o.score, detail=o.detail) for o in hotels]
+    return options
+
+
+def _ticket_estimate(tool_messages: List[ToolMessage], days: int) -> Tuple[float, int, int]:
+    """
+    景点门票估算：按行程可游览的景点数取搜索到的景点，有人均消费的用实际值，没有的用默认值
+
+    Returns:
+        (每人门票总额, 计入的景点数, 其中按默认值估算的景点数)
+    """
+    costs, seen = [], set()
+    for entity, poi, args in iter_structured_records(tool_messages):
+        key = poi.get("id") or poi.get("name")
+        if entity != "poi" or not key or key in seen or not is_attraction(poi, args):
+            continue
+        seen.add(key)
+        biz_ext = poi.get("biz_ext") if isinstance(poi.get("biz_ext"), dict) else {}
+        cost = _number(poi.get("cost") or biz_ext.get("cost"))
+        costs.append(cost)
+    count = days * ATTRACTIONS_PER_DAY
+    if costs:
+        costs = costs[:count]
+        count = len(costs)
+    total = sum(cost if cost is not None else ATTRACTION_TICKET_ESTIMATE for cost in costs) if costs else count * ATTRACTION_TICKET_ESTIMATE
+    estimated = sum(1 for cost in costs if cost is None) if costs else count
+    return total, count, estimated
+
+
+def solve_budget(
+    tool_messages: List[ToolMessage],
+    budget: float,
+    people: int,
+    days: int,
+    origin: str = "",
+    destination: str = ""
+) -> Optional[BudgetPlan]:
+    """
+    求解预算方案
+
+    Args:
+        tool_messages: 会话中的工具调用结果
+        budget: 总预算（元）
+        people: 出行人数
+        days: 行程天数
+        origin: 出发地
+        destination: 目的地
+
+    Returns:
+        预算方案；没有任何交通或酒店价格时返回None
+    """
+    people = max(int(people or 1), 1)
+    days = max(int(days or 1), 1)
+    budget = float(budget or 0)
+    options = collect_options(tool_messages, origin, destination)
+    if not any(options.values()):
+        return None
+
+    rooms = math.ceil(people / PEOPLE_PER_ROOM)
+    nights = max(days - 1, 1)
+    tickets, ticket_count, estimated_tickets = _ticket_estimate(tool_messages, days)
+    fixed = {
+        "meals": MEAL_COST_PER_PERSON_DAY * people * days,
+        "local_transport": LOCAL_TRANSPORT_PER_PERSON_DAY * people * days,
+        "attractions": tickets * people,
+    }
+
+    def cost(outbound: Optional[Option], return_trip: Optional[Option], hotel: Optional[Option]) -> Dict[str, float]:
+        transport = sum(o.price for o in (outbound, return_trip) if o) * people
+        accommodation = hotel.price * rooms * nights if hotel else 0.0
+        subtotal = transport + fixed["local_transport"] + accommodation + fixed["meals"] + fixed["attractions"]
+        contingency = round(subtotal * CONTINGENCY_RATIO)
+        return {
+            "intercity_transport": transport,
+            "transportation": transport + fixed["local_transport"],
+            "accommodation": accommodation,
+            **fixed,
+            "contingency": contingency,
+            "total": subtotal + contingency,
+        }
+
+    def value(outbound: Optional[Option], return_trip: Optional[Option], hotel: Optional[Option]) -> float:
+        hours = sum(o.hours for o in (outbound, return_trip) if o and o.hours is not None)
+        return HOTEL_SCORE_WEIGHT * ((hotel.score or 0) if hotel else 0) - HOUR_PENALTY * hours
+
+    combos = []
+    for combo in itertools.product(options["outbound"] or [None], options["return"] or [None], options["hotel"] or [None]):
+        breakdown = cost(*combo)
+        combos.append((breakdown["total"] <= budget, value(*combo), -breakdown["total"], combo, breakdown))
+    feasible = [c for c in combos if c[0]]
+    if feasible:
+        _, _, _, combo, breakdown = max(feasible, key=lambda c: (c[1], c[2]))
+    else:
+        _, _, _, combo, breakdown = max(combos, key=lambda c: (c[2], c[1]))
+
+    plan = BudgetPlan(budget, people, days, *combo, breakdown=breakdown)
+    if not options["outbound"]:
+        plan.notes.append("没有查到去程的价格，交通费用未包含去程")
+    if not options["return"]:
+        plan.notes.append("没有查到返程的价格，交通费用未包含返程")
+    if not options["hotel"]:
+        plan.notes.append("没有查到酒店价格，住宿费用未计入")
+    plan.notes.append(f"景点门票按{ticket_count}个景点计算（其中{estimated_tickets}个按{ATTRACTION_TICKET_ESTIMATE}元/人估算）")
+    plan.notes.append(f"住宿按{rooms}间 × {nights}晚计算")
+    if not plan.within_budget:
+        plan.notes.append(f"查到的所有组合都超出预算，已选最便宜的组合，超出{plan.total - budget:.0f}元")
+    logger.info(
+        f"✅ 【预算方案】{len(combos)}种组合中{len(feasible)}种在预算内，"
+        f"选中总价{plan.total:.0f}元（预算{budget:.0f}元）"
+    )
+    return plan
+
+
+def render_budget_plan(plan: BudgetPlan) -> str:
+    """
+    把预算方案渲染成提示词文本
+
+    Returns:
+        选中的交通、酒店和各项费用（元）
+    """
+    b = plan.breakdown
+    lines = [f"预算 {plan.budget:.0f}元（{plan.people}人，{plan.days}天）"]
+    for name, option in (("去程", plan.outbound), ("返程", plan.return_trip)):
+        if option:
+            hours = f"，历时约{option.hours:.1f}小时" if option.hours is not None else ""
+            lines.append(f"- {name}：{option.label} {option.price:.0f}元/人（{option.detail}{hours}）")
+    if plan.hotel:
+        score = f"，评分{plan.hotel.score:g}" if plan.hotel.score is not None else ""
+        lines.append(f"- 住宿：{plan.hotel.label} {plan.hotel.price:.0f}元/间/晚{score}")
+    lines.extend([
+        f"- transportation（交通）：{b['transportation']:.0f}元（城际{b['intercity_transport']:.0f}元 + 市内交通{b['local_transport']:.0f}元）",
+        f"- accommodation（住宿）：{b['accommodation']:.0f}元",
+        f"- meals（餐饮）：{b['meals']:.0f}元（{MEAL_COST_PER_PERSON_DAY}元/人/天）",
+        f"- attractions（景点门票）：{b['attractions']:.0f}元",
+        f"- contingency（预备金）：{b['contingency']:.0f}元（{CONTINGENCY_RATIO:.0%}）",
+        f"- total（总计）：{b['total']:.0f}元，{'剩余' if plan.within_budget else '超出'}{abs(plan.budget - b['total']):.0f}元",
+    ])
+    lines.extend(f"- 说明：{note}" for note in plan.notes)
+    return "\n".join(lines)
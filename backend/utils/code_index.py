@@ -0,0 +1,209 @@
+"""
+车站代码 / 机场代码本地索引（进程级）
+12306的车站代码、城市的机场三字码几乎不会变化，但每次会话都要调用一次 get-station-code-of-citys
+（以及为此多走的一轮LLM调用）。这里在进程内维护一份 城市 → 代码 的索引：
+
+- 启动时从随代码分发的种子文件（config/code_index_seed.json）和历史工具执行记录
+  （data/tool_executions/transport*.json 中 get-station-code-of-citys 和航班工具的输出）加载
+- 运行中每次真实调用这些工具后，把结果补充进索引
+- 后台定时重新加载历史记录（见 app.py 的 lifespan）
+
+execute_tool_calls 遇到 get-station-code-of-citys 时，城市全部在索引中就直接返回结果，不再调用MCP工具。
+"""
+import json
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from utils.tool_projection import parse_json_output, find_record_list
+from utils.tool_data_storage import get_tool_storage
+
+logger = logging.getLogger("utils.code_index")
+
+STATION_CODE_TOOL = "get-station-code-of-citys"
+FLIGHT_TOOLS = {"searchFlightsByDepArr", "searchFlightItineraries", "getFlightTransferInfo"}
+
+# 随代码分发的种子数据
+SEED_FILE = Path(__file__).resolve().parent.parent / "config" / "code_index_seed.json"
+
+# 后台重新加载历史记录的间隔（秒）
+REFRESH_INTERVAL_SECONDS = 3600
+
+
+def _city(name: Any) -> str:
+    return str(name or "").strip().removesuffix("市")
+
+
+class CodeIndex:
+    """城市 → 12306车站代码 / 机场三字码"""
+
+    def __init__(self, seed_file: Path = SEED_FILE):
+        self.seed_file = seed_file
+        self._lock = threading.Lock()
+        self._stations: Dict[str, Dict[str, str]] = {}
+        self._airports: Dict[str, List[str]] = {}
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- 加载 ----------
+
+    def _merge_stations(self, stations: Dict[str, Any]) -> int:
+        added = 0
+        for city, station in stations.items():
+            if isinstance(station, dict) and station.get("station_code"):
+                key = _city(city)
+                if self._stations.get(key, {}).get("station_code") != station["station_code"]:
+                    added += 1
+                self._stations[key] = {
+                    "station_code": str(station["station_code"]),
+                    "station_name": str(station.get("station_name") or city),
+                }
+        return added
+
+    def _merge_airport(self, city: Any, code: Any) -> bool:
+        city, code = _city(city), str(code or "").strip().upper()
+        if not city or len(code) != 3 or not code.isalpha():
+            return False
+        codes = self._airports.setdefault(city, [])
+        if code in codes:
+            return False
+        codes.append(code)
+        return True
+
+    def learn(self, tool_name: str, raw: Any) -> int:
+        """
+        从一次工具输出中补充索引
+
+        Args:
+            tool_name: 工具名称（get-station-code-of-citys 或航班工具）
+            raw: 工具原始输出
+
+        Returns:
+            新增/更新的条目数
+        """
+        data = parse_json_output(raw)
+        if data is None:
+            return 0
+        with self._lock:
+            if tool_name == STATION_CODE_TOOL and isinstance(data, dict):
+                return self._merge_stations(data)
+            if tool_name in FLIGHT_TOOLS:
+                added = 0
+                for flight in find_record_list(data):
+                    added += self._merge_airport(flight.get("FlightDep"), flight.get("FlightDepcode"))
+                    added += self._merge_airport(flight.get("FlightArr"), flight.get("FlightArrcode"))
+                return added
+        return 0
+
+    def _load_seed(self) -> int:
+        if not self.seed_file.exists():
+            return 0
+        try:
+            seed = json.loads(self.seed_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            logger.warning(f"⚠️ 加载代码索引种子文件失败: {e}")
+            return 0
+        with self._lock:
+            added = self._merge_stations(seed.get("stations") or {})
+            for city, codes in (seed.get("airports") or {}).items():
+                for code in codes:
+                    added += self._merge_airport(city, code)
+        return added
+
+    def _load_history(self) -> int:
+        storage_dir = get_tool_storage().storage_dir
+        added = 0
+        for path in sorted(storage_dir.glob("transport*.json")):
+            try:
+                records = json.loads(path.read_text(encoding="utf-8"))
+            except Exception as e:
+                logger.warning(f"⚠️ 读取历史工具记录 {path.name} 失败: {e}")
+                continue
+            for record in records if isinstance(records, list) else []:
+                tool_name = record.get("tool_name")
+                if tool_name == STATION_CODE_TOOL or tool_name in FLIGHT_TOOLS:
+                    added += self.learn(tool_name, record.get("tool_output"))
+        return added
+
+    def refresh(self) -> int:
+        """
+        重新加载种子文件和历史工具记录（历史记录中的真实结果覆盖种子数据）
+
+        Returns:
+            新增/更新的条目数
+        """
+        added = self._load_seed() + self._load_history()
+        self._loaded = True
+        logger.info(f"✅ 【代码索引】已加载，车站{len(self._stations)}个城市，机场{len(self._airports)}个城市（新增/更新{added}条）")
+        return added
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    # ---------- 查询 ----------
+
+    def lookup_station_codes(self, citys: Any) -> Optional[str]:
+        """
+        按 get-station-code-of-citys 的输出格式返回车站代码
+
+        Args:
+            citys: 工具参数，多个城市用 | 分隔
+
+        Returns:
+            JSON字符串 {城市: {station_code, station_name}}；有城市不在索引中时返回None（需要调用工具）
+        """
+        self._ensure_loaded()
+        cities = [city.strip() for city in str(citys or "").split("|") if city.strip()]
+        if not cities:
+            return None
+        with self._lock:
+            found = {city: self._stations.get(_city(city)) for city in cities}
+        if not all(found.values()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.dumps(found, ensure_ascii=False)
+
+    def airport_codes(self, city: Any) -> List[str]:
+        """城市的机场三字码（未知时返回空列表）"""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._airports.get(_city(city), []))
+
+    def known_cities(self) -> Set[str]:
+        """索引中的全部城市（有车站代码或机场代码的城市）"""
+        self._ensure_loaded()
+        with self._lock:
+            return set(self._stations) | set(self._airports)
+
+    def summary(self) -> Dict[str, Any]:
+        """索引状态"""
+        return {
+            "station_cities": len(self._stations),
+            "airport_cities": len(self._airports),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_code_index = CodeIndex()
+
+
+def get_code_index() -> CodeIndex:
+    """获取代码索引单例"""
+    return _code_index
+
+
+async def refresh_code_index_periodically(interval_seconds: float = REFRESH_INTERVAL_SECONDS):
+    """后台定时重新加载代码索引（读取文件在线程池中执行，不阻塞事件循环）"""
+    index = get_code_index()
+    while True:
+        try:
+            await asyncio.to_thread(index.refresh)
+        except Exception as e:
+            logger.warning(f"⚠️ 【代码索引】重新加载失败: {e}")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,405 @@
+"""
+子Agent任务完成度检查
+查询任务的主循环结束后、每个额外轮次之后以及zhipu_search补全之前都会检查一次任务是否完成，
+原来每次都要让LLM阅读全部工具结果判断"0|原因 / 1|原因"，一个任务最多多出3~4次串行的LLM调用。
+
+这里按以下顺序减少检查：
+1. 本地校验：用结构化的工具结果对照任务上下文机械判断（如交通任务已经查到出发日期的车次、
+   天气任务的预报已经覆盖全部行程日期），能判断时直接判定完成；各类子Agent的校验函数见下方 validate_*
+2. 复用：两次检查之间没有新的工具结果时，复用上一次的结论
+3. 重叠：某一轮工具调用完成后，在发起下一轮LLM调用的同时预先检查；
+   下一轮不再调用工具时直接使用预先检查的结论，继续调用工具时丢弃
+"""
+import re
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import ToolMessage
+
+from utils.tool_projection import (
+    parse_train_tickets,
+    parse_flights,
+    parse_pois,
+    parse_weather,
+    parse_hotels,
+)
+
+logger = logging.getLogger("utils.completion_check")
+
+# 工具名称 -> (结构化结果类型, 解析函数)
+_ENTITY_PARSERS: Dict[str, tuple] = {
+    "get-tickets": ("train", parse_train_tickets),
+    "searchFlightsByDepArr": ("flight", parse_flights),
+    "searchFlightItineraries": ("flight", parse_flights),
+    "getFlightTransferInfo": ("flight", parse_flights),
+    "maps_text_search": ("poi", parse_pois),
+    "maps_around_search": ("poi", parse_pois),
+    "maps_weather": ("weather", lambda raw: [{**forecast, "city": city} for city, forecasts in [parse_weather(raw)] for forecast in forecasts]),
+    "find-hotels": ("hotel", parse_hotels),
+    "search-hotels": ("hotel", parse_hotels),
+    "searchHotels": ("hotel", parse_hotels),
+}
+
+def structured_entity(tool_name: str) -> Optional[str]:
+    """工具结果的结构化类型（train/flight/poi/weather/hotel），不是结构化工具时返回None"""
+    parser = _ENTITY_PARSERS.get(tool_name)
+    return parser[0] if parser else None
+
+
+# 判定完成至少需要的酒店 / POI 数量
+MIN_HOTELS = 3
+MIN_POIS = 3
+
+_CHECK_FIELDS = ("llm_checks", "local_checks", "reused_checks", "overlapped_checks", "discarded_checks")
+
+_DATE_RE = re.compile(r"\d{4}-\d{1,2}-\d{1,2}")
+_FLIGHT_WORDS = ("机票", "航班", "飞机", "飞")
+_TRAIN_WORDS = ("火车", "高铁", "动车", "车次", "12306")
+_RETURN_WORDS = ("返程", "回程")
+_ATTRACTION_WORDS = ("景点", "景区", "游览", "玩")
+_FOOD_WORDS = ("美食", "餐厅", "小吃", "吃", "饭店")
+_ROUTE_WORDS = ("路线", "距离", "怎么去", "公交", "地铁", "驾车", "步行")
+_CHECK_IN_ARGS = ("checkInDate", "check_in_date", "checkIn", "check_in")
+
+
+def iter_structured_records(tool_messages: List[ToolMessage]) -> Iterator[Tuple[str, Dict[str, Any], Dict[str, Any]]]:
+    """
+    从工具结果中解析出结构化记录
+
+    Args:
+        tool_messages: 工具调用结果（优先使用原始输出artifact）
+
+    Yields:
+        (结构化结果类型, 记录, 工具调用参数)，类型为 train/flight/poi/weather/hotel
+    """
+    for msg in tool_messages:
+        entry = _ENTITY_PARSERS.get(getattr(msg, "name", "") or "")
+        if entry is None:
+            continue
+        entity, parser = entry
+        raw = msg.artifact if getattr(msg, "artifact", None) is not None else msg.content
+        try:
+            records = parser(raw)
+        except Exception as e:
+            logger.debug(f"解析工具 {msg.name} 的结果失败: {e}")
+            continue
+        tool_args = (getattr(msg, "additional_kwargs", None) or {}).get("tool_args") or {}
+        for record in records:
+            yield entity, record, tool_args
+
+
+def _records(tool_messages: List[ToolMessage], *entities: str) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    return [(record, args) for entity, record, args in iter_structured_records(tool_messages) if entity in entities]
+
+
+def _normalize_date(value: Any) -> Optional[str]:
+    """把日期统一成 YYYY-MM-DD（取字符串开头的日期部分），无法解析时返回None"""
+    match = _DATE_RE.search(str(value or ""))
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(0), "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def _trip_dates(context: Dict[str, Any]) -> List[str]:
+    """行程覆盖的全部日期（出发日期起共days天）"""
+    start = _normalize_date(context.get("date"))
+    if not start:
+        return []
+    try:
+        days = max(int(context.get("days") or 1), 1)
+    except (TypeError, ValueError):
+        days = 1
+    first = datetime.strptime(start, "%Y-%m-%d")
+    return [(first + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days)]
+
+
+def same_place(name: Any, place: str) -> bool:
+    """站名/机场/城市名与城市是否对应（如 杭州东 ↔ 杭州、杭州市 ↔ 杭州）"""
+    name = str(name or "")
+    place = (place or "").removesuffix("市")
+    return bool(name and place) and (place in name or name.removesuffix("市") in place)
+
+
+def validate_transport(task: str, context: Dict[str, Any], tool_messages: List[ToolMessage]) -> Optional[Dict[str, Any]]:
+    """
+    交通任务：查到了任务要求日期的车次/航班即完成
+
+    要求的日期为任务中写明的日期；没有写明时去程为出发日期，返程为行程最后一天，往返两者都要；
+    返程/往返任务还需要对应方向（按出发站判断）有结果
+
+    Returns:
+        {"completed": 1, "reason": str}；无法判断时返回None
+    """
+    wants_flight = any(word in task for word in _FLIGHT_WORDS)
+    wants_train = any(word in task for word in _TRAIN_WORDS)
+    if wants_flight != wants_train:
+        entities = ("flight",) if wants_flight else ("train",)
+    else:
+        entities = ("train", "flight")
+
+    round_trip = "往返" in task
+    return_only = not round_trip and any(word in task for word in _RETURN_WORDS)
+    trip_dates = _trip_dates(context)
+    required_dates = [d for d in (_normalize_date(m) for m in _DATE_RE.findall(task)) if d]
+    if not required_dates and trip_dates:
+        required_dates = [trip_dates[0], trip_dates[-1]] if round_trip else [trip_dates[-1]] if return_only else [trip_dates[0]]
+    required_dates = list(dict.fromkeys(required_dates))
+    if not required_dates:
+        return None
+
+    origin, destination = context.get("origin", ""), context.get("destination", "")
+    found_dates, outbound, return_trip = set(), 0, 0
+    for record, args in _records(tool_messages, *entities):
+        if "train_code" in record:
+            record_date = _normalize_date(args.get("date") or record.get("start_date"))
+            departure = record.get("from_station")
+        else:
+            record_date = _normalize_date(args.get("date") or record.get("dep_time"))
+            departure = record.get("dep_airport")
+        if record_date not in required_dates:
+            continue
+        found_dates.add(record_date)
+        if same_place(departure, destination) and not same_place(departure, origin):
+            return_trip += 1
+        else:
+            outbound += 1
+
+    if any(d not in found_dates for d in required_dates):
+        return None
+    if (round_trip and not (outbound and return_trip)) or (return_only and not return_trip):
+        return None
+    kind = {("flight",): "航班", ("train",): "车次"}.get(entities, "车次/航班")
+    return {
+        "completed": 1,
+        "reason": f"本地校验：已查到{'、'.join(required_dates)}的{kind}（去程{outbound}条，返程{return_trip}条）"
+    }
+
+
+def validate_weather(task: str, context: Dict[str, Any], tool_messages: List[ToolMessage]) -> Optional[Dict[str, Any]]:
+    """
+    天气任务：目的地的天气预报覆盖了全部行程日期即完成
+
+    Returns:
+        {"completed": 1, "reason": str}；无法判断时返回None
+    """
+    trip_dates = _trip_dates(context)
+    if not trip_dates:
+        return None
+    destination = context.get("destination", "")
+    covered = {
+        _normalize_date(record.get("date"))
+        for record, _ in _records(tool_messages, "weather")
+        if not destination or same_place(record.get("city"), destination)
+    }
+    if not all(day in covered for day in trip_dates):
+        return None
+    return {"completed": 1, "reason": f"本地校验：天气预报已覆盖{trip_dates[0]}至{trip_dates[-1]}共{len(trip_dates)}天"}
+
+
+def validate_hotels(task: str, context: Dict[str, Any], tool_messages: List[ToolMessage]) -> Optional[Dict[str, Any]]:
+    """
+    酒店任务：查到了至少 MIN_HOTELS 家有名称和价格的酒店即完成（查询参数带入住日期时须与出发日期一致）
+
+    Returns:
+        {"completed": 1, "reason": str}；无法判断时返回None
+    """
+    start = _normalize_date(context.get("date"))
+    hotels = set()
+    for record, args in _records(tool_messages, "hotel"):
+        check_in = next((_normalize_date(args[key]) for key in _CHECK_IN_ARGS if args.get(key)), None)
+        if check_in and start and check_in != start:
+            continue
+        if record.get("name") and record.get("price") not in (None, ""):
+            hotels.add(str(record["name"]))
+    if len(hotels) < MIN_HOTELS:
+        return None
+    return {"completed": 1, "reason": f"本地校验：已查到{len(hotels)}家有价格的酒店"}
+
+
+def validate_pois(task: str, context: Dict[str, Any], tool_messages: List[ToolMessage]) -> Optional[Dict[str, Any]]:
+    """
+    地图任务：任务要求的景点/餐厅各查到至少 MIN_POIS 个（POI带城市时须在目的地）即完成；
+    路线、距离类任务交给LLM判断
+
+    Returns:
+        {"completed": 1, "reason": str}；无法判断时返回None
+    """
+    if any(word in task for word in _ROUTE_WORDS):
+        return None
+    wants_food = any(word in task for word in _FOOD_WORDS)
+    wants_attractions = any(word in task for word in _ATTRACTION_WORDS) or not wants_food
+
+    destination = context.get("destination", "")
+    attractions, restaurants = set(), set()
+    for record, _ in _records(tool_messages, "poi"):
+        city = record.get("cityname") or record.get("city")
+        if destination and isinstance(city, str) and city and not same_place(city, destination):
+            continue
+        poi_type = str(record.get("type") or "")
+        typecode = str(record.get("typecode") or "")
+        if "住宿" in poi_type or typecode.startswith("10"):
+            continue
+        if "餐饮" in poi_type or typecode.startswith("05"):
+            restaurants.add(str(record.get("name")))
+        else:
+            attractions.add(str(record.get("name")))
+
+    if wants_attractions and len(attractions) < MIN_POIS:
+        return None
+    if wants_food and len(restaurants) < MIN_POIS:
+        return None
+    return {"completed": 1, "reason": f"本地校验：已查到景点{len(attractions)}个、餐厅{len(restaurants)}个"}
+
+
+class CompletionCheckStats:
+    """完成度检查的统计（进程级）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {field: 0 for field in _CHECK_FIELDS}
+        self._by_agent: Dict[str, Dict[str, int]] = {}
+
+    def record(self, agent_type: str, counts: Dict[str, int]):
+        """累加一个查询任务的检查次数"""
+        with self._lock:
+            by_agent = self._by_agent.setdefault(agent_type, {field: 0 for field in _CHECK_FIELDS})
+            for field in _CHECK_FIELDS:
+                self._totals[field] += counts.get(field, 0)
+                by_agent[field] += counts.get(field, 0)
+
+    def summary(self) -> Dict[str, Any]:
+        """统计汇总（avoided_llm_checks = 本地校验 + 复用，省掉的LLM调用次数）"""
+        with self._lock:
+            return {
+                **self._totals,
+                "avoided_llm_checks": self._totals["local_checks"] + self._totals["reused_checks"],
+                "by_agent": {agent: dict(counts) for agent, counts in self._by_agent.items()},
+            }
+
+
+_completion_check_stats = CompletionCheckStats()
+
+
+def get_completion_check_stats() -> CompletionCheckStats:
+    """获取完成度检查统计单例"""
+    return _completion_check_stats
+
+
+class CompletionChecker:
+    """
+    单个查询任务内的完成度检查
+
+    按工具结果的数量判断两次检查之间是否有新结果（工具结果列表只会追加）
+    """
+
+    def __init__(
+        self,
+        agent_name: str,
+        agent_type: str,
+        validate: Callable[[List[ToolMessage]], Optional[Dict[str, Any]]],
+        llm_check: Callable[[List[ToolMessage]], Awaitable[Dict[str, Any]]]
+    ):
+        """
+        Args:
+            agent_name: 子Agent名称（用于日志）
+            agent_type: 子Agent类型（用于统计）
+            validate: 本地校验函数，无法判断时返回None
+            llm_check: LLM检查函数
+        """
+        self.agent_name = agent_name
+        self.agent_type = agent_type
+        self._validate = validate
+        self._llm_check = llm_check
+        self._last: Optional[tuple] = None
+        self._overlapped: Optional[tuple] = None
+        self.counts = {field: 0 for field in _CHECK_FIELDS}
+
+    def _local(self, tool_messages: List[ToolMessage]) -> Optional[Dict[str, Any]]:
+        try:
+            return self._validate(tool_messages)
+        except Exception as e:
+            logger.warning(f"  [{self.agent_name}] 本地完成度校验异常，交给LLM检查: {e}")
+            return None
+
+    def start_overlapped(self, tool_messages: List[ToolMessage]):
+        """
+        在发起下一轮LLM调用前预先开始检查（本地校验能判断时不发起LLM检查）
+
+        Args:
+            tool_messages: 当前全部工具结果
+        """
+        self.discard_overlapped()
+        count = len(tool_messages)
+        if self._local(tool_messages) is not None:
+            return
+        task = asyncio.create_task(self._llm_check(list(tool_messages)))
+        self._overlapped = (count, task)
+        logger.debug(f"  [{self.agent_name}] 已预先开始完成度检查（{count}个工具结果）")
+
+    def discard_overlapped(self):
+        """下一轮继续调用了工具，预先检查的结论已经过时，取消它"""
+        if self._overlapped is None:
+            return
+        _, task = self._overlapped
+        self._overlapped = None
+        if not task.done():
+            task.cancel()
+        self.counts["discarded_checks"] += 1
+
+    async def check(self, tool_messages: List[ToolMessage]) -> Dict[str, Any]:
+        """
+        检查任务是否完成
+
+        Args:
+            tool_messages: 当前全部工具结果
+
+        Returns:
+            {"completed": int, "reason": str}
+        """
+        count = len(tool_messages)
+        if self._last is not None and self._last[0] == count:
+            self.counts["reused_checks"] += 1
+            logger.info(f"  [{self.agent_name}] 没有新的工具结果，复用上一次完成度检查的结论")
+            return self._last[1]
+
+        result = self._local(tool_messages)
+        if result is not None:
+            self.counts["local_checks"] += 1
+            logger.info(f"  [{self.agent_name}] {result['reason']}，跳过LLM完成度检查")
+        elif self._overlapped is not None and self._overlapped[0] == count:
+            _, task = self._overlapped
+            self._overlapped = None
+            result = await task
+            self.counts["overlapped_checks"] += 1
+            logger.info(f"  [{self.agent_name}] 使用与上一轮重叠执行的完成度检查结论")
+        else:
+            self.discard_overlapped()
+            result = await self._llm_check(tool_messages)
+            self.counts["llm_checks"] += 1
+
+        self._last = (count, result)
+        return result
+
+    def finish(self) -> Dict[str, int]:
+        """
+        任务结束：取消未使用的预先检查，记录统计
+
+        Returns:
+            本任务的检查次数统计
+        """
+        self.discard_overlapped()
+        get_completion_check_stats().record(self.agent_type, self.counts)
+        avoided = self.counts["local_checks"] + self.counts["reused_checks"]
+        if any(self.counts.values()):
+            logger.info(
+                f"  [{self.agent_name}] 【完成度检查】LLM检查{self.counts['llm_checks']}次，"
+                f"省掉{avoided}次（本地校验{self.counts['local_checks']}、复用{self.counts['reused_checks']}），"
+                f"重叠执行{self.counts['overlapped_checks']}次，丢弃{self.counts['discarded_checks']}次"
+            )
+        return dict(self.counts)
@@ -0,0 +1,197 @@
+"""
+弹性日期：出发日期前后 ±N 天的交通比价
+日期灵活的用户原来要换着 date 多次提交 /travel，每次都完整执行一遍规划流程。
+
+这里在执行规划流程之前，用交通工具并发查询 ±N 天每天的去程车次/航班（限制并发数和调用频率，
+经 execute_tool_calls 查询，命中车站代码索引和工具缓存，结果也会写入工具缓存），
+用结构化排序（见 utils/transport_ranking.py）汇总成价格/历时日历并选出最合适的日期，
+完整的规划流程只为选中的日期执行一次（交通助手查询该日期时直接命中缓存）。
+"""
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from utils.agent_tools import execute_tool_calls
+from utils.code_index import get_code_index, STATION_CODE_TOOL
+from utils.tool_data_storage import get_tool_storage
+from utils.tool_projection import parse_json_output
+from utils.partial_result import set_tool_collector, reset_tool_collector
+from utils.transport_ranking import TransportPreferences, TransportTable
+from config.api_config import (
+    FLEXIBLE_DATE_CONCURRENCY,
+    FLEXIBLE_DATE_MIN_INTERVAL_SECONDS,
+    FLEXIBLE_DATE_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger("utils.date_fanout")
+
+TRAIN_TOOL = "get-tickets"
+FLIGHT_TOOL = "searchFlightsByDepArr"
+# 工具结果写入缓存时使用的类别（与交通助手的任务类别一致）
+STORAGE_CATEGORY = "transport"
+
+_FLIGHT_WORDS = ("飞机", "航班", "机票")
+_TRAIN_WORDS = ("火车", "高铁", "动车", "卧铺")
+
+
+def candidate_dates(date: str, flexible_days: int) -> List[str]:
+    """
+    出发日期前后 ±flexible_days 天（不早于今天）
+
+    Returns:
+        日期列表（YYYY-MM-DD），出发日期无法解析时只返回原日期
+    """
+    try:
+        center = datetime.strptime(date[:10], "%Y-%m-%d")
+    except ValueError:
+        return [date]
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        day.strftime("%Y-%m-%d")
+        for offset in range(-flexible_days, flexible_days + 1)
+        if (day := center + timedelta(days=offset)) >= today
+    ]
+
+
+class RateLimiter:
+    """限制同时进行的调用数，以及相邻两次调用发起的最小间隔"""
+
+    def __init__(self, concurrency: int, min_interval: float):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lock = asyncio.Lock()
+        self._min_interval = min_interval
+        self._last_start = 0.0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        async with self._lock:
+            wait = self._last_start + self._min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_start = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+async def _call_tool(tools: List[Any], tool_name: str, args: Dict[str, Any], limiter: RateLimiter, context: Dict[str, Any]) -> List[ToolMessage]:
+    """经 execute_tool_calls 调用一次工具，实际调用工具得到的结果写入工具缓存（命中缓存的结果不重复写入）"""
+    call = AIMessage(content="", tool_calls=[{"name": tool_name, "args": args, "id": f"flex-{tool_name}-{args.get('date', '')}"}])
+    storage = get_tool_storage()
+    cached = storage.find_cached_execution(category=STORAGE_CATEGORY, tool_name=tool_name, tool_input=args) is not None
+    # 各个日期的查询结果不登记到部分结果收集器（见 utils/partial_result.py），
+    # 超过截止时间生成部分攻略时只使用选中日期的规划流程查到的结果
+    token = set_tool_collector(None)
+    try:
+        async with limiter:
+            messages = await execute_tool_calls(call, tools, logger, category=STORAGE_CATEGORY, storage=storage)
+    finally:
+        reset_tool_collector(token)
+    if cached:
+        return messages
+    for msg in messages:
+        if msg.artifact is not None:
+            storage.save_tool_execution(
+                category=STORAGE_CATEGORY,
+                tool_name=tool_name,
+                tool_input=args,
+                tool_output=msg.artifact,
+                context=context,
+                metadata={"task": "弹性日期比价"}
+            )
+    return messages
+
+
+async def _station_codes(tools: List[Any], origin: str, destination: str, limiter: RateLimiter, context: Dict[str, Any]) -> Optional[tuple]:
+    """出发地/目的地的12306车站代码（优先本地索引）"""
+    citys = f"{origin}|{destination}"
+    raw = get_code_index().lookup_station_codes(citys)
+    if raw is None:
+        if not any(getattr(tool, "name", "") == STATION_CODE_TOOL for tool in tools):
+            return None
+        messages = await _call_tool(tools, STATION_CODE_TOOL, {"citys": citys}, limiter, context)
+        raw = messages[0].artifact if messages else None
+    data = parse_json_output(raw)
+    if not isinstance(data, dict):
+        return None
+    codes = [station.get("station_code") for station in data.values() if isinstance(station, dict)]
+    return tuple(codes) if len(codes) == 2 and all(codes) else None
+
+
+async def search_date_calendar(
+    origin: str,
+    destination: str,
+    date: str,
+    flexible_days: int,
+    tools: List[Any],
+    preferences: str = "",
+    budget: Any = None,
+    people: Any = None
+) -> Optional[Dict[str, Any]]:
+    """
+    并发查询 ±flexible_days 天的去程车次/航班，汇总成价格/历时日历并选出最合适的日期
+
+    Args:
+        origin: 出发地
+        destination: 目的地
+        date: 用户给出的出发日期
+        flexible_days: 前后浮动天数
+        tools: 可用的工具（需要包含 get-tickets 或 searchFlightsByDepArr）
+        preferences: 用户偏好（决定查火车还是航班，以及排序方式）
+        budget: 总预算
+        people: 出行人数
+
+    Returns:
+        {"selected_date", "calendar": [...], "tool_calls": int}；没有可用的交通工具或没有查到结果时返回None
+    """
+    dates = candidate_dates(date, flexible_days)
+    if len(dates) <= 1:
+        return None
+    tool_names = {getattr(tool, "name", "") for tool in tools}
+    context = {"origin": origin, "destination": destination, "date": date, "preferences": preferences}
+    limiter = RateLimiter(FLEXIBLE_DATE_CONCURRENCY, FLEXIBLE_DATE_MIN_INTERVAL_SECONDS)
+    started_at = time.perf_counter()
+
+    wants_flight = any(word in preferences for word in _FLIGHT_WORDS)
+    wants_train = any(word in preferences for word in _TRAIN_WORDS) or not wants_flight
+    calls = []
+    if wants_train and TRAIN_TOOL in tool_names:
+        codes = await _station_codes(tools, origin, destination, limiter, context)
+        if codes:
+            calls += [(TRAIN_TOOL, {"date": day, "fromStation": codes[0], "toStation": codes[1]}) for day in dates]
+    if (wants_flight or not calls) and FLIGHT_TOOL in tool_names:
+        index = get_code_index()
+        dep, arr = index.airport_codes(origin), index.airport_codes(destination)
+        if dep and arr:
+            calls += [(FLIGHT_TOOL, {"dep": dep[0], "arr": arr[0], "date": day}) for day in dates]
+    if not calls:
+        logger.warning("⚠️ 【弹性日期】没有可用的交通工具或无法确定车站/机场代码，按原日期规划")
+        return None
+
+    tasks = [asyncio.ensure_future(_call_tool(tools, name, args, limiter, context)) for name, args in calls]
+    done, pending = await asyncio.wait(tasks, timeout=FLEXIBLE_DATE_TIMEOUT_SECONDS)
+    for task in pending:
+        task.cancel()
+    tool_messages = [msg for task in done if not task.cancelled() and task.exception() is None for msg in task.result()]
+
+    prefs = TransportPreferences.parse(preferences, budget=budget, people=people)
+    calendar = TransportTable.from_tool_messages(tool_messages, prefs, origin, destination).calendar(prefs)
+    if not calendar:
+        logger.warning("⚠️ 【弹性日期】没有查到任何日期的车次/航班，按原日期规划")
+        return None
+
+    # 分数相同时选离原日期最近的
+    center = datetime.strptime(dates[len(dates) // 2] if date not in dates else date, "%Y-%m-%d")
+    best = min(calendar, key=lambda day: (day["best_score"], abs((datetime.strptime(day["date"], "%Y-%m-%d") - center).days)))
+    logger.info(
+        f"✅ 【弹性日期】{len(dates)}个日期并发查询{len(calls)}次（{len(pending)}次超时），耗时{time.perf_counter() - started_at:.1f}s，"
+        f"选中{best['date']}（{best['best']}）: "
+        + json.dumps({day["date"]: day["cheapest_price"] for day in calendar}, ensure_ascii=False)
+    )
+    return {"selected_date": best["date"], "calendar": calendar, "tool_calls": len(calls)}
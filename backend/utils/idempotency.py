@@ -0,0 +1,196 @@
+"""
+/travel 请求去重（幂等 + single-flight）
+用户双击、前端超时重试都会重复提交 /travel，每次都会启动一次数分钟的完整规划。
+这里按 Idempotency-Key 请求头（没有时按规范化后的请求内容）识别重复提交：
+- 执行中：重复请求等待同一次执行，返回同一个会话
+- 已完成：带 Idempotency-Key 的请求在幂等窗口内直接返回同一份结果；
+  按请求内容识别的请求只在完成后的宽限期内复用（之后相同的表单视为重新生成）
+- 执行出错、被取消、需要人工介入或只有部分结果：不复用，重试时重新执行
+  （需要人工介入的会话可能已经通过 /resume 继续，旧响应已经过时）
+
+执行不属于任何一个请求：所有等待的客户端都断开并超过宽限期后才取消执行。
+"""
+import time
+import json
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Dict, Optional
+
+from starlette.requests import Request
+
+from config.api_config import (
+    DISCONNECT_POLL_SECONDS,
+    IDEMPOTENCY_WINDOW_SECONDS,
+    IDEMPOTENCY_ABANDON_GRACE_SECONDS,
+)
+from utils.run_control import get_run_registry, CANCEL_CLIENT_DISCONNECT
+
+logger = logging.getLogger("utils.idempotency")
+
+PAYLOAD_KEY_PREFIX = "payload:"
+# 这些状态的响应不复用：需要人工介入的会话可能已经继续执行，部分结果应当重试以得到完整结果
+NON_REUSABLE_STATUSES = {"cancelled", "need_intervention", "partial"}
+
+
+@dataclass
+class Flight:
+    """一次共享的执行"""
+    key: str
+    session_id: str
+    task: asyncio.Task
+    created_at: float
+    waiters: int = 0
+    joined: int = 0  # 复用该执行的重复请求数
+    finished_at: Optional[float] = None
+
+
+def normalize_payload(payload: Dict[str, Any]) -> str:
+    """
+    规范化请求内容（去掉首尾空白、统一数字格式、按键排序），用于生成去重key
+
+    Args:
+        payload: 请求内容
+
+    Returns:
+        规范化后的JSON文本
+    """
+    normalized = {}
+    for key, value in payload.items():
+        if isinstance(value, str):
+            value = " ".join(value.split())
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        normalized[key] = value
+    return json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+
+
+class SingleFlight:
+    """按key合并重复提交的执行"""
+
+    def __init__(
+        self,
+        window_seconds: float = IDEMPOTENCY_WINDOW_SECONDS,
+        grace_seconds: float = IDEMPOTENCY_ABANDON_GRACE_SECONDS
+    ):
+        self.window_seconds = window_seconds
+        self.grace_seconds = grace_seconds
+        self._flights: Dict[str, Flight] = {}
+        self.coalesced = 0  # 累计合并的重复请求数
+
+    @staticmethod
+    def make_key(idempotency_key: Optional[str], payload: Dict[str, Any]) -> str:
+        """
+        生成去重key：优先使用 Idempotency-Key 请求头，否则使用请求内容的哈希
+
+        Args:
+            idempotency_key: Idempotency-Key 请求头
+            payload: 请求内容（不含会话ID、截止时间等不影响结果的字段）
+
+        Returns:
+            去重key
+        """
+        if idempotency_key and idempotency_key.strip():
+            return f"header:{idempotency_key.strip()}"
+        return PAYLOAD_KEY_PREFIX + hashlib.sha256(normalize_payload(payload).encode("utf-8")).hexdigest()
+
+    def _purge(self):
+        """清理超出幂等窗口的已完成执行"""
+        now = time.monotonic()
+        expired = [
+            key for key, flight in self._flights.items()
+            if flight.task.done() and now - flight.created_at > self.window_seconds
+        ]
+        for key in expired:
+            self._flights.pop(key, None)
+
+    def get(self, key: str) -> Optional[Flight]:
+        """
+        查找可复用的执行（执行中，或已完整完成且在幂等窗口/宽限期内）
+
+        Args:
+            key: 去重key
+
+        Returns:
+            Flight；没有可复用的执行时返回None
+        """
+        self._purge()
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        if flight.task.done() and (
+            flight.task.cancelled()
+            or flight.task.exception() is not None
+            or getattr(flight.task.result(), "status", None) in NON_REUSABLE_STATUSES
+            or (
+                key.startswith(PAYLOAD_KEY_PREFIX)
+                and time.monotonic() - (flight.finished_at or flight.created_at) > self.grace_seconds
+            )
+        ):
+            # 出错、被取消、需要人工介入或部分结果的执行不复用；按请求内容识别的执行完成后只在宽限期内复用
+            self._flights.pop(key, None)
+            return None
+        flight.joined += 1
+        self.coalesced += 1
+        return flight
+
+    def session_in_use(self, session_id: str) -> bool:
+        """会话ID是否已被某次执行使用（执行中，或已完成且仍在幂等窗口内）"""
+        self._purge()
+        return any(flight.session_id == session_id for flight in self._flights.values())
+
+    def start(self, key: str, session_id: str, coro: Awaitable[Any]) -> Flight:
+        """
+        启动一次新的共享执行
+
+        Args:
+            key: 去重key
+            session_id: 会话ID
+            coro: 执行协程（返回最终响应）
+
+        Returns:
+            Flight
+        """
+        flight = Flight(key=key, session_id=session_id, task=asyncio.create_task(coro), created_at=time.monotonic())
+        flight.task.add_done_callback(lambda _: setattr(flight, "finished_at", time.monotonic()))
+        self._flights[key] = flight
+        return flight
+
+    def _cancel_if_abandoned(self, flight: Flight):
+        if flight.waiters == 0 and not flight.task.done():
+            logger.warning(f"⚠️ 会话 {flight.session_id} 的所有客户端均已断开超过{self.grace_seconds}秒，取消执行")
+            get_run_registry().cancel(flight.session_id, CANCEL_CLIENT_DISCONNECT)
+
+    async def wait(self, flight: Flight, request: Optional[Request] = None) -> Optional[Any]:
+        """
+        等待共享执行的结果，同时检测当前客户端是否断开
+
+        Args:
+            flight: 共享执行
+            request: 当前HTTP请求
+
+        Returns:
+            执行结果；当前客户端已断开时返回None（执行出错时抛出对应异常）
+        """
+        flight.waiters += 1
+        try:
+            while True:
+                done, _ = await asyncio.wait({flight.task}, timeout=DISCONNECT_POLL_SECONDS)
+                if done:
+                    return flight.task.result()
+                if request is not None and await request.is_disconnected():
+                    logger.info(f"客户端已断开，不再等待会话 {flight.session_id} 的执行")
+                    return None
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                asyncio.get_running_loop().call_later(self.grace_seconds, self._cancel_if_abandoned, flight)
+
+
+_travel_single_flight = SingleFlight()
+
+
+def get_travel_single_flight() -> SingleFlight:
+    """获取 /travel 去重单例"""
+    return _travel_single_flight
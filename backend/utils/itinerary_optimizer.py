@@ -0,0 +1,387 @@
+"""
+行程路线本地优化（每日行程骨架）
+原来每日行程的景点顺序和景点间路线（DailyItineraryFormat / PathFormat）由LLM阅读大量 maps_direction_* 结果推理得出，
+景点两两之间都可能查询一次路线（O(n²)次工具调用）。
+
+这里用地图助手查到的景点坐标在本地预先求解：
+1. 向量化计算全部景点之间的球面距离矩阵（NumPy）
+2. 按坐标把景点聚成 days 组（均衡的k-means），每组一天
+3. 每天内用最近邻 + 2-opt 排出游览顺序
+4. 只有排好顺序后相邻的景点之间才调用高德路线工具查询实际交通时间（O(n)次）
+
+结果作为行程骨架写进replan的提示词，LLM在骨架的基础上安排餐饮、休息和描述，不再自行推算顺序和路线。
+"""
+import math
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.messages import AIMessage, ToolMessage
+
+from utils.completion_check import iter_structured_records
+from utils.poi_store import get_poi_store, parse_location
+from utils.tool_projection import parse_json_output
+from utils.tool_data_storage import get_tool_storage
+
+logger = logging.getLogger("utils.itinerary_optimizer")
+
+# 每天最多安排的景点数（超出的按搜索结果排名靠后的丢弃）
+MAX_ATTRACTIONS_PER_DAY = 4
+# 直线距离不超过该值（米）的相邻景点按步行查询，否则按公交/地铁查询
+WALKING_MAX_METERS = 1500
+# 查询相邻景点交通时间的总超时（秒），超时的路段使用直线距离估算
+LEG_TIMEOUT_SECONDS = 15
+# 同时查询的路段数
+LEG_CONCURRENCY = 4
+# 直线距离估算时使用的速度（米/分钟）：步行 / 公共交通（含换乘等待）
+_ESTIMATE_SPEED = {"walking": 80, "transit": 300}
+
+# 高德风景名胜类POI的类型编码前缀
+_ATTRACTION_TYPECODE_PREFIX = "11"
+_ATTRACTION_WORDS = ("景点", "景区", "名胜", "公园", "博物馆", "古镇", "寺", "游览")
+
+_LEG_TOOLS = {
+    "walking": ("maps_direction_walking", "步行"),
+    "transit": ("maps_direction_transit_integrated", "公交/地铁"),
+    "driving": ("maps_direction_driving", "驾车"),
+}
+
+_EARTH_RADIUS_METERS = 6371000
+
+
+@dataclass
+class Leg:
+    """相邻两个景点之间的一段路线"""
+    origin: Dict[str, Any]
+    destination: Dict[str, Any]
+    straight_meters: float
+    mode: str = "walking"
+    minutes: Optional[float] = None
+    meters: Optional[float] = None
+    estimated: bool = True
+
+
+@dataclass
+class ItinerarySkeleton:
+    """每日行程骨架：每天的景点游览顺序和相邻景点之间的路线"""
+    days: List[List[Dict[str, Any]]]
+    legs: List[List[Leg]] = field(default_factory=list)
+
+    @property
+    def total_straight_meters(self) -> float:
+        return sum(leg.straight_meters for day in self.legs for leg in day)
+
+
+def distance_matrix(coords: np.ndarray) -> np.ndarray:
+    """
+    向量化计算两两之间的球面距离
+
+    Args:
+        coords: n×2 数组，每行为 (经度, 纬度)
+
+    Returns:
+        n×n 距离矩阵（米）
+    """
+    radians = np.radians(coords)
+    lng, lat = radians[:, 0:1], radians[:, 1:2]
+    a = (
+        np.sin((lat.T - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lat.T) * np.sin((lng.T - lng) / 2) ** 2
+    )
+    return 2 * _EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def cluster_days(coords: np.ndarray, days: int, iterations: int = 20) -> List[List[int]]:
+    """
+    把景点按坐标聚成 days 组，每组景点数尽量均衡
+
+    先在平面近似坐标上做k-means（最远点初始化，结果确定），再按到各中心的距离从近到远、
+    在每组容量 ceil(n/days) 内分配景点，避免某一天景点过多
+
+    Args:
+        coords: n×2 数组 (经度, 纬度)，按重要程度排序
+        days: 天数
+
+    Returns:
+        每组景点的下标列表（按组内最重要的景点排序，组内顺序未优化）
+    """
+    n = len(coords)
+    k = max(min(days, n), 1)
+    # 经度按纬度缩放，近似成平面坐标
+    points = coords * np.array([math.cos(math.radians(float(coords[:, 1].mean()))), 1.0])
+
+    centers = [points[0]]
+    for _ in range(1, k):
+        nearest = np.min(np.linalg.norm(points[:, None, :] - np.array(centers)[None, :, :], axis=2), axis=1)
+        centers.append(points[int(np.argmax(nearest))])
+    centers = np.array(centers)
+
+    labels = np.zeros(n, dtype=int)
+    for _ in range(iterations):
+        labels = np.argmin(np.linalg.norm(points[:, None, :] - centers[None, :, :], axis=2), axis=1)
+        updated = np.array([points[labels == c].mean(axis=0) if np.any(labels == c) else centers[c] for c in range(k)])
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+
+    # 均衡分配：按 (景点, 组) 的距离从近到远分配，每组不超过容量
+    capacity = math.ceil(n / k)
+    distances = np.linalg.norm(points[:, None, :] - centers[None, :, :], axis=2)
+    assigned = np.full(n, -1)
+    sizes = np.zeros(k, dtype=int)
+    for flat in np.argsort(distances, axis=None):
+        point, cluster = divmod(int(flat), k)
+        if assigned[point] == -1 and sizes[cluster] < capacity:
+            assigned[point] = cluster
+            sizes[cluster] += 1
+
+    groups = [sorted(np.flatnonzero(assigned == c).tolist()) for c in range(k)]
+    return sorted((group for group in groups if group), key=lambda group: group[0])
+
+
+def order_route(dist: np.ndarray, indices: List[int]) -> List[int]:
+    """
+    一天内的游览顺序（不回到起点的开放路径）：以每个景点为起点做最近邻，取最短的一条，再做2-opt优化
+
+    Args:
+        dist: 全部景点的距离矩阵
+        indices: 当天的景点下标
+
+    Returns:
+        排好顺序的景点下标
+    """
+    if len(indices) <= 2:
+        return list(indices)
+    sub = dist[np.ix_(indices, indices)]
+    size = len(indices)
+
+    def length(route: List[int]) -> float:
+        return float(sub[route[:-1], route[1:]].sum())
+
+    best = None
+    for start in range(size):
+        route, remaining = [start], set(range(size)) - {start}
+        while remaining:
+            last = route[-1]
+            route.append(min(remaining, key=lambda j: sub[last, j]))
+            remaining.discard(route[-1])
+        if best is None or length(route) < length(best):
+            best = route
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(size - 1):
+            for j in range(i + 1, size):
+                # 反转 best[i:j+1]：只有 (i-1,i) 和 (j,j+1) 两条边变化（开放路径的两端没有对应的边）
+                before = (sub[best[i - 1], best[i]] if i > 0 else 0) + (sub[best[j], best[j + 1]] if j + 1 < size else 0)
+                after = (sub[best[i - 1], best[j]] if i > 0 else 0) + (sub[best[i], best[j + 1]] if j + 1 < size else 0)
+                if after + 1e-6 < before:
+                    best[i:j + 1] = best[i:j + 1][::-1]
+                    improved = True
+    return [indices[i] for i in best]
+
+
+def is_attraction(poi: Dict[str, Any], tool_args: Dict[str, Any]) -> bool:
+    """POI是否为景点（风景名胜类型编码，或用景点类关键词搜索到的）"""
+    if str(poi.get("typecode") or "").startswith(_ATTRACTION_TYPECODE_PREFIX):
+        return True
+    text = f"{tool_args.get('keywords', '')}{poi.get('type', '')}"
+    return any(word in text for word in _ATTRACTION_WORDS)
+
+
+def collect_attractions(tool_messages: List[ToolMessage]) -> List[Dict[str, Any]]:
+    """
+    从地图助手的POI搜索结果中收集有坐标的景点（按出现顺序去重，缺少坐标时从POI存储补全）
+
+    Args:
+        tool_messages: 工具调用结果
+
+    Returns:
+        景点列表（高德POI字段，location为 "经度,纬度"）
+    """
+    store = get_poi_store()
+    attractions, seen = [], set()
+    for entity, poi, tool_args in iter_structured_records(tool_messages):
+        if entity != "poi" or not is_attraction(poi, tool_args):
+            continue
+        key = poi.get("id") or poi.get("name")
+        if not key or key in seen:
+            continue
+        if parse_location(poi.get("location")) is None:
+            stored = store.get_poi(poi.get("id"))
+            if not stored or parse_location(stored.get("location")) is None:
+                continue
+            poi = {**stored, **{k: v for k, v in poi.items() if v}, "location": stored["location"]}
+        seen.add(key)
+        attractions.append(poi)
+    return attractions
+
+
+def build_skeleton(attractions: List[Dict[str, Any]], days: int) -> Optional[ItinerarySkeleton]:
+    """
+    求解每日行程骨架（只用直线距离，不调用工具）
+
+    Args:
+        attractions: 有坐标的景点，按重要程度排序
+        days: 行程天数
+
+    Returns:
+        行程骨架；景点少于2个时返回None
+    """
+    days = max(int(days or 1), 1)
+    attractions = attractions[:days * MAX_ATTRACTIONS_PER_DAY]
+    if len(attractions) < 2:
+        return None
+
+    coords = np.array([parse_location(poi["location"]) for poi in attractions], dtype=float)
+    dist = distance_matrix(coords)
+    skeleton = ItinerarySkeleton(days=[])
+    for group in cluster_days(coords, days):
+        route = order_route(dist, group)
+        skeleton.days.append([attractions[i] for i in route])
+        skeleton.legs.append([
+            Leg(
+                origin=attractions[a],
+                destination=attractions[b],
+                straight_meters=float(dist[a, b]),
+                mode="walking" if dist[a, b] <= WALKING_MAX_METERS else "transit",
+            )
+            for a, b in zip(route[:-1], route[1:])
+        ])
+    return skeleton
+
+
+def _find_number(data: Any, key: str) -> Optional[float]:
+    """广度优先查找最浅层的数值字段（高德路线结果中第一条方案的 duration / distance）"""
+    queue = [data]
+    while queue:
+        node = queue.pop(0)
+        if isinstance(node, dict):
+            if key in node:
+                try:
+                    return float(node[key])
+                except (TypeError, ValueError):
+                    pass
+            queue.extend(node.values())
+        elif isinstance(node, list):
+            queue.extend(node[:1])
+    return None
+
+
+async def fetch_leg_times(skeleton: ItinerarySkeleton, tools: List[Any], city: str) -> int:
+    """
+    只为骨架中相邻的景点调用高德路线工具，填入实际交通时间（经 execute_tool_calls，可命中工具缓存）
+
+    Args:
+        skeleton: 行程骨架
+        tools: 可用的工具（包含 maps_direction_*）
+        city: 目的地城市（公交路线需要）
+
+    Returns:
+        成功查询到交通时间的路段数；超时或失败的路段保留直线距离估算
+    """
+    from utils.agent_tools import execute_tool_calls
+
+    tool_names = {getattr(tool, "name", "") for tool in tools}
+    semaphore = asyncio.Semaphore(LEG_CONCURRENCY)
+
+    async def _fetch(leg: Leg) -> bool:
+        mode = leg.mode
+        if _LEG_TOOLS[mode][0] not in tool_names:
+            mode = "driving" if mode == "transit" else mode
+        tool_name = _LEG_TOOLS[mode][0]
+        if tool_name not in tool_names:
+            return False
+        args = {"origin": leg.origin["location"], "destination": leg.destination["location"]}
+        if mode == "transit":
+            args.update({"city": city, "cityd": city})
+        call = AIMessage(content="", tool_calls=[{"name": tool_name, "args": args, "id": f"leg-{id(leg)}"}])
+        async with semaphore:
+            messages = await execute_tool_calls(call, tools, logger, category="map", storage=get_tool_storage())
+        data = parse_json_output(messages[0].artifact) if messages and messages[0].artifact is not None else None
+        seconds = _find_number(data, "duration")
+        if seconds is None:
+            return False
+        leg.mode, leg.minutes, leg.estimated = mode, seconds / 60, False
+        leg.meters = _find_number(data, "distance")
+        return True
+
+    legs = [leg for day in skeleton.legs for leg in day]
+    tasks = [asyncio.ensure_future(_fetch(leg)) for leg in legs]
+    if not tasks:
+        return 0
+    done, pending = await asyncio.wait(tasks, timeout=LEG_TIMEOUT_SECONDS)
+    for task in pending:
+        task.cancel()
+    fetched = sum(1 for task in done if not task.cancelled() and task.exception() is None and task.result())
+    if pending:
+        logger.warning(f"⚠️ 【行程优化】{len(pending)}段路线查询超时，使用直线距离估算")
+    return fetched
+
+
+def render_skeleton(skeleton: ItinerarySkeleton, start_date: str = "") -> str:
+    """
+    把行程骨架渲染成提示词文本
+
+    Args:
+        skeleton: 行程骨架
+        start_date: 出发日期（YYYY-MM-DD），用于标注每天的日期
+
+    Returns:
+        每天一行："第1天（日期）：A →（步行约10分钟，0.8公里）→ B …"
+    """
+    try:
+        start = datetime.strptime(start_date[:10], "%Y-%m-%d")
+    except ValueError:
+        start = None
+
+    lines = []
+    for day_index, (pois, legs) in enumerate(zip(skeleton.days, skeleton.legs)):
+        date = f"（{(start + timedelta(days=day_index)).strftime('%Y-%m-%d')}）" if start else ""
+        parts = [pois[0]["name"]]
+        for leg, poi in zip(legs, pois[1:]):
+            minutes = leg.minutes if leg.minutes is not None else leg.straight_meters / _ESTIMATE_SPEED.get(leg.mode, _ESTIMATE_SPEED["transit"])
+            meters = leg.meters if leg.meters is not None else leg.straight_meters
+            note = "，直线估算" if leg.estimated else ""
+            parts.append(f"→（{_LEG_TOOLS[leg.mode][1]}约{max(round(minutes), 1)}分钟，{meters / 1000:.1f}公里{note}）→ {poi['name']}")
+        lines.append(f"第{day_index + 1}天{date}：{' '.join(parts)}")
+    return "\n".join(lines)
+
+
+async def plan_itinerary_skeleton(
+    tool_messages: List[ToolMessage],
+    days: int,
+    destination: str,
+    start_date: str,
+    tools: List[Any]
+) -> Optional[str]:
+    """
+    从工具结果求解每日行程骨架并查询相邻景点的交通时间
+
+    Args:
+        tool_messages: 会话中的工具调用结果
+        days: 行程天数
+        destination: 目的地城市
+        start_date: 出发日期
+        tools: 可用的工具（没有路线工具时全部使用直线距离估算）
+
+    Returns:
+        行程骨架文本；景点坐标不足时返回None
+    """
+    attractions = collect_attractions(tool_messages)
+    skeleton = build_skeleton(attractions, days)
+    if skeleton is None:
+        return None
+    fetched = await fetch_leg_times(skeleton, tools, destination)
+    poi_count = sum(len(day) for day in skeleton.days)
+    leg_count = sum(len(day) for day in skeleton.legs)
+    logger.info(
+        f"✅ 【行程优化】{poi_count}个景点分为{len(skeleton.days)}天，"
+        f"查询相邻路段{fetched}/{leg_count}段（两两查询需要{poi_count * (poi_count - 1) // 2}段），"
+        f"总直线距离{skeleton.total_straight_meters / 1000:.1f}公里"
+    )
+    return render_skeleton(skeleton, start_date)
@@ -0,0 +1,234 @@
+"""
+LLM用量统计
+通过LangChain回调读取每次模型调用返回的token用量（usage_metadata / response_metadata.token_usage），
+按节点统计提示词缓存命中情况（cached_tokens / input_tokens），
+并按会话汇总每次调用的token用量和耗时（总计 / 按节点 / 按子Agent），随会话状态一起保存。
+
+chain.ainvoke（prompt | llm | parser）的返回值已经是解析后的dict，拿不到元数据，
+所以统一通过回调在LLM调用结束时读取。
+"""
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+logger = logging.getLogger("utils.llm_usage")
+
+
+def extract_usage(message: Any = None, llm_output: Optional[dict] = None) -> Dict[str, int]:
+    """
+    从模型响应中提取token用量（兼容 usage_metadata 和 OpenAI 格式的 token_usage）
+
+    Args:
+        message: AIMessage（可选）
+        llm_output: LLMResult.llm_output（可选）
+
+    Returns:
+        {"input_tokens", "output_tokens", "cached_tokens", "reasoning_tokens"}
+    """
+    usage = {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "reasoning_tokens": 0}
+
+    usage_metadata = getattr(message, "usage_metadata", None) if message is not None else None
+    if usage_metadata:
+        usage["input_tokens"] = usage_metadata.get("input_tokens", 0) or 0
+        usage["output_tokens"] = usage_metadata.get("output_tokens", 0) or 0
+        usage["cached_tokens"] = (usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+        usage["reasoning_tokens"] = (usage_metadata.get("output_token_details") or {}).get("reasoning", 0) or 0
+        return usage
+
+    token_usage = None
+    response_metadata = getattr(message, "response_metadata", None) if message is not None else None
+    if response_metadata:
+        token_usage = response_metadata.get("token_usage")
+    if not token_usage and llm_output:
+        token_usage = llm_output.get("token_usage")
+    if token_usage:
+        usage["input_tokens"] = token_usage.get("prompt_tokens", 0) or 0
+        usage["output_tokens"] = token_usage.get("completion_tokens", 0) or 0
+        usage["cached_tokens"] = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+        usage["reasoning_tokens"] = (token_usage.get("completion_tokens_details") or {}).get("reasoning_tokens", 0) or 0
+    return usage
+
+
+class PromptCacheStats:
+    """按节点统计提示词缓存命中率（进程级）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def record(self, node: str, input_tokens: int, cached_tokens: int):
+        """记录一次调用的输入token数和命中缓存的token数"""
+        with self._lock:
+            stats = self._stats.setdefault(node, {"calls": 0, "input_tokens": 0, "cached_tokens": 0})
+            stats["calls"] += 1
+            stats["input_tokens"] += input_tokens
+            stats["cached_tokens"] += cached_tokens
+
+    def hit_rate(self, node: str) -> float:
+        """节点的累计缓存命中率（命中缓存的输入token占比）"""
+        stats = self._stats.get(node)
+        if not stats or not stats["input_tokens"]:
+            return 0.0
+        return stats["cached_tokens"] / stats["input_tokens"]
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """所有节点的统计信息"""
+        with self._lock:
+            return {
+                node: {**stats, "hit_rate": round(stats["cached_tokens"] / stats["input_tokens"], 4) if stats["input_tokens"] else 0.0}
+                for node, stats in self._stats.items()
+            }
+
+
+_prompt_cache_stats = PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """获取提示词缓存统计单例"""
+    return _prompt_cache_stats
+
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cached_tokens", "reasoning_tokens")
+
+
+def _empty_bucket() -> Dict[str, Any]:
+    return {"calls": 0, "failed_calls": 0, **{name: 0 for name in USAGE_FIELDS}, "wall_time": 0.0}
+
+
+class SessionUsage:
+    """
+    单个会话的LLM用量统计
+
+    节点名称形如 plan、dispatch、replan、sub_agent.map、completion_check.map，
+    sub_agent.X 和 completion_check.X 同时计入子Agent X 的统计
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals: Dict[str, Any] = _empty_bucket()
+        self.by_node: Dict[str, Dict[str, Any]] = {}
+        self.by_sub_agent: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _sub_agent_of(node: str) -> Optional[str]:
+        prefix, _, agent_type = node.partition(".")
+        if prefix in ("sub_agent", "completion_check") and agent_type:
+            return agent_type
+        return None
+
+    def record(self, node: str, usage: Dict[str, int], wall_time: float, success: bool = True):
+        """
+        记录一次LLM调用
+
+        Args:
+            node: 节点名称
+            usage: token用量（extract_usage的返回值）
+            wall_time: 本次调用耗时（秒）
+            success: 调用是否成功
+        """
+        node = node or "unknown"
+        with self._lock:
+            buckets = [self.totals, self.by_node.setdefault(node, _empty_bucket())]
+            agent_type = self._sub_agent_of(node)
+            if agent_type:
+                buckets.append(self.by_sub_agent.setdefault(agent_type, _empty_bucket()))
+            for bucket in buckets:
+                bucket["calls"] += 1
+                if not success:
+                    bucket["failed_calls"] += 1
+                for name in USAGE_FIELDS:
+                    bucket[name] += usage.get(name, 0) or 0
+                bucket["wall_time"] = round(bucket["wall_time"] + wall_time, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可JSON化的字典"""
+        with self._lock:
+            return {
+                "totals": dict(self.totals),
+                "by_node": {node: dict(bucket) for node, bucket in self.by_node.items()},
+                "by_sub_agent": {agent: dict(bucket) for agent, bucket in self.by_sub_agent.items()},
+            }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "SessionUsage":
+        """从保存的字典恢复（resume/feedback时在原有统计上继续累加）"""
+        usage = cls()
+        if not data:
+            return usage
+        usage.totals.update(data.get("totals") or {})
+        for node, bucket in (data.get("by_node") or {}).items():
+            usage.by_node[node] = {**_empty_bucket(), **bucket}
+        for agent_type, bucket in (data.get("by_sub_agent") or {}).items():
+            usage.by_sub_agent[agent_type] = {**_empty_bucket(), **bucket}
+        return usage
+
+    def summary_text(self) -> str:
+        """用于日志的简短汇总（按耗时排序的前几个节点）"""
+        totals = self.totals
+        top_nodes = sorted(self.by_node.items(), key=lambda item: item[1]["wall_time"], reverse=True)[:5]
+        nodes_text = ", ".join(
+            f"{node}: {bucket['calls']}次/{bucket['input_tokens'] + bucket['output_tokens']}token/{bucket['wall_time']:.1f}s"
+            for node, bucket in top_nodes
+        )
+        return (
+            f"共{totals['calls']}次调用（失败{totals['failed_calls']}次），输入{totals['input_tokens']} token"
+            f"（缓存命中{totals['cached_tokens']}），输出{totals['output_tokens']} token"
+            f"（推理{totals['reasoning_tokens']}），耗时{totals['wall_time']:.1f}s；{nodes_text}"
+        )
+
+
+# 当前会话的用量统计（API在执行graph前设置；asyncio任务会继承同一个对象）
+_current_session_usage: ContextVar[Optional[SessionUsage]] = ContextVar("session_usage", default=None)
+
+
+def set_session_usage(usage: Optional[SessionUsage]):
+    """
+    设置当前上下文的会话用量统计
+
+    Returns:
+        ContextVar token，用于 reset_session_usage 恢复
+    """
+    return _current_session_usage.set(usage)
+
+
+def reset_session_usage(token):
+    """恢复 set_session_usage 之前的会话用量统计"""
+    _current_session_usage.reset(token)
+
+
+def get_session_usage() -> Optional[SessionUsage]:
+    """获取当前上下文的会话用量统计（不在会话中时返回None）"""
+    return _current_session_usage.get()
+
+
+class UsageCallbackHandler(AsyncCallbackHandler):
+    """在LLM调用结束时读取token用量，记录到对应节点的统计中（本次调用的用量保存在 self.usage）"""
+
+    def __init__(self, node: str):
+        self.node = node
+        self.usage: Dict[str, int] = {name: 0 for name in USAGE_FIELDS}
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        message = None
+        try:
+            generation = response.generations[0][0]
+            message = getattr(generation, "message", None)
+        except (IndexError, TypeError):
+            pass
+
+        usage = extract_usage(message, response.llm_output)
+        for name in USAGE_FIELDS:
+            self.usage[name] += usage[name]
+        if not usage["input_tokens"]:
+            return
+
+        stats = get_prompt_cache_stats()
+        stats.record(self.node, usage["input_tokens"], usage["cached_tokens"])
+        logger.info(
+            f"【提示词缓存】{self.node}: 本次命中 {usage['cached_tokens']}/{usage['input_tokens']} token，"
+            f"累计命中率 {stats.hit_rate(self.node):.1%}"
+        )
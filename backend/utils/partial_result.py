@@ -0,0 +1,292 @@
+"""
+部分结果（截止时间兜底）
+/travel 设置了截止时间时，超时后工作流会被取消，这里用已经拿到的工具结果直接拼出一份
+AmusementFormat（不再调用LLM），并标出哪些板块未完成，保证用户在固定时间内总能拿到结果。
+
+工具结果来自两处：
+1. 工作流最近一次完成的节点输出的状态（state["messages"]）
+2. 正在执行的节点中已经完成的工具调用（excute节点结束前不会输出状态，
+   所以 execute_tool_calls 每完成一批工具调用就登记到当前执行的收集器中）
+"""
+import logging
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, ToolMessage
+
+from utils.tool_projection import (
+    parse_train_tickets,
+    parse_flights,
+    parse_pois,
+    parse_weather,
+    parse_hotels,
+    hotel_price_per_night,
+)
+
+logger = logging.getLogger("utils.partial_result")
+
+# AmusementFormat中检查完成情况的板块（字段名）
+SECTIONS = [
+    "transportation",
+    "accommodation",
+    "weather",
+    "attractions",
+    "restaurants",
+    "daily_itinerary",
+    "budget_breakdown",
+]
+
+# 每个板块最多保留的条目数
+MAX_ITEMS_PER_SECTION = 8
+
+# 12306席位名称 → TrainTicketFormat字段前缀
+_SEAT_FIELDS = {
+    "二等座": "second_class",
+    "一等座": "first_class",
+    "商务座": "business_class",
+}
+
+_TRAIN_TOOLS = {"get-tickets"}
+_FLIGHT_TOOLS = {"searchFlightsByDepArr", "searchFlightItineraries", "getFlightTransferInfo"}
+_POI_TOOLS = {"maps_text_search", "maps_around_search"}
+_HOTEL_TOOLS = {"find-hotels", "search-hotels", "searchHotels"}
+
+
+# ========================================
+# 执行中的工具结果收集
+# ========================================
+
+_current_collector: ContextVar[Optional[List[ToolMessage]]] = ContextVar("tool_result_collector", default=None)
+
+
+def set_tool_collector(collector: Optional[List[ToolMessage]]):
+    """
+    设置当前上下文的工具结果收集器
+
+    Returns:
+        ContextVar token，用于 reset_tool_collector 恢复
+    """
+    return _current_collector.set(collector)
+
+
+def reset_tool_collector(token):
+    """恢复 set_tool_collector 之前的收集器"""
+    _current_collector.reset(token)
+
+
+def collect_tool_messages(messages: Iterable[ToolMessage]):
+    """将工具调用结果登记到当前执行的收集器（不在API执行中时忽略）"""
+    collector = _current_collector.get()
+    if collector is not None:
+        collector.extend(messages)
+
+
+# ========================================
+# 由工具结果拼出攻略
+# ========================================
+
+def _raw_output(msg: ToolMessage) -> Any:
+    """工具原始输出（artifact），反序列化后的会话中只有投影后的content"""
+    return msg.artifact if getattr(msg, "artifact", None) is not None else msg.content
+
+
+def _text(value: Any) -> Optional[str]:
+    if value in (None, "", []):
+        return None
+    return str(value)
+
+
+def _train_ticket(ticket: Dict[str, Any]) -> Dict[str, Any]:
+    item = {
+        "train_no": ticket.get("train_code") or "",
+        "from_station": ticket.get("from_station") or "",
+        "to_station": ticket.get("to_station") or "",
+        "departure_time": ticket.get("start_time") or "",
+        "arrival_time": ticket.get("arrive_time") or "",
+        "duration": ticket.get("duration") or "",
+    }
+    for seat in ticket.get("seats") or []:
+        prefix = _SEAT_FIELDS.get(str(seat.get("name") or "").strip())
+        if prefix:
+            item[f"{prefix}_price"] = _text(seat.get("price"))
+            item[f"{prefix}_available"] = _text(seat.get("num"))
+    return item
+
+
+def _flight_ticket(flight: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "flight_no": str(flight.get("flight_no") or ""),
+        "from_airport": str(flight.get("dep_airport") or ""),
+        "to_airport": str(flight.get("arr_airport") or ""),
+        "departure_time": str(flight.get("dep_time") or ""),
+        "arrival_time": str(flight.get("arr_time") or ""),
+        "duration": "",
+        "price": _text(flight.get("price")),
+    }
+
+
+def _is_outbound(departure: str, origin: str, destination: str) -> bool:
+    """按出发站/机场判断是去程还是返程（无法判断时视为去程）"""
+    departure = departure or ""
+    if destination and destination in departure and not (origin and origin in departure):
+        return False
+    return True
+
+
+def _poi(poi: Dict[str, Any], default_type: str) -> Dict[str, Any]:
+    poi_type = str(poi.get("type") or "").split(";")[-1]
+    biz_ext = poi.get("biz_ext") if isinstance(poi.get("biz_ext"), dict) else {}
+    return {
+        "name": str(poi.get("name") or ""),
+        "type": poi_type or default_type,
+        "address": _text(poi.get("address")),
+        "rating": _text(biz_ext.get("rating")),
+        "avg_cost": _text(biz_ext.get("cost")),
+    }
+
+
+def _is_restaurant(poi: Dict[str, Any]) -> bool:
+    return "餐饮" in str(poi.get("type") or "") or str(poi.get("typecode") or "").startswith("05")
+
+
+def _is_hotel_poi(poi: Dict[str, Any]) -> bool:
+    return "住宿" in str(poi.get("type") or "") or str(poi.get("typecode") or "").startswith("10")
+
+
+def _dedupe(items: List[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    seen = set()
+    result = []
+    for item in items:
+        value = item.get(key)
+        if not value or value in seen:
+            continue
+        seen.add(value)
+        result.append(item)
+    return result[:MAX_ITEMS_PER_SECTION]
+
+
+def find_incomplete_sections(amusement_info: Optional[Dict[str, Any]]) -> List[str]:
+    """
+    找出攻略中为空的板块
+
+    Args:
+        amusement_info: 攻略字典（AmusementFormat.model_dump()）
+
+    Returns:
+        为空的板块字段名列表（按 SECTIONS 的顺序）
+    """
+    if not amusement_info:
+        return list(SECTIONS)
+
+    incomplete = []
+    for section in SECTIONS:
+        value = amusement_info.get(section)
+        if isinstance(value, dict):
+            empty = not any(v not in (None, "", [], "未完成") for v in value.values())
+        else:
+            empty = not value
+        if empty:
+            incomplete.append(section)
+    return incomplete
+
+
+def build_partial_amusement_info(
+    context: Dict[str, Any],
+    messages: Iterable[BaseMessage]
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    用已经拿到的工具结果拼出一份攻略（不调用LLM）
+
+    每日行程和预算明细需要LLM综合生成，部分结果中始终标记为未完成
+
+    Args:
+        context: 出行信息（origin、destination、date、days）
+        messages: 会话消息（只使用其中的ToolMessage）
+
+    Returns:
+        (攻略字典（符合AmusementFormat）, 未完成的板块列表)
+    """
+    origin = context.get("origin", "") or ""
+    destination = context.get("destination", "") or ""
+
+    outbound, return_trip, outbound_flights, return_flights = [], [], [], []
+    hotels, weather, attractions, restaurants = [], [], [], []
+
+    for msg in messages:
+        if not isinstance(msg, ToolMessage):
+            continue
+        name = getattr(msg, "name", "") or ""
+        raw = _raw_output(msg)
+        try:
+            if name in _TRAIN_TOOLS:
+                for ticket in parse_train_tickets(raw):
+                    item = _train_ticket(ticket)
+                    (outbound if _is_outbound(item["from_station"], origin, destination) else return_trip).append(item)
+            elif name in _FLIGHT_TOOLS:
+                for flight in parse_flights(raw):
+                    item = _flight_ticket(flight)
+                    # 机场名（如“浦东国际机场”）不含城市名，优先按出发城市判断方向
+                    departure = str(flight.get("dep_city") or item["from_airport"])
+                    (outbound_flights if _is_outbound(departure, origin, destination) else return_flights).append(item)
+            elif name in _HOTEL_TOOLS:
+                for hotel in parse_hotels(raw):
+                    hotels.append({
+                        "hotel_name": str(hotel.get("name") or ""),
+                        "hotel_star": _text(hotel.get("star")),
+                        "address": _text(hotel.get("address")),
+                        # 酒店工具返回的是入住晚数的总价
+                        "price_per_night": _text(hotel_price_per_night(hotel)),
+                        "rating": _text(hotel.get("score")),
+                        "distance_to_center": _text(hotel.get("distance")),
+                    })
+            elif name == "maps_weather":
+                city, forecasts = parse_weather(raw)
+                if destination and city and destination not in city and city not in destination:
+                    continue
+                for forecast in forecasts:
+                    weather.append({
+                        "date": str(forecast.get("date") or ""),
+                        "weather_desc": f"白天{forecast.get('dayweather', '-')}，夜间{forecast.get('nightweather', '-')}",
+                        "temperature_high": _text(forecast.get("daytemp")),
+                        "temperature_low": _text(forecast.get("nighttemp")),
+                        "wind": _text(f"{forecast.get('daywind', '')}风{forecast.get('daypower', '')}级" if forecast.get("daywind") else None),
+                    })
+            elif name in _POI_TOOLS:
+                for poi in parse_pois(raw):
+                    if _is_hotel_poi(poi):
+                        continue
+                    if _is_restaurant(poi):
+                        restaurants.append(_poi(poi, "餐厅"))
+                    else:
+                        attractions.append(_poi(poi, "景点"))
+        except Exception as e:
+            logger.warning(f"解析工具 {name} 的结果失败，部分结果中忽略: {e}")
+
+    amusement_info = {
+        "destination": destination,
+        "travel_dates": f"{context.get('date', '')}起{context.get('days', '')}天",
+        "duration": int(context.get("days") or 0),
+        "summary": "",
+        "transportation": {
+            "outbound": _dedupe(outbound, "train_no") or None,
+            "return_trip": _dedupe(return_trip, "train_no") or None,
+            "outbound_flights": _dedupe(outbound_flights, "flight_no") or None,
+            "return_flights": _dedupe(return_flights, "flight_no") or None,
+            "local_transport": None,
+        },
+        "accommodation": _dedupe(hotels, "hotel_name"),
+        "weather": _dedupe(weather, "date"),
+        "attractions": _dedupe(attractions, "name"),
+        "restaurants": _dedupe(restaurants, "name") or None,
+        "daily_itinerary": [],
+        "budget_breakdown": {"total": "未完成"},
+        "tips": None,
+    }
+
+    incomplete = find_incomplete_sections(amusement_info)
+    amusement_info["summary"] = (
+        f"{origin}→{destination}的行程规划未能在截止时间内全部完成，以下是已经查询到的信息"
+        + (f"（未完成: {'、'.join(incomplete)}）" if incomplete else "")
+    )
+    logger.info(f"✅ 已由工具结果生成部分攻略，未完成板块: {incomplete}")
+    return amusement_info, incomplete
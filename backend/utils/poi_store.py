@@ -0,0 +1,464 @@
+"""
+POI / 地理编码本地存储（地图助手）
+热门目的地的景点、餐厅和地理编码每次会话都要重新调用高德，这里把高德工具的输出持久化到
+data/poi_store.json，并建立索引：
+
+- POI按ID保存（maps_text_search / maps_around_search / maps_search_detail 的输出合并到同一条记录）
+- 关键词搜索按（城市, 关键词）记录返回的POI ID
+- 有坐标的POI按经纬度网格建立空间索引，"X附近的餐厅"这类周边搜索可以在本地回答
+- 地理编码按（地址, 城市）保存
+
+execute_tool_calls 调用这些工具前先尝试在本地回答：数据足够新时直接返回（格式与高德工具输出一致），
+超过刷新时间的数据仍然直接返回，同时在后台重新调用工具刷新。
+
+写入只标记存储已修改，由事件循环在 SAVE_DELAY_SECONDS 后在线程池中合并写入一次（先写临时文件再替换），
+避免每次工具调用都在事件循环上序列化整个存储，写入中途退出也不会损坏文件。
+"""
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from utils.tool_projection import parse_json_output, find_record_list
+from utils.tool_data_storage import get_tool_storage
+
+logger = logging.getLogger("utils.poi_store")
+
+TEXT_SEARCH_TOOL = "maps_text_search"
+AROUND_SEARCH_TOOL = "maps_around_search"
+DETAIL_TOOL = "maps_search_detail"
+GEO_TOOL = "maps_geo"
+POI_STORE_TOOLS = {TEXT_SEARCH_TOOL, AROUND_SEARCH_TOOL, DETAIL_TOOL, GEO_TOOL}
+
+# 数据在该时间内可以直接用于本地回答（秒）
+POI_FRESH_SECONDS = 7 * 24 * 3600
+GEO_FRESH_SECONDS = 90 * 24 * 3600
+# 超过该时间的数据在本地回答的同时后台刷新（秒）
+REFRESH_AFTER_SECONDS = 24 * 3600
+
+# 空间索引网格大小（度，约1公里）
+GRID_DEGREES = 0.01
+# 没有覆盖该区域的周边搜索记录时，本地至少找到这么多POI才直接回答
+MIN_LOCAL_NEARBY_RESULTS = 10
+# 周边搜索默认半径（米，与高德一致）
+DEFAULT_AROUND_RADIUS = 1000
+# 最多保存的POI数量（超出时丢弃最旧的）
+MAX_POIS = 20000
+# 修改后延迟多久写入文件（秒），期间的多次修改合并为一次写入
+SAVE_DELAY_SECONDS = 5
+
+# 关键词搜索/周边搜索中决定查询本身的参数，其余参数（types、page等）作为过滤条件一起作为查询的key
+_TEXT_QUERY_ARGS = ("city", "keywords")
+_AROUND_QUERY_ARGS = ("location", "radius", "keywords")
+
+_INTERNAL_FIELDS = ("fetched_at", "detail_fetched_at", "keywords", "city")
+
+
+def haversine_meters(lng1: float, lat1: float, lng2: float, lat2: float) -> float:
+    """两点之间的球面距离（米）"""
+    lng1, lat1, lng2, lat2 = map(math.radians, (lng1, lat1, lng2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 6371000 * 2 * math.asin(math.sqrt(a))
+
+
+def parse_location(value: Any) -> Optional[Tuple[float, float]]:
+    """解析高德坐标 "经度,纬度"，无法解析时返回None"""
+    try:
+        lng, lat = (float(part) for part in str(value or "").split(","))
+    except ValueError:
+        return None
+    return lng, lat
+
+
+def _norm(value: Any) -> str:
+    return str(value or "").strip().removesuffix("市")
+
+
+class PoiStore:
+    """高德POI和地理编码的持久化存储 + 网格空间索引"""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._pois: Dict[str, Dict[str, Any]] = {}
+        self._text_queries: Dict[str, Dict[str, Any]] = {}
+        self._around_queries: List[Dict[str, Any]] = []
+        self._geocodes: Dict[str, Dict[str, Any]] = {}
+        self._grid: Dict[Tuple[int, int], Set[str]] = {}
+        self._refreshing: Set[str] = set()
+        self._loaded = False
+        self._dirty = False
+        self._save_scheduled = False
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- 持久化 ----------
+
+    def _file(self) -> Path:
+        if self.path is None:
+            self.path = get_tool_storage().storage_dir.parent / "poi_store.json"
+        return self.path
+
+    def load(self):
+        """从文件加载存储（只加载一次，启动时在线程池中预先调用，避免第一次工具调用时阻塞事件循环）"""
+        self._ensure_loaded()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        path = self._file()
+        if not path.exists():
+            return
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except Exception as e:
+            # 保留损坏的文件以便排查，不被之后的写入覆盖
+            backup = path.with_name(path.name + ".corrupt")
+            logger.warning(f"⚠️ 加载POI存储失败，将重新建立（原文件已移到 {backup}）: {e}")
+            try:
+                os.replace(path, backup)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._pois = data.get("pois") or {}
+            self._text_queries = data.get("text_queries") or {}
+            self._around_queries = data.get("around_queries") or []
+            self._geocodes = data.get("geocodes") or {}
+            for poi_id, poi in self._pois.items():
+                self._index(poi_id, poi)
+        logger.info(f"✅ 【POI存储】已加载{len(self._pois)}个POI、{len(self._geocodes)}个地理编码")
+
+    def flush(self):
+        """把修改写入文件（先写临时文件再替换，写入中途退出不会损坏原文件）；没有修改时不写入"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            text = json.dumps({
+                "pois": self._pois,
+                "text_queries": self._text_queries,
+                "around_queries": self._around_queries,
+                "geocodes": self._geocodes,
+            }, ensure_ascii=False)
+        path = self._file()
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"保存POI存储失败: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def _mark_dirty(self):
+        """标记存储已修改：在事件循环中延迟到线程池合并写入，不在事件循环中时（如脚本）直接写入"""
+        with self._lock:
+            self._dirty = True
+            if self._save_scheduled:
+                return
+            self._save_scheduled = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._save_scheduled = False
+            self.flush()
+            return
+
+        async def _flush_later():
+            await asyncio.sleep(SAVE_DELAY_SECONDS)
+            with self._lock:
+                self._save_scheduled = False
+            await asyncio.to_thread(self.flush)
+
+        loop.create_task(_flush_later())
+
+    # ---------- 空间索引 ----------
+
+    @staticmethod
+    def _cell(lng: float, lat: float) -> Tuple[int, int]:
+        return math.floor(lat / GRID_DEGREES), math.floor(lng / GRID_DEGREES)
+
+    def _index(self, poi_id: str, poi: Dict[str, Any]):
+        location = parse_location(poi.get("location"))
+        if location is not None:
+            self._grid.setdefault(self._cell(*location), set()).add(poi_id)
+
+    def nearby(self, location: Tuple[float, float], radius: float, keywords: str = "") -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        查找坐标周边的POI（只包含数据足够新的POI）
+
+        Args:
+            location: (经度, 纬度)
+            radius: 半径（米）
+            keywords: 关键词（匹配POI名称、类型或返回该POI的搜索关键词），为空时不过滤
+
+        Returns:
+            [(距离, POI)]，按距离排序
+        """
+        self._ensure_loaded()
+        lng, lat = location
+        dlat = radius / 111000
+        dlng = radius / (111000 * max(math.cos(math.radians(lat)), 0.01))
+        min_cell, max_cell = self._cell(lng - dlng, lat - dlat), self._cell(lng + dlng, lat + dlat)
+        now = time.time()
+        results = []
+        with self._lock:
+            for lat_cell in range(min_cell[0], max_cell[0] + 1):
+                for lng_cell in range(min_cell[1], max_cell[1] + 1):
+                    for poi_id in self._grid.get((lat_cell, lng_cell), ()):
+                        poi = self._pois[poi_id]
+                        if now - poi.get("fetched_at", 0) > POI_FRESH_SECONDS or not self._matches(poi, keywords):
+                            continue
+                        distance = haversine_meters(lng, lat, *parse_location(poi["location"]))
+                        if distance <= radius:
+                            results.append((distance, poi))
+        results.sort(key=lambda item: item[0])
+        return results
+
+    @staticmethod
+    def _matches(poi: Dict[str, Any], keywords: str) -> bool:
+        keywords = (keywords or "").strip()
+        if not keywords:
+            return True
+        haystack = f"{poi.get('name', '')}{poi.get('type', '')}"
+        return keywords in poi.get("keywords", []) or any(word in haystack for word in keywords.split())
+
+    # ---------- 写入 ----------
+
+    def _merge_poi(self, poi: Dict[str, Any], now: float, keywords: str = "", city: str = "") -> Optional[str]:
+        poi_id = str(poi.get("id") or "")
+        if not poi_id or not poi.get("name"):
+            return None
+        stored = self._pois.setdefault(poi_id, {"keywords": []})
+        stored.update({key: value for key, value in poi.items() if value not in (None, "", [])})
+        stored["fetched_at"] = now
+        if keywords and keywords not in stored["keywords"]:
+            stored["keywords"].append(keywords)
+        if city:
+            stored["city"] = city
+        self._index(poi_id, stored)
+        return poi_id
+
+    def _evict(self):
+        if len(self._pois) <= MAX_POIS:
+            return
+        oldest = sorted(self._pois, key=lambda poi_id: self._pois[poi_id].get("fetched_at", 0))
+        for poi_id in oldest[:len(self._pois) - MAX_POIS]:
+            location = parse_location(self._pois.pop(poi_id).get("location"))
+            if location is not None:
+                self._grid.get(self._cell(*location), set()).discard(poi_id)
+
+    def learn(self, tool_name: str, tool_args: Dict[str, Any], raw: Any) -> int:
+        """
+        把一次高德工具输出写入存储
+
+        Args:
+            tool_name: 工具名称
+            tool_args: 工具参数
+            raw: 工具原始输出
+
+        Returns:
+            写入的条目数
+        """
+        self._ensure_loaded()
+        data = parse_json_output(raw)
+        if data is None:
+            return 0
+        now = time.time()
+        written = 0
+        with self._lock:
+            if tool_name == GEO_TOOL:
+                results = find_record_list(data)
+                if results:
+                    self._geocodes[self._geo_key(tool_args)] = {"results": results, "fetched_at": now}
+                    written = len(results)
+            elif tool_name == DETAIL_TOOL:
+                poi_id = self._merge_poi(data, now) if isinstance(data, dict) else None
+                if poi_id is not None:
+                    # 记录详情接口的写入时间，详情调用只用它回答
+                    self._pois[poi_id]["detail_fetched_at"] = now
+                    written = 1
+            else:
+                keywords = str(tool_args.get("keywords") or "").strip()
+                city = _norm(tool_args.get("city"))
+                poi_ids = [
+                    poi_id for poi in find_record_list(data)
+                    if (poi_id := self._merge_poi(poi, now, keywords, city))
+                ]
+                written = len(poi_ids)
+                if tool_name == TEXT_SEARCH_TOOL and poi_ids:
+                    self._text_queries[self._text_key(tool_args)] = {"poi_ids": poi_ids, "fetched_at": now}
+                elif tool_name == AROUND_SEARCH_TOOL and parse_location(tool_args.get("location")):
+                    query = {
+                        "location": tool_args.get("location"),
+                        "radius": self._radius(tool_args),
+                        "keywords": keywords,
+                        "filters": self._filters(tool_args, _AROUND_QUERY_ARGS),
+                    }
+                    self._around_queries = [
+                        stored for stored in self._around_queries
+                        if self._around_key(stored) != self._around_key(query)
+                    ]
+                    self._around_queries.append({**query, "fetched_at": now})
+            self._evict()
+        if written:
+            self._mark_dirty()
+        return written
+
+    # ---------- 本地回答 ----------
+
+    @staticmethod
+    def _filters(tool_args: Dict[str, Any], query_args: Tuple[str, ...]) -> str:
+        """查询参数以外的参数（types、page等），不同过滤条件/分页的搜索结果分开保存"""
+        filters = {key: value for key, value in tool_args.items() if key not in query_args and value not in (None, "", [])}
+        return json.dumps(filters, ensure_ascii=False, sort_keys=True) if filters else ""
+
+    @staticmethod
+    def _around_key(query: Dict[str, Any]) -> Tuple:
+        return query["location"], query["radius"], query["keywords"], query.get("filters", "")
+
+    @classmethod
+    def _text_key(cls, tool_args: Dict[str, Any]) -> str:
+        return (
+            f"{_norm(tool_args.get('city'))}|{str(tool_args.get('keywords') or '').strip()}"
+            f"|{cls._filters(tool_args, _TEXT_QUERY_ARGS)}"
+        )
+
+    @staticmethod
+    def _geo_key(tool_args: Dict[str, Any]) -> str:
+        return f"{_norm(tool_args.get('city'))}|{str(tool_args.get('address') or '').strip()}"
+
+    @staticmethod
+    def _radius(tool_args: Dict[str, Any]) -> float:
+        try:
+            return float(tool_args.get("radius") or DEFAULT_AROUND_RADIUS)
+        except (TypeError, ValueError):
+            return DEFAULT_AROUND_RADIUS
+
+    @staticmethod
+    def _public(poi: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in poi.items() if key not in _INTERNAL_FIELDS}
+
+    def _answer(self, tool_name: str, tool_args: Dict[str, Any]) -> Tuple[Optional[str], float]:
+        """本地回答，返回 (与高德工具格式一致的输出, 数据时间)；无法回答时输出为None"""
+        now = time.time()
+        if tool_name == GEO_TOOL:
+            entry = self._geocodes.get(self._geo_key(tool_args))
+            if entry and now - entry["fetched_at"] <= GEO_FRESH_SECONDS:
+                return json.dumps({"results": entry["results"]}, ensure_ascii=False), entry["fetched_at"]
+            return None, 0
+
+        if tool_name == DETAIL_TOOL:
+            poi = self._pois.get(str(tool_args.get("id") or ""))
+            # 关键词/周边搜索的记录只有搜索级字段（同样带坐标），只有写入过详情接口输出的才能回答详情调用
+            if poi and now - poi.get("detail_fetched_at", 0) <= POI_FRESH_SECONDS:
+                return json.dumps(self._public(poi), ensure_ascii=False), poi["detail_fetched_at"]
+            return None, 0
+
+        if tool_name == TEXT_SEARCH_TOOL:
+            entry = self._text_queries.get(self._text_key(tool_args))
+            if not entry or now - entry["fetched_at"] > POI_FRESH_SECONDS:
+                return None, 0
+            pois = [self._public(self._pois[poi_id]) for poi_id in entry["poi_ids"] if poi_id in self._pois]
+            return (json.dumps({"pois": pois}, ensure_ascii=False), entry["fetched_at"]) if pois else (None, 0)
+
+        # 周边搜索：之前有覆盖该圆形区域的同关键词、同过滤条件的周边搜索，
+        # 或者没有过滤条件（types、page等）且本地已经有足够多的POI
+        location = parse_location(tool_args.get("location"))
+        if location is None:
+            return None, 0
+        radius = self._radius(tool_args)
+        keywords = str(tool_args.get("keywords") or "").strip()
+        filters = self._filters(tool_args, _AROUND_QUERY_ARGS)
+        covering = [
+            query for query in self._around_queries
+            if query["keywords"] == keywords
+            and query.get("filters", "") == filters
+            and now - query["fetched_at"] <= POI_FRESH_SECONDS
+            and haversine_meters(*location, *parse_location(query["location"])) + radius <= query["radius"]
+        ]
+        found = self.nearby(location, radius, keywords)
+        if not covering and (filters or len(found) < MIN_LOCAL_NEARBY_RESULTS):
+            return None, 0
+        fetched_at = max(query["fetched_at"] for query in covering) if covering else min(poi["fetched_at"] for _, poi in found)
+        pois = [{**self._public(poi), "distance": str(round(distance))} for distance, poi in found]
+        return json.dumps({"pois": pois}, ensure_ascii=False), fetched_at
+
+    def answer(self, tool_name: str, tool_args: Dict[str, Any], tool: Any = None) -> Optional[str]:
+        """
+        尝试在本地回答高德工具调用
+
+        Args:
+            tool_name: 工具名称
+            tool_args: 工具参数
+            tool: 工具对象（数据需要刷新时用于后台重新调用）
+
+        Returns:
+            与高德工具格式一致的输出；本地无法回答时返回None
+        """
+        if tool_name not in POI_STORE_TOOLS:
+            return None
+        self._ensure_loaded()
+        with self._lock:
+            result, fetched_at = self._answer(tool_name, tool_args)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if tool is not None and time.time() - fetched_at > REFRESH_AFTER_SECONDS:
+            self._schedule_refresh(tool_name, tool_args, tool)
+        return result
+
+    def _schedule_refresh(self, tool_name: str, tool_args: Dict[str, Any], tool: Any):
+        key = f"{tool_name}:{json.dumps(tool_args, ensure_ascii=False, sort_keys=True)}"
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def _refresh():
+            try:
+                from utils.tool_projection import extract_text
+                result = await tool.ainvoke(tool_args)
+                self.learn(tool_name, tool_args, extract_text(result))
+                logger.info(f"✅ 【POI存储】后台刷新完成: {tool_name} {tool_args}")
+            except Exception as e:
+                logger.warning(f"⚠️ 【POI存储】后台刷新失败: {tool_name} {tool_args}: {e}")
+            finally:
+                self._refreshing.discard(key)
+
+        asyncio.get_running_loop().create_task(_refresh())
+
+    def get_poi(self, poi_id: Any) -> Optional[Dict[str, Any]]:
+        """按ID获取POI（不检查新鲜度，用于补全坐标等字段），不存在时返回None"""
+        self._ensure_loaded()
+        with self._lock:
+            poi = self._pois.get(str(poi_id or ""))
+            return self._public(poi) if poi else None
+
+    def summary(self) -> Dict[str, Any]:
+        """存储状态"""
+        self._ensure_loaded()
+        return {
+            "pois": len(self._pois),
+            "located_pois": sum(len(ids) for ids in self._grid.values()),
+            "text_queries": len(self._text_queries),
+            "around_queries": len(self._around_queries),
+            "geocodes": len(self._geocodes),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_poi_store = PoiStore()
+
+
+def get_poi_store() -> PoiStore:
+    """获取POI存储单例"""
+    return _poi_store
@@ -0,0 +1,252 @@
+"""
+推测性预取：规划（plan）的LLM调用期间，先查询几乎每次都会用到的工具
+几乎每次规划，子Agent最先做的都是查询目的地天气、出发地→目的地的车票和目的地的酒店，
+这些调用的参数都可以直接由请求（TrivalFormat）得出，却要等plan的LLM调用结束、子Agent再走一轮LLM才发起。
+
+这里在 /travel 入口就与plan并发发起这些调用，结果按规划任务的类别写入工具缓存（见 utils/tool_data_storage.py），
+子Agent发起相同的调用时直接命中缓存。缓存记录的metadata中带有prefetch_id，
+execute_tool_calls 命中预取的记录时调用 get_prefetch_stats().mark_used()，用于统计预取被用到和浪费的比例。
+"""
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage
+
+from utils.code_index import get_code_index, STATION_CODE_TOOL
+from utils.tool_data_storage import get_tool_storage
+from utils.tool_projection import parse_json_output
+from config.api_config import PREFETCH_ENABLED, PREFETCH_TIMEOUT_SECONDS
+
+logger = logging.getLogger("utils.prefetch")
+
+WEATHER_TOOL = "maps_weather"
+TRAIN_TOOL = "get-tickets"
+HOTEL_TOOLS = ("searchHotels", "search-hotels", "find-hotels")
+
+# 预取结果写入缓存时使用的类别（与规划任务的category一致，子Agent按该类别查找缓存）
+WEATHER_CATEGORY = "weather"
+TRANSPORT_CATEGORY = "transport"
+HOTEL_CATEGORY = "accommodation"
+
+# 酒店工具的参数名（小写）包含这些关键字时，由请求中的对应字段填充
+_HOTEL_ARG_KEYWORDS = (
+    (("checkout", "check_out", "leave"), "check_out"),
+    (("checkin", "check_in", "arrive"), "check_in"),
+    (("city", "destination", "place", "address", "location", "keyword", "query"), "destination"),
+    (("adult", "people", "guest", "person"), "people"),
+)
+
+
+class PrefetchStats:
+    """预取的统计（进程级）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._unused: Dict[str, str] = {}  # prefetch_id -> tool_name，还没有被子Agent用到的预取记录
+        self._totals = {"started": 0, "prefetched": 0, "used": 0, "cache_hits": 0, "already_cached": 0, "failed": 0, "cancelled": 0}
+        self._by_tool: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, tool_name: str, field: str, n: int = 1):
+        self._totals[field] += n
+        by_tool = self._by_tool.setdefault(tool_name, {"prefetched": 0, "used": 0})
+        if field in by_tool:
+            by_tool[field] += n
+
+    def record(self, tool_name: str, field: str, prefetch_id: Optional[str] = None):
+        """记录一次预取的结果（field: started/prefetched/already_cached/failed/cancelled）"""
+        with self._lock:
+            self._count(tool_name, field)
+            if field == "prefetched" and prefetch_id:
+                self._unused[prefetch_id] = tool_name
+
+    def mark_used(self, prefetch_id: str):
+        """子Agent的工具调用命中了预取的缓存记录（同一条记录只在第一次命中时计为used）"""
+        with self._lock:
+            self._totals["cache_hits"] += 1
+            tool_name = self._unused.pop(prefetch_id, None)
+            if tool_name is not None:
+                self._count(tool_name, "used")
+
+    def summary(self) -> Dict[str, Any]:
+        """统计汇总（wasted = 预取了但还没有被用到的记录数）"""
+        with self._lock:
+            prefetched = self._totals["prefetched"]
+            return {
+                **self._totals,
+                "wasted": prefetched - self._totals["used"],
+                "used_ratio": round(self._totals["used"] / prefetched, 3) if prefetched else None,
+                "by_tool": {
+                    tool: {**counts, "wasted": counts["prefetched"] - counts["used"]}
+                    for tool, counts in self._by_tool.items()
+                },
+            }
+
+
+_prefetch_stats = PrefetchStats()
+
+
+def get_prefetch_stats() -> PrefetchStats:
+    """获取预取统计单例"""
+    return _prefetch_stats
+
+
+def _arg_names(tool: Any) -> tuple:
+    """工具的参数名和必填参数名"""
+    schema = getattr(tool, "args_schema", None)
+    if isinstance(schema, dict):
+        properties, required = schema.get("properties", {}), schema.get("required", [])
+    elif schema is not None and hasattr(schema, "model_json_schema"):
+        json_schema = schema.model_json_schema()
+        properties, required = json_schema.get("properties", {}), json_schema.get("required", [])
+    else:
+        properties, required = getattr(tool, "args", {}) or {}, []
+    return list(properties), list(required)
+
+
+def _hotel_args(tool: Any, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    按酒店工具的参数名由请求填充参数
+
+    Returns:
+        参数字典；有必填参数无法填充时返回None
+    """
+    try:
+        check_in = datetime.strptime(str(state.get("date", ""))[:10], "%Y-%m-%d")
+    except ValueError:
+        return None
+    values = {
+        "destination": state.get("destination"),
+        "check_in": check_in.strftime("%Y-%m-%d"),
+        "check_out": (check_in + timedelta(days=max(int(state.get("days") or 1) - 1, 1))).strftime("%Y-%m-%d"),
+        "people": state.get("people"),
+    }
+    names, required = _arg_names(tool)
+    args = {}
+    for name in names:
+        lowered = name.lower()
+        for keywords, field in _HOTEL_ARG_KEYWORDS:
+            if any(keyword in lowered for keyword in keywords) and values.get(field):
+                args[name] = values[field]
+                break
+    if not args or any(name not in args for name in required):
+        return None
+    return args
+
+
+async def _prefetch_call(tools: List[Any], category: str, tool_name: str, args: Dict[str, Any], context: Dict[str, Any]) -> Optional[Any]:
+    """
+    调用一次工具并以预取记录写入工具缓存
+
+    Returns:
+        工具原始输出；已有缓存或调用失败时返回None
+    """
+    from utils.agent_tools import execute_tool_calls
+
+    stats = get_prefetch_stats()
+    storage = get_tool_storage()
+    if storage.find_cached_execution(category=category, tool_name=tool_name, tool_input=args) is not None:
+        stats.record(tool_name, "already_cached")
+        return None
+
+    stats.record(tool_name, "started")
+    call = AIMessage(content="", tool_calls=[{"name": tool_name, "args": args, "id": f"prefetch-{tool_name}"}])
+    try:
+        # 不传category/storage：已确认没有缓存，直接调用工具
+        messages = await execute_tool_calls(call, tools, logger)
+    except asyncio.CancelledError:
+        stats.record(tool_name, "cancelled")
+        raise
+    raw = messages[0].artifact if messages else None
+    if raw is None:
+        stats.record(tool_name, "failed")
+        return None
+
+    prefetch_id = uuid.uuid4().hex
+    storage.save_tool_execution(
+        category=category,
+        tool_name=tool_name,
+        tool_input=args,
+        tool_output=raw,
+        context=context,
+        metadata={"task": "推测性预取", "prefetch_id": prefetch_id}
+    )
+    stats.record(tool_name, "prefetched", prefetch_id)
+    return raw
+
+
+async def _prefetch_tickets(tools: List[Any], state: Dict[str, Any], context: Dict[str, Any]):
+    """去程车票：先取车站代码（优先本地索引），再查询出发日期的车票"""
+    citys = f"{state['origin']}|{state['destination']}"
+    raw = get_code_index().lookup_station_codes(citys)
+    if raw is None:
+        raw = await _prefetch_call(tools, TRANSPORT_CATEGORY, STATION_CODE_TOOL, {"citys": citys}, context)
+    data = parse_json_output(raw)
+    if not isinstance(data, dict):
+        return
+    codes = [station.get("station_code") for station in data.values() if isinstance(station, dict)]
+    if len(codes) == 2 and all(codes):
+        args = {"date": state["date"], "fromStation": codes[0], "toStation": codes[1]}
+        await _prefetch_call(tools, TRANSPORT_CATEGORY, TRAIN_TOOL, args, context)
+
+
+async def speculative_prefetch(state: Dict[str, Any], tools: List[Any], session_id: str):
+    """
+    与plan并发预取目的地天气、去程车票和目的地酒店，结果写入工具缓存
+
+    Args:
+        state: 初始状态（origin、destination、date、days、people）
+        tools: 可用的工具
+        session_id: 会话ID（记录在缓存的context中）
+    """
+    tool_names = {getattr(tool, "name", "") for tool in tools}
+    context = {"origin": state.get("origin"), "destination": state.get("destination"), "date": state.get("date"), "session_id": session_id}
+    started_at = time.perf_counter()
+
+    jobs = []
+    if WEATHER_TOOL in tool_names and state.get("destination"):
+        jobs.append(_prefetch_call(tools, WEATHER_CATEGORY, WEATHER_TOOL, {"city": state["destination"]}, context))
+    if TRAIN_TOOL in tool_names and state.get("origin") and state.get("destination") and state.get("date"):
+        jobs.append(_prefetch_tickets(tools, state, context))
+    hotel_tool = next((tool for tool in tools if getattr(tool, "name", "") in HOTEL_TOOLS), None)
+    hotel_args = _hotel_args(hotel_tool, state) if hotel_tool is not None else None
+    if hotel_args is not None:
+        jobs.append(_prefetch_call(tools, HOTEL_CATEGORY, hotel_tool.name, hotel_args, context))
+    if not jobs:
+        return
+
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"⚠️ 【推测性预取】预取失败: {type(result).__name__}: {result}")
+    logger.info(f"✅ 【推测性预取】{len(jobs)}项预取完成，耗时{time.perf_counter() - started_at:.1f}s")
+
+
+def start_prefetch(state: Dict[str, Any], tools: List[Any], session_id: str) -> Optional[asyncio.Task]:
+    """
+    在后台开始推测性预取（与plan并发执行）
+
+    Returns:
+        预取任务；未启用预取时返回None
+    """
+    if not PREFETCH_ENABLED:
+        return None
+    return asyncio.create_task(asyncio.wait_for(speculative_prefetch(state, tools, session_id), PREFETCH_TIMEOUT_SECONDS))
+
+
+async def stop_prefetch(task: Optional[asyncio.Task]):
+    """规划流程结束时取消还没有完成的预取（结果已经用不上了）"""
+    if task is None:
+        return
+    if not task.done():
+        task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        logger.warning("⚠️ 【推测性预取】预取未在规划流程结束前完成，已取消")
+    except Exception as e:
+        logger.warning(f"⚠️ 【推测性预取】预取失败: {type(e).__name__}: {e}")
@@ -0,0 +1,79 @@
+"""
+Prompt组装缓存
+plan/replan每次调用都会重新创建JsonOutputParser和PromptTemplate，
+而 get_format_instructions() 每次都要重新生成 AmusementFormat 整棵模型树的JSON Schema。
+这些内容在进程内不会变化，这里按（模板, 输出格式）缓存，每个进程只构建一次。
+"""
+import logging
+from functools import lru_cache
+from typing import Optional, Type
+
+from pydantic import BaseModel
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+
+from utils.prompt_layout import split_template
+
+logger = logging.getLogger("utils.prompt_cache")
+
+
+@lru_cache(maxsize=None)
+def get_json_parser(pydantic_object: Type[BaseModel]) -> JsonOutputParser:
+    """
+    获取指定输出格式的JsonOutputParser（进程内缓存）
+
+    Args:
+        pydantic_object: 输出格式模型（如 PlanWithIntervention）
+
+    Returns:
+        JsonOutputParser
+    """
+    return JsonOutputParser(pydantic_object=pydantic_object)
+
+
+@lru_cache(maxsize=None)
+def get_format_instructions(pydantic_object: Type[BaseModel]) -> str:
+    """
+    获取指定输出格式的格式说明（JSON Schema只生成一次）
+
+    Args:
+        pydantic_object: 输出格式模型
+
+    Returns:
+        格式说明文本
+    """
+    instructions = get_json_parser(pydantic_object).get_format_instructions()
+    logger.debug(f"已缓存 {pydantic_object.__name__} 的格式说明，长度: {len(instructions)}")
+    return instructions
+
+
+@lru_cache(maxsize=64)
+def _get_chat_prompt_template(template: str, pydantic_object: Optional[Type[BaseModel]]) -> ChatPromptTemplate:
+    static_template, dynamic_template = split_template(template)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", static_template),
+        ("human", dynamic_template),
+    ])
+    if pydantic_object is not None:
+        prompt = prompt.partial(json_format=get_format_instructions(pydantic_object))
+    return prompt
+
+
+def get_chat_prompt_template(
+    template: str,
+    pydantic_object: Optional[Type[BaseModel]] = None
+) -> ChatPromptTemplate:
+    """
+    获取分层布局的ChatPromptTemplate（进程内缓存）
+
+    模板被拆成静态前缀（system）和动态后缀（human），相同节点的请求共享完全相同的前缀，
+    可以命中模型服务的提示词缓存（见 utils/prompt_layout.py）
+
+    Args:
+        template: 原模板文本
+        pydantic_object: 输出格式模型，提供时以 json_format 作为partial变量填入格式说明
+
+    Returns:
+        ChatPromptTemplate
+    """
+    return _get_chat_prompt_template(template, pydantic_object)
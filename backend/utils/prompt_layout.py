@@ -0,0 +1,165 @@
+"""
+Prompt分层布局
+模型服务对"前缀完全相同"的请求有提示词缓存（更便宜、更快），但 prompts/amusement_prompt.py 中的模板
+把每次会话都不同的值（出发地、日期、预算、工具结果等）穿插在大段固定说明的中间，导致前缀几乎无法命中缓存。
+
+这里把模板自动拆成两部分：
+- 静态前缀（SystemMessage）：固定说明 + 进程内不变的变量（json_format、description、sub_agents_info）
+- 动态后缀（HumanMessage）：所有与本次会话/任务相关的信息
+
+tools_desc 不在静态前缀中：子Agent按任务选择工具（见 utils/tool_selector.py），工具说明随任务变化，
+放在静态前缀中会使各次调用的前缀不同。它所在的段落放在动态后缀的最前面（同一子Agent选中相同工具时，
+缓存前缀可以一直延伸到工具说明之后）。
+
+拆分规则：
+1. "标签：{变量}" 形式的信息行、单独一行的 "{变量}" 及其所属的小标题，整体移到动态后缀
+2. 说明文字中内嵌的变量（如 "必须生成{days}天的完整行程"）替换为 "【旅行天数】"，并在动态后缀中给出对应的值
+"""
+import re
+import logging
+from functools import lru_cache
+from typing import FrozenSet, List, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+logger = logging.getLogger("utils.prompt_layout")
+
+# 进程内不变（或按Agent不变）的变量，保留在静态前缀中
+DEFAULT_STATIC_VARS = frozenset({"json_format", "description", "sub_agents_info"})
+
+# 变化较少的动态变量（按任务选择的工具说明），所在段落放在动态后缀的最前面
+LEADING_DYNAMIC_VARS = frozenset({"tools_desc"})
+
+# 内嵌在说明文字中的动态变量的名称（替换为【名称】）
+VAR_LABELS = {
+    "origin": "出发地",
+    "destination": "目的地",
+    "date": "出发日期",
+    "days": "旅行天数",
+    "people": "出行人数",
+    "budget": "预算",
+    "preferences": "用户偏好",
+    "task": "当前任务",
+    "num_results": "之前查询结果数",
+}
+
+DYNAMIC_HEADER = "### 本次任务信息\n（系统说明中提到的\"上面/上述\"信息、以及【】标注的值均以这里为准）"
+
+_PLACEHOLDER_RE = re.compile(r"(?<!\{)\{(\w+)\}(?!\})")
+_LABEL_LINE_RE = re.compile(r"^\s*(?:[-*]\s*)?(?:\*\*)?[^{}\n]{1,40}?(?:\*\*)?\s*[：:]\s*(?:\*\*)?\s*\{(\w+)\}")
+_STANDALONE_RE = re.compile(r"^\s*\{(\w+)\}\s*$")
+
+
+def _is_heading(line: str) -> bool:
+    """是否为小标题行（### 标题、**标题**：、以冒号结尾的短句）"""
+    text = line.strip()
+    if not text or _PLACEHOLDER_RE.search(text):
+        return False
+    if text.startswith("#"):
+        return True
+    if re.match(r"^\*\*[^*]+\*\*\s*[:：]?$", text):
+        return True
+    return len(text) <= 30 and text[-1] in ":："
+
+
+@lru_cache(maxsize=128)
+def split_template(template: str, static_vars: FrozenSet[str] = DEFAULT_STATIC_VARS) -> Tuple[str, str]:
+    """
+    将模板拆分为静态前缀模板和动态后缀模板（两者仍是可format的模板）
+
+    Args:
+        template: 原模板
+        static_vars: 保留在静态前缀中的变量
+
+    Returns:
+        (静态前缀模板, 动态后缀模板)；模板中没有动态变量时动态后缀为空字符串
+    """
+    lines = template.split("\n")
+    dynamic = [False] * len(lines)
+    used_labels: List[str] = []
+
+    for idx, line in enumerate(lines):
+        names = [name for name in _PLACEHOLDER_RE.findall(line) if name not in static_vars]
+        if not names:
+            continue
+        if _LABEL_LINE_RE.match(line) or _STANDALONE_RE.match(line):
+            dynamic[idx] = True
+        elif any(name not in VAR_LABELS for name in names):
+            dynamic[idx] = True
+
+    # 小标题下面（直到空行或下一个标题）全部是动态行时，小标题一起移到动态后缀
+    for idx, line in enumerate(lines):
+        if dynamic[idx] or not _is_heading(line):
+            continue
+        block = []
+        for next_idx in range(idx + 1, len(lines)):
+            if not lines[next_idx].strip() or _is_heading(lines[next_idx]):
+                break
+            block.append(next_idx)
+        if block and all(dynamic[i] for i in block):
+            dynamic[idx] = True
+
+    static_lines: List[str] = []
+    # 原模板中相邻的动态行组成一段，不相邻的段之间保留空行
+    dynamic_segments: List[List[str]] = []
+    previous_dynamic = False
+    for idx, line in enumerate(lines):
+        if dynamic[idx]:
+            if not previous_dynamic:
+                dynamic_segments.append([])
+            dynamic_segments[-1].append(line)
+        else:
+            def _label(match):
+                name = match.group(1)
+                if name in static_vars:
+                    return match.group(0)
+                if name not in used_labels:
+                    used_labels.append(name)
+                return f"【{VAR_LABELS[name]}】"
+            static_lines.append(_PLACEHOLDER_RE.sub(_label, line))
+        previous_dynamic = dynamic[idx]
+
+    # 含工具说明的段落放在最前面（稳定排序，其余段落保持原顺序）
+    dynamic_segments.sort(key=lambda segment: not LEADING_DYNAMIC_VARS & set(_PLACEHOLDER_RE.findall("\n".join(segment))))
+    dynamic_lines: List[str] = []
+    for segment in dynamic_segments:
+        if dynamic_lines:
+            dynamic_lines.append("")
+        dynamic_lines.extend(segment)
+
+    # 说明文字中用到的【】变量，如果动态后缀中还没有给出值，补充到末尾
+    listed = set(_PLACEHOLDER_RE.findall("\n".join(dynamic_lines)))
+    missing = [name for name in used_labels if name not in listed]
+    if missing:
+        dynamic_lines.append("")
+        dynamic_lines.extend(f"- {VAR_LABELS[name]}：{{{name}}}" for name in missing)
+
+    static_template = re.sub(r"\n{3,}", "\n\n", "\n".join(static_lines)).strip()
+    dynamic_body = "\n".join(dynamic_lines).strip()
+    dynamic_template = f"{DYNAMIC_HEADER}\n\n{dynamic_body}" if dynamic_body else ""
+    return static_template, dynamic_template
+
+
+def build_layered_messages(template: str, **values) -> List[BaseMessage]:
+    """
+    按分层布局格式化模板，返回 [SystemMessage(静态前缀), HumanMessage(动态后缀)]
+
+    Args:
+        template: 原模板
+        **values: 模板变量
+
+    Returns:
+        消息列表；模板没有动态变量时只返回一条HumanMessage（与原行为一致）
+    """
+    static_template, dynamic_template = split_template(template)
+    if not dynamic_template:
+        return [HumanMessage(content=template.format(**values))]
+    return [
+        SystemMessage(content=static_template.format(**values)),
+        HumanMessage(content=dynamic_template.format(**values)),
+    ]
+
+
+def messages_to_text(messages: List[BaseMessage]) -> str:
+    """将分层消息拼接为文本（用于日志）"""
+    return "\n\n".join(str(msg.content) for msg in messages)
@@ -0,0 +1,326 @@
+"""
+工具结果本地检索模块
+replan不再把所有ToolMessage塞进prompt，而是按行程板块（交通、天气、住宿、景点、餐饮、各规划任务）
+从本次会话的工具结果和 data/tool_executions 历史记录中检索相关片段。
+
+使用BM25排序，分词方式为：中文按相邻两字切分（bigram），英文/数字按单词切分，
+完全在本地计算，不依赖任何向量模型或网络服务。
+"""
+import re
+import math
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, ToolMessage
+
+from utils.token_counter import estimate_tokens
+from utils.tool_projection import project_tool_output
+from config.context_config import (
+    RETRIEVAL_TOP_K_PER_SECTION,
+    RETRIEVAL_HISTORY_TOOLS,
+    RETRIEVAL_HISTORY_MAX_AGE_DAYS,
+)
+
+logger = logging.getLogger("utils.retrieval_index")
+
+_CJK_RUN_RE = re.compile(r"[一-鿿]+")
+_ASCII_WORD_RE = re.compile(r"[a-z0-9]+")
+_TABLE_TITLE_RE = re.compile(r"^(?P<title>.*?)（共\d+条）$")
+
+# 非表格文本按段落切分时，单个片段的最大字符数
+MAX_CHUNK_CHARS = 400
+
+# 得分低于最高分该比例的片段视为不相关（只是碰巧提到了城市名等）
+MIN_RELATIVE_SCORE = 0.25
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为检索词：中文bigram（单字的词保留单字）+ 英文/数字单词
+
+    Args:
+        text: 文本
+
+    Returns:
+        检索词列表
+    """
+    text = str(text or "").lower()
+    tokens = _ASCII_WORD_RE.findall(text)
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+@dataclass
+class Chunk:
+    """检索片段"""
+    text: str                      # 展示给LLM的内容（表格行或文本段落）
+    source: str                    # 来源工具名称
+    header: Optional[str] = None   # 表格的标题和表头（同一表格的行共享）
+    origin: str = "session"        # session: 本次会话；history: 历史记录
+    terms: Counter = field(default_factory=Counter)
+    length: int = 0
+
+
+class ToolResultIndex:
+    """工具结果的BM25检索索引（进程内，按会话构建）"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks: List[Chunk] = []
+        self._doc_freq: Counter = Counter()
+        self._avg_length = 0.0
+        self._seen_texts = set()
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def _add_chunk(self, text: str, source: str, header: Optional[str], origin: str):
+        text = text.strip()
+        key = (header, text)
+        if not text or key in self._seen_texts:
+            return
+        self._seen_texts.add(key)
+
+        terms = Counter(tokenize(f"{source} {header or ''} {text}"))
+        chunk = Chunk(text=text, source=source, header=header, origin=origin, terms=terms, length=sum(terms.values()))
+        self.chunks.append(chunk)
+        self._doc_freq.update(terms.keys())
+        self._avg_length += (chunk.length - self._avg_length) / len(self.chunks)
+
+    def add_text(self, text: str, source: str, origin: str = "session"):
+        """
+        切分文本并加入索引：投影后的表格按行切分，其他文本按段落切分
+
+        Args:
+            text: 工具结果文本
+            source: 来源工具名称
+            origin: 来源（session/history）
+        """
+        lines = [line for line in str(text or "").split("\n")]
+        if len(lines) >= 3 and _TABLE_TITLE_RE.match(lines[0].strip()) and "|" in lines[1]:
+            header = f"{_TABLE_TITLE_RE.match(lines[0].strip()).group('title')}\n{lines[1]}"
+            for row in lines[2:]:
+                self._add_chunk(row, source, header, origin)
+            return
+
+        buffer = ""
+        for line in lines:
+            if not line.strip():
+                continue
+            if buffer and len(buffer) + len(line) > MAX_CHUNK_CHARS:
+                self._add_chunk(buffer, source, None, origin)
+                buffer = ""
+            buffer = f"{buffer}\n{line}" if buffer else line
+            while len(buffer) > MAX_CHUNK_CHARS:
+                self._add_chunk(buffer[:MAX_CHUNK_CHARS], source, None, origin)
+                buffer = buffer[MAX_CHUNK_CHARS:]
+        if buffer:
+            self._add_chunk(buffer, source, None, origin)
+
+    def add_tool_messages(self, messages: Iterable[BaseMessage]):
+        """将会话中的ToolMessage加入索引"""
+        for msg in messages:
+            if isinstance(msg, ToolMessage):
+                self.add_text(str(msg.content), getattr(msg, "name", None) or "tool")
+
+    def add_history_records(self, records: Iterable[Dict[str, Any]], destination: str = ""):
+        """
+        将 data/tool_executions 中的历史记录加入索引
+
+        只加入结果不随日期变化的工具（见 RETRIEVAL_HISTORY_TOOLS），且目的地相同、未过期的记录
+
+        Args:
+            records: 工具执行记录
+            destination: 当前目的地
+        """
+        cutoff = datetime.now() - timedelta(days=RETRIEVAL_HISTORY_MAX_AGE_DAYS)
+        added = 0
+        for record in records:
+            tool_name = record.get("tool_name", "")
+            if tool_name not in RETRIEVAL_HISTORY_TOOLS:
+                continue
+            if destination and record.get("context", {}).get("destination") != destination:
+                continue
+            try:
+                if datetime.fromisoformat(record.get("timestamp", "")) < cutoff:
+                    continue
+            except ValueError:
+                continue
+            self.add_text(project_tool_output(tool_name, record.get("tool_output", "")), tool_name, origin="history")
+            added += 1
+        if added:
+            logger.info(f"检索索引加入 {added} 条历史工具记录")
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K_PER_SECTION) -> List[Tuple[float, int]]:
+        """
+        BM25检索
+
+        Args:
+            query: 查询文本
+            top_k: 返回的最大片段数
+
+        Returns:
+            [(得分, 片段下标)]，按得分从高到低排序；历史记录的得分会打折，优先使用本次会话的结果
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.chunks:
+            return []
+
+        total = len(self.chunks)
+        avg_length = self._avg_length or 1.0
+        scored = []
+        for idx, chunk in enumerate(self.chunks):
+            score = 0.0
+            for term in query_terms:
+                tf = chunk.terms.get(term)
+                if not tf:
+                    continue
+                df = self._doc_freq[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * chunk.length / avg_length))
+            if score > 0:
+                if chunk.origin == "history":
+                    score *= 0.8
+                scored.append((score, idx))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        if scored:
+            threshold = scored[0][0] * MIN_RELATIVE_SCORE
+            scored = [item for item in scored if item[0] >= threshold]
+        return scored[:top_k]
+
+    def render(self, chunk_ids: List[int]) -> str:
+        """将片段按来源表格分组渲染（同一表格的行共用表头）"""
+        groups: Dict[Tuple[str, Optional[str]], List[str]] = {}
+        for idx in chunk_ids:
+            chunk = self.chunks[idx]
+            groups.setdefault((chunk.source, chunk.header), []).append(chunk.text)
+
+        parts = []
+        for (source, header), texts in groups.items():
+            if header:
+                parts.append(f"[{source}] {header}\n" + "\n".join(texts))
+            else:
+                parts.append("\n".join(f"[{source}] {text}" for text in texts))
+        return "\n".join(parts)
+
+    def build_context(
+        self,
+        sections: List[Tuple[str, str]],
+        max_tokens: int,
+        top_k: int = RETRIEVAL_TOP_K_PER_SECTION
+    ) -> str:
+        """
+        按板块检索并拼接上下文，同一片段只在第一个命中的板块中出现
+
+        Args:
+            sections: [(板块名称, 查询文本)]
+            max_tokens: 上下文token上限
+            top_k: 每个板块的片段数
+
+        Returns:
+            检索上下文文本（没有命中时返回空字符串）
+        """
+        used = set()
+        parts = []
+        total_tokens = 0
+        for section_name, query in sections:
+            hits = [idx for _, idx in self.search(query, top_k) if idx not in used]
+            # 超出上限时从得分最低的片段开始丢弃
+            while hits:
+                block = f"### {section_name}\n{self.render(hits)}"
+                block_tokens = estimate_tokens(block)
+                if total_tokens + block_tokens <= max_tokens:
+                    break
+                hits.pop()
+            if not hits:
+                continue
+            used.update(hits)
+            parts.append(block)
+            total_tokens += block_tokens
+
+        if parts:
+            logger.info(f"✅ 检索上下文: {len(parts)}个板块, {len(used)}/{len(self.chunks)}个片段, 约{total_tokens}个token")
+        return "\n\n".join(parts)
+
+
+def build_itinerary_sections(
+    context: Dict[str, Any],
+    plan_items: Iterable[Any],
+    index: Optional[ToolResultIndex] = None
+) -> List[Tuple[str, str]]:
+    """
+    根据出行信息和规划任务生成按行程板块的检索查询
+
+    提供index时，住宿查询会加入检索到的景点名称/地址，优先找景点附近的酒店
+
+    Args:
+        context: 出行信息（origin、destination、date、preferences等）
+        plan_items: 规划中的任务/概述条目
+        index: 检索索引（可选，用于扩展住宿查询）
+
+    Returns:
+        [(板块名称, 查询文本)]
+    """
+    origin = context.get("origin", "")
+    destination = context.get("destination", "")
+    preferences = context.get("preferences", "") or ""
+
+    # 查询中的英文词对应工具名称/表格标题（get-tickets、find-hotels、POI等），让各板块优先命中对应工具的结果
+    attraction_query = f"poi search {destination} 景点 景区 公园 博物馆 游玩 {preferences}"
+    hotel_query = f"hotels {destination} 酒店 住宿 宾馆 星级 评分 价格 {preferences}"
+    if index is not None:
+        nearby = []
+        for _, idx in index.search(attraction_query, top_k=5):
+            chunk = index.chunks[idx]
+            if chunk.header and chunk.header.startswith("POI"):
+                cells = chunk.text.split("|")
+                nearby.extend(cells[:2])  # 名称、地址
+        if nearby:
+            hotel_query += " " + " ".join(nearby)
+
+    sections = [
+        ("往返交通", f"tickets searchflightsbydeparr {origin} {destination} 火车票 高铁 车次 航班 出发 到达 历时 余票"),
+        ("天气", f"weather {destination} 天气 预报 日期 {context.get('date', '')} 白天 夜间 温度"),
+        ("景点", attraction_query),
+        ("住宿", hotel_query),
+        ("餐饮", f"poi {destination} 美食 餐厅 小吃 特色菜 餐饮"),
+    ]
+    for idx, item in enumerate(plan_items or [], 1):
+        text = str(item).strip()
+        if text:
+            sections.append((f"规划任务{idx}: {text[:40]}", text))
+    return sections
+
+
+def build_session_index(messages: Iterable[BaseMessage], destination: str = "", storage=None) -> ToolResultIndex:
+    """
+    构建会话的工具结果检索索引
+
+    Args:
+        messages: 会话消息（只使用其中的ToolMessage）
+        destination: 目的地（用于筛选历史记录）
+        storage: ToolDataStorage实例（为None时不加入历史记录）
+
+    Returns:
+        ToolResultIndex
+    """
+    index = ToolResultIndex()
+    index.add_tool_messages(messages)
+
+    if storage is not None and destination:
+        try:
+            for category in storage.get_all_categories():
+                index.add_history_records(storage.query_by_category(category), destination)
+        except Exception as e:
+            logger.warning(f"加载历史工具记录失败，仅使用本次会话的结果: {e}")
+
+    return index
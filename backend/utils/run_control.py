@@ -0,0 +1,151 @@
+"""
+工作流执行控制
+记录每个会话正在执行的工作流任务，支持在客户端断开连接或用户主动取消时取消执行；
+取消会沿 asyncio 任务传播到 graph 的节点、子Agent的多轮循环和正在进行的LLM/工具调用。
+
+同时统计取消节省的开销：用已完成执行的平均开销（LLM调用次数、token、耗时、工具调用次数）
+减去被取消的执行已经花费的部分，作为本次取消节省的估计值。
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("utils.run_control")
+
+# 取消原因
+CANCEL_CLIENT_DISCONNECT = "client_disconnect"
+CANCEL_USER_REQUEST = "user_request"
+
+_COST_FIELDS = ("llm_calls", "tokens", "seconds", "tool_calls")
+
+
+class RunCancelledError(Exception):
+    """工作流执行被取消（客户端断开连接或用户主动取消）"""
+
+    def __init__(self, session_id: str, reason: str):
+        super().__init__(f"会话 {session_id} 的执行已取消: {reason}")
+        self.session_id = session_id
+        self.reason = reason
+
+
+class RunRegistry:
+    """会话ID → 正在执行的工作流任务"""
+
+    def __init__(self):
+        self._runs: Dict[str, asyncio.Task] = {}
+        self._cancel_reasons: Dict[str, str] = {}
+
+    def register(self, session_id: str, task: asyncio.Task):
+        """登记会话正在执行的任务"""
+        self._runs[session_id] = task
+        self._cancel_reasons.pop(session_id, None)
+
+    def unregister(self, session_id: str, task: asyncio.Task) -> Optional[str]:
+        """
+        移除会话的任务登记
+
+        Returns:
+            该任务被取消的原因（未被取消时返回None）
+        """
+        if self._runs.get(session_id) is task:
+            self._runs.pop(session_id, None)
+        return self._cancel_reasons.pop(session_id, None)
+
+    def is_running(self, session_id: str) -> bool:
+        """会话是否有正在执行的任务"""
+        task = self._runs.get(session_id)
+        return task is not None and not task.done()
+
+    def cancel(self, session_id: str, reason: str) -> bool:
+        """
+        取消会话正在执行的任务
+
+        Args:
+            session_id: 会话ID
+            reason: 取消原因（CANCEL_CLIENT_DISCONNECT / CANCEL_USER_REQUEST）
+
+        Returns:
+            是否有任务被取消
+        """
+        task = self._runs.get(session_id)
+        if task is None or task.done():
+            return False
+        self._cancel_reasons[session_id] = reason
+        task.cancel()
+        logger.warning(f"⚠️ 【取消执行】会话 {session_id}: {reason}")
+        return True
+
+
+class CancellationStats:
+    """取消执行的统计（进程级）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._completed = {"runs": 0, **{field: 0.0 for field in _COST_FIELDS}}
+        self._cancelled: Dict[str, Any] = {
+            "runs": 0,
+            "by_reason": {},
+            "spent": {field: 0.0 for field in _COST_FIELDS},
+            "estimated_saved": {field: 0.0 for field in _COST_FIELDS},
+        }
+
+    def record_completed(self, cost: Dict[str, float]):
+        """记录一次完整执行的开销（作为估算节省量的基准）"""
+        with self._lock:
+            self._completed["runs"] += 1
+            for field in _COST_FIELDS:
+                self._completed[field] += cost.get(field, 0)
+
+    def record_cancelled(self, reason: str, cost: Dict[str, float]) -> Dict[str, float]:
+        """
+        记录一次被取消的执行
+
+        Args:
+            reason: 取消原因
+            cost: 取消前已经花费的开销
+
+        Returns:
+            本次取消节省的估计值（没有完整执行作为基准时为0）
+        """
+        with self._lock:
+            runs = self._completed["runs"]
+            saved = {
+                field: max(self._completed[field] / runs - cost.get(field, 0), 0.0) if runs else 0.0
+                for field in _COST_FIELDS
+            }
+            self._cancelled["runs"] += 1
+            self._cancelled["by_reason"][reason] = self._cancelled["by_reason"].get(reason, 0) + 1
+            for field in _COST_FIELDS:
+                self._cancelled["spent"][field] += cost.get(field, 0)
+                self._cancelled["estimated_saved"][field] += saved[field]
+        return saved
+
+    def summary(self) -> Dict[str, Any]:
+        """统计汇总"""
+        with self._lock:
+            runs = self._completed["runs"]
+            return {
+                "completed_runs": runs,
+                "avg_completed_cost": {
+                    field: round(self._completed[field] / runs, 2) if runs else 0.0 for field in _COST_FIELDS
+                },
+                "cancelled_runs": self._cancelled["runs"],
+                "cancelled_by_reason": dict(self._cancelled["by_reason"]),
+                "cancelled_spent": {field: round(value, 2) for field, value in self._cancelled["spent"].items()},
+                "estimated_saved": {field: round(value, 2) for field, value in self._cancelled["estimated_saved"].items()},
+            }
+
+
+_run_registry = RunRegistry()
+_cancellation_stats = CancellationStats()
+
+
+def get_run_registry() -> RunRegistry:
+    """获取工作流执行登记表单例"""
+    return _run_registry
+
+
+def get_cancellation_stats() -> CancellationStats:
+    """获取取消统计单例"""
+    return _cancellation_stats
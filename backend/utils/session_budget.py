@@ -0,0 +1,146 @@
+"""
+会话预算
+单次graph执行的预算（截止时间、LLM调用次数、token用量），保存在contextvar中，
+由API在执行graph前设置，retry_llm_call在每次调用后扣减，各节点和子Agent轮次在执行可选工作前检查。
+
+预算不足（剩余低于 BUDGET_RESERVE）时跳过可选工作，保证replan仍有足够的预算用已有结果生成攻略；
+不在会话中（如脚本直接调用）时不做任何限制。
+"""
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from config.budget_config import (
+    SESSION_DEADLINE_SECONDS,
+    SESSION_MAX_LLM_CALLS,
+    SESSION_MAX_TOKENS,
+    BUDGET_RESERVE,
+    BUDGET_RESERVE_MAX_DEADLINE_RATIO,
+)
+
+logger = logging.getLogger("utils.session_budget")
+
+
+class SessionBudget:
+    """单次执行的预算"""
+
+    def __init__(
+        self,
+        deadline_seconds: float = SESSION_DEADLINE_SECONDS,
+        max_llm_calls: int = SESSION_MAX_LLM_CALLS,
+        max_tokens: int = SESSION_MAX_TOKENS,
+        reserve: Optional[Dict[str, float]] = None
+    ):
+        self.deadline_seconds = deadline_seconds
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+        self.reserve = reserve if reserve is not None else BUDGET_RESERVE
+        self.started_at = time.monotonic()
+        self.llm_calls = 0
+        self.tokens = 0
+        self.skipped: List[str] = []
+        self._lock = threading.Lock()
+
+    def charge(self, tokens: int):
+        """扣减一次LLM调用及其token用量"""
+        with self._lock:
+            self.llm_calls += 1
+            self.tokens += tokens
+
+    def restart_clock(self):
+        """从现在开始计时（没有用户截止时间时，排队等待准入的时间不计入预算）"""
+        self.started_at = time.monotonic()
+
+    def elapsed(self) -> float:
+        """已用时间（秒）"""
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> Dict[str, float]:
+        """各维度的剩余预算"""
+        return {
+            "seconds": self.deadline_seconds - self.elapsed(),
+            "llm_calls": self.max_llm_calls - self.llm_calls,
+            "tokens": self.max_tokens - self.tokens,
+        }
+
+    def reserve_seconds(self) -> float:
+        """时间预留（不超过截止时间的 BUDGET_RESERVE_MAX_DEADLINE_RATIO）"""
+        return min(self.reserve.get("seconds", 0), self.deadline_seconds * BUDGET_RESERVE_MAX_DEADLINE_RATIO)
+
+    def low_reason(self) -> Optional[str]:
+        """剩余预算低于预留值的原因（预算充足时返回None）"""
+        remaining = self.remaining()
+        if remaining["seconds"] < self.reserve_seconds():
+            return f"剩余时间{max(remaining['seconds'], 0):.0f}s"
+        if remaining["llm_calls"] < self.reserve.get("llm_calls", 0):
+            return f"剩余LLM调用{max(remaining['llm_calls'], 0)}次"
+        if remaining["tokens"] < self.reserve.get("tokens", 0):
+            return f"剩余token {max(remaining['tokens'], 0)}"
+        return None
+
+    def is_low(self) -> bool:
+        """剩余预算是否低于预留值"""
+        return self.low_reason() is not None
+
+    def skip(self, work: str):
+        """记录一项因预算不足而跳过的工作"""
+        with self._lock:
+            self.skipped.append(work)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """预算使用情况（用于日志和响应）"""
+        return {
+            "elapsed_seconds": round(self.elapsed(), 1),
+            "deadline_seconds": self.deadline_seconds,
+            "llm_calls": self.llm_calls,
+            "max_llm_calls": self.max_llm_calls,
+            "tokens": self.tokens,
+            "max_tokens": self.max_tokens,
+            "skipped": list(self.skipped),
+        }
+
+
+_current_budget: ContextVar[Optional[SessionBudget]] = ContextVar("session_budget", default=None)
+
+
+def set_session_budget(budget: Optional[SessionBudget]):
+    """
+    设置当前上下文的会话预算
+
+    Returns:
+        ContextVar token，用于 reset_session_budget 恢复
+    """
+    return _current_budget.set(budget)
+
+
+def reset_session_budget(token):
+    """恢复 set_session_budget 之前的会话预算"""
+    _current_budget.reset(token)
+
+
+def get_session_budget() -> Optional[SessionBudget]:
+    """获取当前上下文的会话预算（不在会话中时返回None）"""
+    return _current_budget.get()
+
+
+def budget_allows(work: str) -> bool:
+    """
+    检查是否还有预算执行一项可选工作，预算不足时记录并跳过
+
+    Args:
+        work: 工作描述（用于日志，如 "地图助手 第2轮"）
+
+    Returns:
+        True 表示可以执行；False 表示应跳过
+    """
+    budget = get_session_budget()
+    if budget is None:
+        return True
+    reason = budget.low_reason()
+    if reason is None:
+        return True
+    budget.skip(work)
+    logger.warning(f"⚠️ 【会话预算】{reason}，跳过: {work}")
+    return False
@@ -0,0 +1,141 @@
+"""
+本地token估算工具
+不调用模型服务，用于在构建prompt前估算消息长度、按预算压缩内容
+
+优先使用tiktoken（如果已安装且编码文件可用），否则使用字符启发式估算：
+- 中日韩字符按每字约1个token计算
+- 其他字符按每4个字符约1个token计算
+"""
+import logging
+from typing import Any
+
+logger = logging.getLogger("utils.token_counter")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """懒加载tiktoken编码，加载失败时返回None并使用启发式估算"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+            logger.info("token估算使用tiktoken(cl100k_base)")
+        except Exception as e:
+            _encoding = None
+            logger.info(f"tiktoken不可用（{type(e).__name__}），token估算使用字符启发式")
+    return _encoding
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF      # 中日韩统一表意文字
+        or 0x3400 <= code <= 0x4DBF   # 扩展A
+        or 0x3000 <= code <= 0x303F   # 中文标点
+        or 0xFF00 <= code <= 0xFFEF   # 全角字符
+    )
+
+
+def estimate_tokens(text: Any) -> int:
+    """
+    估算文本的token数
+
+    Args:
+        text: 文本（非字符串会先转换为字符串）
+
+    Returns:
+        估算的token数
+    """
+    if text is None:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    if not text:
+        return 0
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        try:
+            return len(encoding.encode(text, disallowed_special=()))
+        except Exception:
+            pass
+
+    cjk_count = sum(1 for ch in text if _is_cjk(ch))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def estimate_message_tokens(message: Any) -> int:
+    """
+    估算单条消息的token数（内容 + 少量角色/格式开销）
+
+    Args:
+        message: BaseMessage 或任意对象
+
+    Returns:
+        估算的token数
+    """
+    content = getattr(message, "content", message)
+    return estimate_tokens(content) + 4
+
+
+def truncate_to_tokens(text: Any, max_tokens: int, head_ratio: float = 0.7) -> str:
+    """
+    将文本压缩到指定的token数以内，保留开头和结尾，中间用省略标记替换
+
+    工具结果的开头通常是最重要的数据（列表前几项），结尾通常是汇总/分页信息，
+    所以默认保留70%开头和30%结尾
+
+    Args:
+        text: 原始文本
+        max_tokens: 最大token数
+        head_ratio: 开头部分占比
+
+    Returns:
+        压缩后的文本（未超过上限时原样返回）
+    """
+    if text is None:
+        return ""
+    if not isinstance(text, str):
+        text = str(text)
+
+    total_tokens = estimate_tokens(text)
+    if total_tokens <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    # 按token/字符比例换算保留的字符数，留出省略标记的空间
+    chars_per_token = len(text) / max(total_tokens, 1)
+    keep_chars = max(int((max_tokens - 16) * chars_per_token), 0)
+    head_chars = int(keep_chars * head_ratio)
+    tail_chars = keep_chars - head_chars
+
+    omitted = total_tokens - max_tokens
+    marker = f"\n...[已省略约{omitted}个token]...\n"
+    tail = text[-tail_chars:] if tail_chars > 0 else ""
+    return text[:head_chars] + marker + tail
+
+
+def condense_message(message: Any, max_tokens: int) -> Any:
+    """
+    返回内容被压缩到max_tokens以内的消息副本（原消息不会被修改）
+
+    Args:
+        message: BaseMessage
+        max_tokens: 最大token数
+
+    Returns:
+        压缩后的消息（未超过上限时返回原消息）
+    """
+    content = getattr(message, "content", None)
+    if not isinstance(content, str) or estimate_tokens(content) <= max_tokens:
+        return message
+    try:
+        return message.model_copy(update={"content": truncate_to_tokens(content, max_tokens)})
+    except Exception:
+        return message
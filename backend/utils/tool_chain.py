@@ -0,0 +1,194 @@
+"""
+工具调用链（前置工具预解析）
+部分MCP工具需要先调用前置工具拿到参数，例如12306的 get-tickets 需要先用 get-station-code-of-citys
+把城市换成车站代码、用 get-current-date 确认当前日期，LLM要为此多走一轮（多一次串行的LLM调用）。
+
+这里声明常见的前置依赖：任务选中的工具命中某条调用链时，在第一轮LLM调用之前直接在本地并行调用前置工具
+（参数由任务上下文生成，结果按参数缓存），把结果写进提示词，LLM第一轮就可以直接调用最终的查询工具。
+车站代码、机场三字码优先从本地代码索引中获取（见 utils/code_index.py）。
+"""
+import time
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.tool_projection import extract_text, parse_json_output
+from utils.code_index import get_code_index, STATION_CODE_TOOL
+
+logger = logging.getLogger("utils.tool_chain")
+
+
+def _city(value: Any) -> str:
+    return str(value or "").strip().removesuffix("市")
+
+
+def _render_station_codes(raw: Any) -> str:
+    """get-station-code-of-citys 的结果：{城市: {station_code, station_name}} → "北京: BJP（北京）；…" """
+    data = parse_json_output(raw)
+    if not isinstance(data, dict):
+        return extract_text(raw)
+    parts = []
+    for city, station in data.items():
+        if isinstance(station, dict) and station.get("station_code"):
+            parts.append(f"{city}: {station['station_code']}（{station.get('station_name') or city}）")
+    return "；".join(parts) or extract_text(raw)
+
+
+def _airport_codes(context: Dict[str, Any]) -> Optional[str]:
+    index = get_code_index()
+    parts = [
+        f"{_city(context.get(key))}: {'/'.join(codes)}"
+        for key in ("origin", "destination")
+        if (codes := index.airport_codes(context.get(key)))
+    ]
+    return "；".join(parts) or None
+
+
+@dataclass(frozen=True)
+class ToolPrerequisite:
+    """
+    前置工具：选中 targets 中任意一个工具时，在本地预先调用 tool
+
+    local 为本地解析函数（参数 -> 结果），能解析时不调用工具；tool 为None表示只在本地解析
+    """
+    tool: Optional[str]
+    targets: Tuple[str, ...]
+    label: str
+    build_args: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+    render: Callable[[Any], str] = extract_text
+    ttl_seconds: float = 24 * 3600
+    local: Optional[Callable[[Dict[str, Any]], Optional[Any]]] = None
+
+
+TOOL_PREREQUISITES: List[ToolPrerequisite] = [
+    ToolPrerequisite(
+        tool=STATION_CODE_TOOL,
+        targets=("get-tickets", "get-interline-tickets"),
+        label="出发地/目的地车站代码（get-tickets 的 fromStation/toStation 直接使用）",
+        build_args=lambda context: (
+            {"citys": f"{_city(context.get('origin'))}|{_city(context.get('destination'))}"}
+            if _city(context.get("origin")) and _city(context.get("destination")) else None
+        ),
+        render=_render_station_codes,
+        local=lambda args: get_code_index().lookup_station_codes(args["citys"]),
+    ),
+    ToolPrerequisite(
+        tool="get-current-date",
+        targets=("get-tickets", "get-interline-tickets"),
+        label="当前日期（上海时区）",
+        build_args=lambda context: {},
+        ttl_seconds=60,
+    ),
+    ToolPrerequisite(
+        tool=None,
+        targets=("searchFlightsByDepArr", "searchFlightItineraries", "getFlightTransferInfo"),
+        label="出发地/目的地机场三字码（航班查询的出发/到达参数直接使用）",
+        build_args=lambda context: context,
+        local=_airport_codes,
+    ),
+]
+
+
+class PrerequisiteCache:
+    """前置工具结果缓存（进程级，按 工具名 + 参数 缓存，带过期时间）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[tuple, Tuple[float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(tool: str, args: Dict[str, Any]) -> tuple:
+        return (tool, tuple(sorted((k, str(v)) for k, v in args.items())))
+
+    def get(self, tool: str, args: Dict[str, Any]) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(self._key(tool, args))
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, tool: str, args: Dict[str, Any], result: Any, ttl_seconds: float):
+        with self._lock:
+            self._entries[self._key(tool, args)] = (time.monotonic() + ttl_seconds, result)
+
+
+_prerequisite_cache = PrerequisiteCache()
+
+
+def get_prerequisite_cache() -> PrerequisiteCache:
+    """获取前置工具结果缓存单例"""
+    return _prerequisite_cache
+
+
+async def _resolve_one(prerequisite: ToolPrerequisite, tool: Any, args: Dict[str, Any]) -> Optional[str]:
+    if prerequisite.local is not None:
+        result = prerequisite.local(args)
+        if result is not None:
+            return prerequisite.render(result)
+        if tool is None:
+            return None
+    cache = get_prerequisite_cache()
+    result = cache.get(prerequisite.tool, args)
+    if result is None:
+        result = await tool.ainvoke(args)
+        if not extract_text(result).strip():
+            return None
+        get_code_index().learn(prerequisite.tool, extract_text(result))
+        cache.put(prerequisite.tool, args, result, prerequisite.ttl_seconds)
+    return prerequisite.render(result)
+
+
+async def resolve_prerequisites(
+    selected_tools: List[Any],
+    all_tools: List[Any],
+    context: Dict[str, Any]
+) -> str:
+    """
+    并行解析本次任务选中的工具所需的前置信息
+
+    Args:
+        selected_tools: 本次任务选中的工具
+        all_tools: 子Agent的全部工具（前置工具从中查找）
+        context: 任务上下文（origin、destination、date等）
+
+    Returns:
+        写入提示词的前置信息文本（每行 "- 说明: 结果"）；没有需要解析的前置工具时返回空字符串
+    """
+    selected_names = {getattr(tool, "name", str(tool)) for tool in selected_tools}
+    tool_map = {getattr(tool, "name", str(tool)): tool for tool in all_tools}
+
+    jobs = []
+    for prerequisite in TOOL_PREREQUISITES:
+        if not selected_names.intersection(prerequisite.targets):
+            continue
+        if prerequisite.tool is not None and prerequisite.tool not in tool_map:
+            continue
+        args = prerequisite.build_args(context)
+        if args is None:
+            continue
+        jobs.append((prerequisite, args))
+    if not jobs:
+        return ""
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(
+        *(_resolve_one(prerequisite, tool_map.get(prerequisite.tool), args) for prerequisite, args in jobs),
+        return_exceptions=True
+    )
+
+    lines = []
+    for (prerequisite, args), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logger.warning(f"⚠️ 前置工具 {prerequisite.tool}({args}) 调用失败，交给LLM调用: {result}")
+            continue
+        if result:
+            lines.append(f"- {prerequisite.label}: {result}")
+    if lines:
+        logger.info(f"✅ 【工具调用链】已在本地预先解析{len(lines)}个前置工具，耗时{time.perf_counter() - started_at:.2f}s")
+    return "\n".join(lines)
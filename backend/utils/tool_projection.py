@@ -0,0 +1,591 @@
+"""
+工具结果投影模块
+MCP工具返回的原始数据（12306车次列表、高德POI、酒店列表等）大部分字段规划时用不到，
+这里按工具名称注册投影函数：解析JSON/文本输出，只保留需要的字段，并把列表渲染成紧凑表格。
+
+原始输出仍然完整保存在 data/tool_executions 中（ToolMessage.artifact），
+只有投影后的紧凑内容进入 ToolMessage.content 传给LLM。
+"""
+import re
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("utils.tool_projection")
+
+# 工具名称 -> 投影函数
+_PROJECTIONS: Dict[str, Callable[[Any], Optional[str]]] = {}
+
+# 单元格最大字符数，避免某个字段（如简介）撑爆表格
+MAX_CELL_CHARS = 60
+
+
+def register_projection(*tool_names: str):
+    """
+    注册工具结果投影函数的装饰器
+
+    投影函数接收工具原始输出，返回紧凑文本；返回None表示无法投影（将使用原始输出）
+
+    Args:
+        tool_names: 该投影适用的工具名称
+    """
+    def decorator(func: Callable[[Any], Optional[str]]):
+        for name in tool_names:
+            _PROJECTIONS[name] = func
+        return func
+    return decorator
+
+
+def extract_text(raw: Any) -> str:
+    """
+    提取工具原始输出的文本内容
+
+    兼容三种返回形式：字符串、MCP内容块列表（[{"type": "text", "text": ...}]）、其他对象
+
+    Args:
+        raw: 工具原始输出
+
+    Returns:
+        文本内容
+    """
+    if raw is None:
+        return ""
+    if isinstance(raw, str):
+        return raw
+    if isinstance(raw, list) and raw and all(isinstance(b, dict) and "text" in b for b in raw):
+        return "\n".join(str(b.get("text", "")) for b in raw)
+    if isinstance(raw, (dict, list)):
+        try:
+            return json.dumps(raw, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return str(raw)
+    return str(raw)
+
+
+def parse_json_output(raw: Any) -> Optional[Any]:
+    """
+    尝试将工具输出解析为JSON对象
+
+    Args:
+        raw: 工具原始输出
+
+    Returns:
+        解析后的对象，无法解析时返回None
+    """
+    if isinstance(raw, (dict, list)) and not (raw and isinstance(raw, list) and isinstance(raw[0], dict) and "type" in raw[0] and "text" in raw[0]):
+        return raw
+
+    text = extract_text(raw).strip()
+    if not text:
+        return None
+
+    # 去掉可能的代码块标记
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.startswith("json"):
+            text = text[4:]
+        text = text.strip()
+
+    if not text or text[0] not in "[{":
+        return None
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, ValueError):
+        return None
+
+
+def _cell(value: Any, max_chars: int = MAX_CELL_CHARS) -> str:
+    """将单元格的值转换为紧凑文本"""
+    if value is None or value == "" or value == []:
+        return "-"
+    if isinstance(value, (list, tuple)):
+        value = ",".join(str(v) for v in value if v not in (None, ""))
+    elif isinstance(value, dict):
+        value = ",".join(f"{k}:{v}" for k, v in value.items() if v not in (None, ""))
+    text = str(value).replace("|", "/").replace("\n", " ").strip()
+    if len(text) > max_chars:
+        text = text[:max_chars] + "…"
+    return text or "-"
+
+
+def render_table(
+    rows: List[Dict[str, Any]],
+    columns: List[Tuple[str, str]],
+    title: str = "",
+    max_cell_chars: int = MAX_CELL_CHARS
+) -> str:
+    """
+    将字典列表渲染为紧凑的竖线分隔表格
+
+    Args:
+        rows: 数据行
+        columns: [(字段名, 表头)] 列定义
+        title: 表格标题（可选）
+        max_cell_chars: 单元格最大字符数
+
+    Returns:
+        表格文本
+    """
+    lines = []
+    if title:
+        lines.append(f"{title}（共{len(rows)}条）")
+    lines.append("|".join(header for _, header in columns))
+    for row in rows:
+        lines.append("|".join(_cell(row.get(key), max_cell_chars) for key, _ in columns))
+    return "\n".join(lines)
+
+
+def _pick(item: Dict[str, Any], *keys: str) -> Any:
+    """按顺序返回第一个存在且非空的字段值（兼容不同MCP版本的字段名）"""
+    for key in keys:
+        value = item.get(key)
+        if value not in (None, "", []):
+            return value
+    return None
+
+
+def find_record_list(data: Any) -> List[Dict[str, Any]]:
+    """在JSON结果中找到最主要的记录列表（最长的字典列表）"""
+    if isinstance(data, list):
+        return [item for item in data if isinstance(item, dict)]
+    if not isinstance(data, dict):
+        return []
+
+    best: List[Dict[str, Any]] = []
+    for value in data.values():
+        if isinstance(value, list) and value and isinstance(value[0], dict) and len(value) > len(best):
+            best = value
+        elif isinstance(value, dict):
+            nested = find_record_list(value)
+            if len(nested) > len(best):
+                best = nested
+    return best
+
+
+# ========================================
+# 12306 火车票
+# ========================================
+
+_TRAIN_HEADER_RE = re.compile(
+    r"^(?P<code>[A-Z]?\d+)(?:\(实际车次train_no:\s*\S+\))?\s+"
+    r"(?P<from>\S+?)\(telecode:\s*(?P<from_code>\w+)\)\s*->\s*"
+    r"(?P<to>\S+?)\(telecode:\s*(?P<to_code>\w+)\)\s+"
+    r"(?P<start>\d{1,2}:\d{2})\s*->\s*(?P<arrive>\d{1,2}:\d{2})\s+历时[：:]\s*(?P<duration>\S+)"
+)
+_TRAIN_SEAT_RE = re.compile(r"^-\s*(?P<name>[^:：]+)[:：]\s*(?P<num>.*?)\s*(?P<price>\d+(?:\.\d+)?)元")
+
+
+def parse_train_tickets(raw: Any) -> List[Dict[str, Any]]:
+    """
+    解析12306 get-tickets 的输出（兼容json格式和默认text格式）
+
+    Args:
+        raw: 工具原始输出
+
+    Returns:
+        车次列表，每项包含 train_code、from_station、to_station、start_time、arrive_time、
+        duration、seats（[{name, num, price}]）
+    """
+    data = parse_json_output(raw)
+    tickets: List[Dict[str, Any]] = []
+
+    if data is not None:
+        for item in find_record_list(data):
+            seats = []
+            for price in item.get("prices") or []:
+                if isinstance(price, dict):
+                    seats.append({
+                        "name": _pick(price, "seat_name", "short"),
+                        "num": price.get("num"),
+                        "price": price.get("price"),
+                    })
+            tickets.append({
+                "train_code": _pick(item, "start_train_code", "train_code", "station_train_code"),
+                "from_station": _pick(item, "from_station", "from_station_name"),
+                "to_station": _pick(item, "to_station", "to_station_name"),
+                "start_date": item.get("start_date"),
+                "start_time": item.get("start_time"),
+                "arrive_time": item.get("arrive_time"),
+                "duration": _pick(item, "lishi", "duration"),
+                "seats": seats,
+            })
+        return [t for t in tickets if t.get("train_code")]
+
+    current = None
+    for line in extract_text(raw).splitlines():
+        line = line.strip()
+        header = _TRAIN_HEADER_RE.match(line)
+        if header:
+            current = {
+                "train_code": header.group("code"),
+                "from_station": header.group("from"),
+                "to_station": header.group("to"),
+                "start_time": header.group("start"),
+                "arrive_time": header.group("arrive"),
+                "duration": header.group("duration"),
+                "seats": [],
+            }
+            tickets.append(current)
+            continue
+        seat = _TRAIN_SEAT_RE.match(line)
+        if seat and current is not None:
+            current["seats"].append({
+                "name": seat.group("name").strip(),
+                "num": seat.group("num").strip(),
+                "price": seat.group("price"),
+            })
+    return tickets
+
+
+@register_projection("get-tickets")
+def _project_train_tickets(raw: Any) -> Optional[str]:
+    tickets = parse_train_tickets(raw)
+    if not tickets:
+        return None
+    rows = []
+    for ticket in tickets:
+        row = dict(ticket)
+        row["seats"] = ";".join(
+            f"{s.get('name')}:{s.get('num') or '-'}/{s.get('price')}元" for s in ticket["seats"]
+        )
+        rows.append(row)
+    return render_table(rows, [
+        ("train_code", "车次"),
+        ("from_station", "出发站"),
+        ("to_station", "到达站"),
+        ("start_time", "出发"),
+        ("arrive_time", "到达"),
+        ("duration", "历时"),
+        ("seats", "席位:余票/价格"),
+    ], title="火车票", max_cell_chars=200)
+
+
+# ========================================
+# 航班（variflight）
+# ========================================
+
+def parse_flights(raw: Any) -> List[Dict[str, Any]]:
+    """
+    解析航班工具（variflight）的输出
+
+    Args:
+        raw: 工具原始输出
+
+    Returns:
+        航班列表，每项包含 flight_no、company、dep_city、arr_city、dep_airport、arr_airport、dep_time、arr_time、transfer、price、state
+    """
+    rows = []
+    for item in find_record_list(parse_json_output(raw)):
+        rows.append({
+            "flight_no": _pick(item, "FlightNo", "flightNo", "flight_no"),
+            "company": _pick(item, "FlightCompany", "airline", "airlineName"),
+            "dep_city": _pick(item, "FlightDep", "depCity", "dep_city"),
+            "arr_city": _pick(item, "FlightArr", "arrCity", "arr_city"),
+            "dep_airport": _pick(item, "FlightDepAirport", "depAirport", "dep_airport", "FlightDepcode"),
+            "arr_airport": _pick(item, "FlightArrAirport", "arrAirport", "arr_airport", "FlightArrcode"),
+            "dep_time": _pick(item, "FlightDeptimePlanDate", "depTime", "dep_time", "departureTime"),
+            "arr_time": _pick(item, "FlightArrtimePlanDate", "arrTime", "arr_time", "arrivalTime"),
+            "transfer": _pick(item, "transferCity", "transfer_city", "FlightTransfer"),
+            "price": _pick(item, "price", "minPrice", "lowestPrice", "ticketPrice"),
+            "state": _pick(item, "FlightState", "status"),
+        })
+    return rows
+
+
+@register_projection("searchFlightsByDepArr", "searchFlightItineraries", "getFlightTransferInfo")
+def _project_flights(raw: Any) -> Optional[str]:
+    rows = parse_flights(raw)
+    if not rows:
+        return None
+    return render_table(rows, [
+        ("flight_no", "航班号"),
+        ("company", "航司"),
+        ("dep_airport", "出发机场"),
+        ("arr_airport", "到达机场"),
+        ("dep_time", "计划起飞"),
+        ("arr_time", "计划到达"),
+        ("transfer", "中转"),
+        ("price", "价格"),
+        ("state", "状态"),
+    ], title="航班")
+
+
+# ========================================
+# 高德地图
+# ========================================
+
+def parse_pois(raw: Any) -> List[Dict[str, Any]]:
+    """
+    解析高德POI搜索（maps_text_search / maps_around_search）的输出
+
+    Args:
+        raw: 工具原始输出
+
+    Returns:
+        POI列表（高德原始字段：id、name、address、typecode、type、location等）
+    """
+    data = parse_json_output(raw)
+    pois = data.get("pois") if isinstance(data, dict) else None
+    if not isinstance(pois, list):
+        pois = find_record_list(data)
+    return [poi for poi in pois if isinstance(poi, dict)]
+
+
+@register_projection("maps_text_search", "maps_around_search")
+def _project_pois(raw: Any) -> Optional[str]:
+    pois = parse_pois(raw)
+    if not pois:
+        return None
+    return render_table(pois, [
+        ("name", "名称"),
+        ("address", "地址"),
+        ("typecode", "类型"),
+        ("location", "坐标"),
+        ("id", "POI ID"),
+    ], title="POI")
+
+
+@register_projection("maps_search_detail")
+def _project_poi_detail(raw: Any) -> Optional[str]:
+    data = parse_json_output(raw)
+    if not isinstance(data, dict):
+        return None
+    keep = ["id", "name", "location", "address", "business_area", "city", "type", "alias", "opentime2", "open_time", "cost", "rating", "tel"]
+    detail = {key: data[key] for key in keep if data.get(key) not in (None, "", [])}
+    return json.dumps(detail, ensure_ascii=False) if detail else None
+
+
+@register_projection("maps_geo")
+def _project_geo(raw: Any) -> Optional[str]:
+    results = find_record_list(parse_json_output(raw))
+    if not results:
+        return None
+    return render_table(results, [
+        ("province", "省"),
+        ("city", "市"),
+        ("district", "区"),
+        ("street", "街道"),
+        ("location", "坐标"),
+        ("adcode", "adcode"),
+    ], title="地理编码")
+
+
+def parse_weather(raw: Any) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    解析高德天气（maps_weather）的输出
+
+    Args:
+        raw: 工具原始输出
+
+    Returns:
+        (城市, 预报列表)，预报为高德原始字段：date、dayweather、nightweather、daytemp、nighttemp、daywind、daypower
+    """
+    data = parse_json_output(raw)
+    forecasts = data.get("forecasts") if isinstance(data, dict) else None
+    if not isinstance(forecasts, list):
+        return "", []
+    return data.get("city", ""), [item for item in forecasts if isinstance(item, dict)]
+
+
+@register_projection("maps_weather")
+def _project_weather(raw: Any) -> Optional[str]:
+    city, forecasts = parse_weather(raw)
+    if not forecasts:
+        return None
+    return render_table(forecasts, [
+        ("date", "日期"),
+        ("dayweather", "白天"),
+        ("nightweather", "夜间"),
+        ("daytemp", "最高温"),
+        ("nighttemp", "最低温"),
+        ("daywind", "风向"),
+        ("daypower", "风力"),
+    ], title=f"{city}天气预报")
+
+
+# 路线规划只保留距离、耗时和前几步的导航指引
+MAX_ROUTE_STEPS = 8
+
+
+@register_projection(
+    "maps_direction_driving",
+    "maps_direction_walking",
+    "maps_direction_bicycling",
+    "maps_bicycling",
+    "maps_direction_transit_integrated",
+)
+def _project_route(raw: Any) -> Optional[str]:
+    data = parse_json_output(raw)
+    if not isinstance(data, dict):
+        return None
+
+    route = data.get("route") if isinstance(data.get("route"), dict) else data
+    paths = route.get("paths") or route.get("transits") or []
+    if not isinstance(paths, list) or not paths:
+        return None
+
+    lines = [f"路线 {route.get('origin', data.get('origin', ''))} -> {route.get('destination', data.get('destination', ''))}（共{len(paths)}个方案）"]
+    for idx, path in enumerate(paths[:3], 1):
+        if not isinstance(path, dict):
+            continue
+        distance = path.get("distance", route.get("distance", "-"))
+        duration = path.get("duration", "-")
+        lines.append(f"方案{idx}: 距离{distance}米, 耗时{duration}秒, 费用{path.get('cost', path.get('tolls', '-'))}")
+
+        steps = path.get("steps") or []
+        instructions = [step.get("instruction") for step in steps if isinstance(step, dict) and step.get("instruction")]
+        if not instructions:
+            # 公交方案：按换乘段输出
+            for segment in path.get("segments") or []:
+                if not isinstance(segment, dict):
+                    continue
+                bus = segment.get("bus") or {}
+                for line in bus.get("buslines") or []:
+                    if isinstance(line, dict) and line.get("name"):
+                        instructions.append(f"乘坐{line['name']}（{line.get('departure_stop', {}).get('name', '')}→{line.get('arrival_stop', {}).get('name', '')}）")
+        for step_text in instructions[:MAX_ROUTE_STEPS]:
+            lines.append(f"  - {_cell(step_text)}")
+        if len(instructions) > MAX_ROUTE_STEPS:
+            lines.append(f"  - …（其余{len(instructions) - MAX_ROUTE_STEPS}步省略）")
+    return "\n".join(lines)
+
+
+@register_projection("maps_distance")
+def _project_distance(raw: Any) -> Optional[str]:
+    results = find_record_list(parse_json_output(raw))
+    if not results:
+        return None
+    return render_table(results, [
+        ("origin_id", "起点序号"),
+        ("dest_id", "终点序号"),
+        ("distance", "距离(米)"),
+        ("duration", "耗时(秒)"),
+    ], title="距离测量")
+
+
+# ========================================
+# 酒店（aigohotel）
+# ========================================
+
+def parse_hotels(raw: Any) -> List[Dict[str, Any]]:
+    """
+    解析酒店工具（aigohotel）的输出
+
+    Args:
+        raw: 工具原始输出
+
+    Returns:
+        酒店列表，每项包含 name、star、score、price、nights、address、distance、id
+    """
+    rows = []
+    for item in find_record_list(parse_json_output(raw)):
+        rows.append({
+            "name": _pick(item, "name", "hotelName", "Name", "HotelName"),
+            "star": _pick(item, "starRating", "star", "Star", "StarRating"),
+            "score": _pick(item, "score", "rating", "Score", "Rating"),
+            "price": _pick(item, "price", "Price", "minPrice", "lowestPrice"),
+            "nights": _pick(item, "stayNights", "StayNights"),
+            "address": _pick(item, "address", "Address"),
+            "distance": _pick(item, "distance", "Distance", "distanceToCenter"),
+            "id": _pick(item, "hotelId", "id", "HotelId"),
+        })
+    return rows
+
+
+def hotel_price_per_night(hotel: Dict[str, Any]) -> Optional[float]:
+    """
+    酒店每晚价格：aigohotel 返回的价格是 stayNights 晚的总价，有晚数时按晚数折算
+
+    Args:
+        hotel: parse_hotels 返回的一项
+
+    Returns:
+        每晚价格；没有价格时返回None
+    """
+    def number(value: Any) -> Optional[float]:
+        if isinstance(value, (int, float)):
+            return float(value)
+        match = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+        return float(match.group()) if match else None
+
+    price, nights = number(hotel.get("price")), number(hotel.get("nights"))
+    if price is None:
+        return None
+    if nights and nights > 0:
+        price = round(price / nights, 1)
+    return int(price) if price.is_integer() else price
+
+
+@register_projection("find-hotels", "search-hotels", "searchHotels")
+def _project_hotels(raw: Any) -> Optional[str]:
+    rows = parse_hotels(raw)
+    if not rows:
+        return None
+    return render_table(rows, [
+        ("name", "酒店"),
+        ("star", "星级"),
+        ("score", "评分"),
+        ("price", "价格"),
+        ("nights", "晚数"),
+        ("address", "地址"),
+        ("distance", "距离"),
+        ("id", "酒店ID"),
+    ], title="酒店")
+
+
+# ========================================
+# 智谱搜索
+# ========================================
+
+# 搜索结果每条保留的摘要字符数
+SEARCH_CONTENT_CHARS = 300
+
+
+@register_projection("zhipu_search")
+def _project_search(raw: Any) -> Optional[str]:
+    results = getattr(raw, "search_result", None)
+    if results is None:
+        data = parse_json_output(raw)
+        results = data.get("search_result") if isinstance(data, dict) else None
+    if not results:
+        return None
+
+    lines = [f"搜索结果（共{len(results)}条）"]
+    for idx, item in enumerate(results, 1):
+        get = item.get if isinstance(item, dict) else (lambda key, _item=item: getattr(_item, key, None))
+        content = str(get("content") or "").replace("\n", " ")
+        if len(content) > SEARCH_CONTENT_CHARS:
+            content = content[:SEARCH_CONTENT_CHARS] + "…"
+        lines.append(f"{idx}. {get('title') or ''}（{get('media') or get('link') or ''}）\n   {content}")
+    return "\n".join(lines)
+
+
+def project_tool_output(tool_name: str, raw: Any) -> str:
+    """
+    将工具原始输出投影为传给LLM的紧凑内容
+
+    未注册投影、解析失败或投影结果不比原始输出短时，返回原始文本
+
+    Args:
+        tool_name: 工具名称
+        raw: 工具原始输出
+
+    Returns:
+        紧凑内容
+    """
+    raw_text = extract_text(raw)
+    projection = _PROJECTIONS.get(tool_name)
+    if projection is None:
+        return raw_text
+
+    try:
+        projected = projection(raw)
+    except Exception as e:
+        logger.warning(f"工具 {tool_name} 结果投影失败，使用原始输出: {type(e).__name__}: {e}")
+        return raw_text
+
+    if not projected or len(projected) >= len(raw_text):
+        return raw_text
+
+    logger.info(f"工具 {tool_name} 结果已投影压缩: {len(raw_text)} → {len(projected)} 字符")
+    return projected
@@ -0,0 +1,289 @@
+"""
+工具结果后处理模块
+子Agent完成一个任务后，对收集到的工具结果做去重和相关性过滤：
+1. 完全重复：按（工具名 + 内容）哈希去掉重复的ToolMessage（例如多次调用maps_weather返回同样的预报）
+2. 近似重复：合并不同消息中的同一条记录（同一POI、同一天的天气；车次/航班只在同一日期、同一线路的查询之间合并）
+3. 超出范围：按任务上下文过滤出行日期之外的天气、与出行城市无关的天气和搜索结果
+
+只处理 utils/tool_projection.py 输出的表格/搜索结果格式，其他内容原样保留
+"""
+import re
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import ToolMessage
+
+from utils.token_counter import estimate_tokens
+from utils.code_index import get_code_index
+
+logger = logging.getLogger("utils.tool_result_filter")
+
+# 表格标题行，例如 "火车票（共12条）"
+_TABLE_TITLE_RE = re.compile(r"^(?P<title>.*?)（共(?P<count>\d+)条）$")
+# 搜索结果条目，例如 "3. 标题（来源）"
+_SEARCH_ITEM_RE = re.compile(r"^\d+\.\s")
+_DATE_RE = re.compile(r"(\d{4})[-/年.](\d{1,2})[-/月.](\d{1,2})")
+
+# 用于识别同一条记录的列（按优先级），同一表格标题下该列相同的行视为同一记录
+RECORD_KEY_COLUMNS = ["POI ID", "酒店ID", "车次", "航班号", "日期", "名称", "酒店"]
+
+# 按日期和线路查询的记录：同一车次/航班在不同日期、不同线路的查询结果中是不同的记录，
+# 同一酒店在不同入住日期、晚数的查询结果中价格不同，识别时加上查询参数，只合并同一查询重复返回的行
+QUERY_SCOPED_KEY_COLUMNS = {"车次", "航班号", "酒店ID", "酒店"}
+
+# 出行日期前后额外保留的天数（天气等按日期的数据）
+DATE_WINDOW_MARGIN_DAYS = 1
+
+
+def _content_hash(msg: ToolMessage) -> str:
+    """计算工具消息的内容哈希（忽略空白差异；车次/航班表格加上查询参数，不同日期返回的相同内容不算重复）"""
+    normalized = re.sub(r"\s+", " ", str(msg.content)).strip()
+    lines = str(msg.content).split("\n", 2)
+    scoped = len(lines) > 1 and any(col in lines[1].split("|") for col in QUERY_SCOPED_KEY_COLUMNS)
+    scope = _query_scope(msg) if scoped else ()
+    return hashlib.sha1(f"{getattr(msg, 'name', '')}\n{scope}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+def _parse_date(value: Any) -> Optional[datetime]:
+    """从文本中解析日期，解析失败返回None"""
+    match = _DATE_RE.search(str(value or ""))
+    if not match:
+        return None
+    try:
+        return datetime(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    except ValueError:
+        return None
+
+
+def _date_window(context: Dict[str, Any]) -> Optional[Tuple[datetime, datetime]]:
+    """根据出发日期和天数计算允许的日期范围"""
+    start = _parse_date(context.get("date"))
+    if start is None:
+        return None
+    try:
+        days = max(int(context.get("days") or 1), 1)
+    except (TypeError, ValueError):
+        days = 1
+    margin = timedelta(days=DATE_WINDOW_MARGIN_DAYS)
+    return start - margin, start + timedelta(days=days - 1) + margin
+
+
+def _city_core(name: Any) -> str:
+    """去掉城市名称的行政区划后缀（北京市 -> 北京）"""
+    text = str(name or "").strip()
+    for suffix in ("特别行政区", "自治州", "地区", "省", "市", "县"):
+        if text.endswith(suffix) and len(text) > len(suffix) + 1:
+            return text[: -len(suffix)]
+    return text
+
+
+def _scope_cities(context: Dict[str, Any]) -> List[str]:
+    """任务涉及的城市（出发地、目的地）"""
+    cities = []
+    for key in ("origin", "destination"):
+        core = _city_core(context.get(key))
+        if len(core) >= 2 and core not in ("未知",):
+            cities.append(core)
+    return cities
+
+
+def _mentions_other_city(text: str, cities: List[str], known_cities: set) -> bool:
+    """文本是否提到了任务涉及的城市以外的城市（车站/机场代码索引中的城市）"""
+    named = {city for city in known_cities if city in text}
+    return any(not _mentions_scope(city, cities) and not any(city in scope for scope in cities) for city in named)
+
+
+def _mentions_scope(text: str, cities: List[str]) -> bool:
+    """文本是否提到了任务涉及的城市"""
+    if not cities:
+        return True
+    return any(city in text for city in cities)
+
+
+def _query_scope(msg: ToolMessage) -> Tuple:
+    """工具调用参数（如查询日期、出发/到达站），用于区分不同查询返回的同一车次/航班"""
+    tool_args = (getattr(msg, "additional_kwargs", None) or {}).get("tool_args") or {}
+    if not isinstance(tool_args, dict):
+        return ()
+    return tuple(sorted((str(k), str(v)) for k, v in tool_args.items() if v not in (None, "", [])))
+
+
+def _process_table(
+    lines: List[str],
+    seen_keys: set,
+    query_scope: Tuple,
+    date_window: Optional[Tuple[datetime, datetime]],
+    cities: List[str],
+    task: str,
+    stats: Dict[str, int]
+) -> Optional[List[str]]:
+    """
+    处理投影后的表格：合并已出现过的记录、过滤日期范围之外的行
+
+    Returns:
+        处理后的行；整个表格都被过滤时返回空列表；不是表格格式时返回None
+    """
+    if len(lines) < 2:
+        return None
+    title_match = _TABLE_TITLE_RE.match(lines[0].strip())
+    if not title_match or "|" not in lines[1]:
+        return None
+
+    title = title_match.group("title")
+    headers = lines[1].split("|")
+
+    # 天气表格的标题带城市名，与出行城市无关的整表过滤
+    if title.endswith("天气预报") and title != "天气预报":
+        weather_city = _city_core(title[: -len("天气预报")])
+        if cities and not _mentions_scope(weather_city, cities) and weather_city not in task:
+            stats["rows_filtered"] += len(lines) - 2
+            return []
+
+    key_column = next((col for col in RECORD_KEY_COLUMNS if col in headers), None)
+    key_index = headers.index(key_column) if key_column is not None else None
+    scope = query_scope if key_column in QUERY_SCOPED_KEY_COLUMNS else ()
+    date_index = headers.index("日期") if "日期" in headers else None
+
+    kept_rows = []
+    for row in lines[2:]:
+        cells = row.split("|")
+        if key_index is not None and key_index < len(cells) and cells[key_index] not in ("", "-"):
+            record_key = (title, scope, cells[key_index])
+            if record_key in seen_keys:
+                stats["records_merged"] += 1
+                continue
+            seen_keys.add(record_key)
+
+        if date_window and date_index is not None and date_index < len(cells):
+            row_date = _parse_date(cells[date_index])
+            if row_date and not (date_window[0] <= row_date <= date_window[1]):
+                stats["rows_filtered"] += 1
+                continue
+
+        kept_rows.append(row)
+
+    if not kept_rows:
+        return []
+    return [f"{title}（共{len(kept_rows)}条）", lines[1]] + kept_rows
+
+
+def _process_search(lines: List[str], cities: List[str], stats: Dict[str, int]) -> Optional[List[str]]:
+    """
+    处理投影后的搜索结果：去掉只提到其他城市、没有提到出行城市的条目
+    （没有提到任何城市的条目保留，例如不带城市名的景点、餐厅）
+
+    Returns:
+        处理后的行；不是搜索结果格式时返回None
+    """
+    if not lines or not lines[0].startswith("搜索结果（共"):
+        return None
+
+    items: List[List[str]] = []
+    for line in lines[1:]:
+        if _SEARCH_ITEM_RE.match(line) or not items:
+            items.append([line])
+        else:
+            items[-1].append(line)
+
+    known_cities = get_code_index().known_cities() if cities else set()
+    kept = [
+        item for item in items
+        if _mentions_scope("\n".join(item), cities) or not _mentions_other_city("\n".join(item), cities, known_cities)
+    ]
+    if not kept:
+        # 全部不相关时保留原结果，避免补全搜索完全没有内容
+        return None
+    stats["rows_filtered"] += len(items) - len(kept)
+
+    renumbered = []
+    for idx, item in enumerate(kept, 1):
+        renumbered.append(_SEARCH_ITEM_RE.sub(f"{idx}. ", item[0], count=1))
+        renumbered.extend(item[1:])
+    return [f"搜索结果（共{len(kept)}条）"] + renumbered
+
+
+def filter_tool_messages(
+    tool_messages: List[ToolMessage],
+    context: Dict[str, Any],
+    task: str = ""
+) -> Tuple[List[ToolMessage], Dict[str, int]]:
+    """
+    对一个任务收集到的工具结果去重、合并近似重复记录并过滤超出范围的内容
+
+    原消息不会被修改，内容有变化的消息会返回副本（artifact中的原始输出保持不变）
+
+    Args:
+        tool_messages: 工具消息列表（按执行顺序）
+        context: 任务上下文（origin、destination、date、days等）
+        task: 任务描述
+
+    Returns:
+        (处理后的工具消息列表, 统计信息)
+        统计信息包含 duplicates_removed、records_merged、rows_filtered、
+        messages_removed、bytes_removed、tokens_removed
+    """
+    stats = {
+        "duplicates_removed": 0,
+        "records_merged": 0,
+        "rows_filtered": 0,
+        "messages_removed": 0,
+        "bytes_removed": 0,
+        "tokens_removed": 0,
+    }
+    if not tool_messages:
+        return [], stats
+
+    date_window = _date_window(context)
+    cities = _scope_cities(context)
+    seen_hashes = set()
+    seen_keys: set = set()
+    result: List[ToolMessage] = []
+
+    for msg in tool_messages:
+        if not isinstance(msg, ToolMessage) or not isinstance(msg.content, str):
+            result.append(msg)
+            continue
+
+        original = msg.content
+        digest = _content_hash(msg)
+        if digest in seen_hashes:
+            stats["duplicates_removed"] += 1
+            stats["bytes_removed"] += len(original.encode("utf-8"))
+            stats["tokens_removed"] += estimate_tokens(original)
+            continue
+        seen_hashes.add(digest)
+
+        lines = original.split("\n")
+        processed = _process_table(lines, seen_keys, _query_scope(msg), date_window, cities, task, stats)
+        if processed is None:
+            processed = _process_search(lines, cities, stats)
+
+        if processed is None:
+            result.append(msg)
+            continue
+
+        if not processed:
+            stats["messages_removed"] += 1
+            stats["bytes_removed"] += len(original.encode("utf-8"))
+            stats["tokens_removed"] += estimate_tokens(original)
+            continue
+
+        new_content = "\n".join(processed)
+        if new_content == original:
+            result.append(msg)
+            continue
+
+        stats["bytes_removed"] += len(original.encode("utf-8")) - len(new_content.encode("utf-8"))
+        stats["tokens_removed"] += estimate_tokens(original) - estimate_tokens(new_content)
+        result.append(msg.model_copy(update={"content": new_content}))
+
+    if stats["bytes_removed"] > 0:
+        logger.info(
+            f"✅ 工具结果后处理: {len(tool_messages)} → {len(result)} 条消息，"
+            f"去重{stats['duplicates_removed']}条，合并重复记录{stats['records_merged']}条，"
+            f"过滤超范围{stats['rows_filtered']}条，"
+            f"减少{stats['bytes_removed']}字节/约{stats['tokens_removed']}个token"
+        )
+    return result, stats
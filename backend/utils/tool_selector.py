@@ -0,0 +1,103 @@
+"""
+子Agent工具选择模块
+按任务内容为子Agent挑选最相关的少量工具进行绑定，避免每轮都把该Agent的全部工具schema发给模型
+
+打分方式：任务文本与工具名称、描述、关键词提示的检索词重叠度，按idf加权（不使用向量模型）
+"""
+import math
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from utils.retrieval_index import tokenize
+from config.sub_agent_config import TOOL_COMPANIONS
+
+logger = logging.getLogger("utils.tool_selector")
+
+# 工具的中文关键词提示（部分MCP工具描述是英文或过于简短，任务描述一般是中文）
+TOOL_KEYWORD_HINTS = {
+    "get-tickets": "火车票 高铁 动车 车次 余票 票价",
+    "get-interline-tickets": "中转 换乘 联程 火车票",
+    "get-station-code-of-citys": "车站 站点 代码 城市",
+    "get-train-route-stations": "经停站 途经",
+    "get-current-date": "日期 今天",
+    "searchFlightsByDepArr": "航班 机票 飞机 起飞 降落",
+    "searchFlightItineraries": "机票 价格 航班 行程",
+    "getFlightTransferInfo": "中转 航班 转机",
+    "maps_text_search": "搜索 景点 景区 餐厅 美食 酒店 关键词",
+    "maps_around_search": "周边 附近 周围",
+    "maps_search_detail": "详情 门票 开放时间 评分",
+    "maps_direction_driving": "驾车 自驾 开车 路线",
+    "maps_direction_walking": "步行 走路 路线",
+    "maps_direction_transit_integrated": "公交 地铁 公共交通 路线",
+    "maps_bicycling": "骑行 自行车 路线",
+    "maps_distance": "距离 多远",
+    "maps_geo": "坐标 经纬度 地理编码 地址",
+    "maps_regeocode": "逆地理编码 坐标 地址",
+    "maps_weather": "天气 气温 预报",
+    "find-hotels": "酒店 住宿 宾馆 民宿",
+}
+
+
+# 任务描述中常见但不能区分工具的词
+STOP_TERMS = {"查询", "询一", "一下", "信息", "相关", "情况", "需要", "获取", "提供", "根据", "使用", "进行", "以及"}
+
+
+def _tool_name(tool: Any) -> str:
+    return tool.name if hasattr(tool, "name") else str(tool)
+
+
+def _tool_terms(tool: Any) -> Counter:
+    """工具的检索词（名称 + 描述 + 关键词提示）"""
+    name = _tool_name(tool)
+    description = getattr(tool, "description", "") or ""
+    return Counter(tokenize(f"{name} {description} {TOOL_KEYWORD_HINTS.get(name, '')}"))
+
+
+def select_tools(task: str, tools: List[Any], top_k: int, extra_query: Optional[str] = None) -> List[Any]:
+    """
+    为任务选择最相关的工具
+
+    工具数不超过top_k、或任务与所有工具都没有关联时，返回全部工具
+
+    Args:
+        task: 任务描述
+        tools: 该Agent的全部工具
+        top_k: 最多选择的工具数（不含配套工具）
+        extra_query: 额外的查询文本（如任务未完成的原因）
+
+    Returns:
+        选中的工具列表（保持原工具顺序）
+    """
+    if top_k <= 0 or len(tools) <= top_k:
+        return list(tools)
+
+    tool_terms = [_tool_terms(tool) for tool in tools]
+    doc_freq: Counter = Counter()
+    for terms in tool_terms:
+        doc_freq.update(terms.keys())
+
+    query_terms = set(tokenize(f"{task} {extra_query or ''}")) - STOP_TERMS
+    total = len(tools)
+    scores = []
+    for idx, terms in enumerate(tool_terms):
+        score = sum(
+            math.log(1 + (total - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5)) * (1 + math.log(terms[term]))
+            for term in query_terms if term in terms
+        )
+        scores.append((score, idx))
+
+    ranked = [idx for score, idx in sorted(scores, key=lambda item: (-item[0], item[1])) if score > 0][:top_k]
+    if not ranked:
+        logger.debug(f"任务与工具没有关联，使用全部{len(tools)}个工具")
+        return list(tools)
+
+    # 补充选中工具的前置/配套工具
+    name_to_idx: Dict[str, int] = {_tool_name(tool): idx for idx, tool in enumerate(tools)}
+    selected = set(ranked)
+    for idx in ranked:
+        for companion in TOOL_COMPANIONS.get(_tool_name(tools[idx]), []):
+            if companion in name_to_idx:
+                selected.add(name_to_idx[companion])
+
+    return [tool for idx, tool in enumerate(tools) if idx in selected]
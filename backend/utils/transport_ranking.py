@@ -0,0 +1,400 @@
+"""
+车次 / 航班的结构化排序
+12306和航班工具一次会返回几十上百条车次/航班，原来交通助手的总结任务要让LLM逐条阅读，
+再按用户偏好（直达、时间段、席别、预算等）挑选，是token最多、耗时最长的一段输入。
+
+这里把 get-tickets 和航班工具的结果解析成列式数组（出发时间、历时、价格、换乘、余票），
+用向量化的筛选和打分在本地排好序，每个方向、每个日期只把前N条交给总结任务。
+"""
+import re
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.messages import ToolMessage
+
+from utils.completion_check import iter_structured_records, same_place
+from utils.tool_projection import render_table
+
+logger = logging.getLogger("utils.transport_ranking")
+
+# 参与排序的工具（结果由排序后的表格代替）
+RANKED_TRANSPORT_TOOLS = {"get-tickets", "searchFlightsByDepArr", "searchFlightItineraries", "getFlightTransferInfo"}
+
+# 交通费用占总预算的参考比例（往返合计），单程价格超过 预算/人数 × 比例/2 的方案降低排名
+TRANSPORT_BUDGET_SHARE = 0.4
+# 打分权重（分数越低越好）
+PRICE_WEIGHT = 0.5
+DURATION_WEIGHT = 0.5
+PREFERRED_WEIGHT = 0.8
+TRANSFER_PENALTY = 0.5
+OVER_BUDGET_PENALTY = 1.0
+TIME_WINDOW_PENALTY = 1.0
+
+_SOLD_OUT = {"无", "0", "--", "-", "*", ""}
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+# 出发时间段偏好（分钟）
+_TIME_WINDOWS = {
+    "凌晨": (0, 6 * 60),
+    "早上": (6 * 60, 10 * 60),
+    "上午": (6 * 60, 12 * 60),
+    "中午": (11 * 60, 14 * 60),
+    "下午": (12 * 60, 18 * 60),
+    "傍晚": (17 * 60, 20 * 60),
+    "晚上": (18 * 60, 24 * 60),
+}
+# 席别偏好（按出现的关键词匹配席别名称）
+_SEAT_WORDS = ("商务座", "一等座", "二等座", "软卧", "硬卧", "卧铺", "硬座", "无座")
+_DIRECT_WORDS = ("直达", "不换乘", "不中转", "不要换乘", "不要中转")
+_CHEAP_WORDS = ("便宜", "省钱", "实惠", "经济", "低价")
+_FAST_WORDS = ("快", "省时", "时间短", "节省时间")
+_HIGH_SPEED_WORDS = ("高铁", "动车")
+
+
+def duration_hours(value: Any) -> Optional[float]:
+    """历时（"05:30"、"5小时30分"）转换为小时，无法解析时返回None"""
+    text = str(value or "")
+    if ":" in text:
+        try:
+            hours, minutes = text.split(":")[:2]
+            return int(hours) + int(minutes) / 60
+        except ValueError:
+            return None
+    numbers = [int(n) for n in re.findall(r"\d+", text)]
+    if "小时" in text and numbers:
+        return numbers[0] + (numbers[1] / 60 if len(numbers) > 1 else 0)
+    if "分" in text and numbers:
+        return numbers[0] / 60
+    return None
+
+
+def flight_hours(dep_time: Any, arr_time: Any) -> Optional[float]:
+    """航班计划起降时间之差（小时），无法解析时返回None"""
+    try:
+        dep = datetime.fromisoformat(str(dep_time).strip())
+        arr = datetime.fromisoformat(str(arr_time).strip())
+    except ValueError:
+        return None
+    hours = (arr - dep).total_seconds() / 3600
+    return hours if hours > 0 else None
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value or ""))
+    return float(match.group()) if match else None
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+def _minute_of_day(value: Any) -> Optional[int]:
+    """"08:05" 或 "2026-10-20 08:05:00" → 当天的分钟数"""
+    match = re.search(r"(\d{1,2}):(\d{2})", str(value or ""))
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else None
+
+
+def _date_of(value: Any) -> str:
+    match = re.search(r"\d{4}-\d{1,2}-\d{1,2}", str(value or ""))
+    return match.group() if match else ""
+
+
+@dataclass
+class TransportPreferences:
+    """从用户偏好和任务描述中解析出的交通偏好"""
+    direct_only: bool = False
+    high_speed_only: bool = False
+    seat: Optional[str] = None
+    time_window: Optional[Tuple[int, int]] = None
+    price_weight: float = PRICE_WEIGHT
+    duration_weight: float = DURATION_WEIGHT
+    max_price: Optional[float] = None
+    notes: List[str] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, text: str, budget: Any = None, people: Any = None) -> "TransportPreferences":
+        """
+        解析偏好
+
+        Args:
+            text: 用户偏好
+            budget: 总预算（元）
+            people: 出行人数
+
+        Returns:
+            交通偏好
+        """
+        prefs = cls()
+        text = text or ""
+        prefs.direct_only = any(word in text for word in _DIRECT_WORDS)
+        prefs.high_speed_only = any(word in text for word in _HIGH_SPEED_WORDS)
+        prefs.seat = next((word for word in _SEAT_WORDS if word in text), None)
+        prefs.time_window = next((window for word, window in _TIME_WINDOWS.items() if word in text), None)
+        if any(word in text for word in _CHEAP_WORDS):
+            prefs.price_weight, prefs.duration_weight = PREFERRED_WEIGHT, 1 - PREFERRED_WEIGHT
+        elif any(word in text for word in _FAST_WORDS):
+            prefs.price_weight, prefs.duration_weight = 1 - PREFERRED_WEIGHT, PREFERRED_WEIGHT
+        if "靠窗" in text or "过道" in text:
+            prefs.notes.append("座位位置（靠窗/过道）需要购票时选座，无法从余票信息中筛选")
+        try:
+            budget, people = float(budget), max(int(people or 1), 1)
+            if budget > 0:
+                prefs.max_price = budget / people * TRANSPORT_BUDGET_SHARE / 2
+        except (TypeError, ValueError):
+            pass
+        return prefs
+
+
+class TransportTable:
+    """车次/航班的列式表：每个车次（取最符合偏好的有票席别）或航班一行"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+        self.price = np.array([row["price"] if row["price"] is not None else np.nan for row in rows], dtype=float)
+        self.hours = np.array([row["hours"] if row["hours"] is not None else np.nan for row in rows], dtype=float)
+        self.departure = np.array([row["departure"] if row["departure"] is not None else -1 for row in rows], dtype=int)
+        self.transfers = np.array([row["transfers"] for row in rows], dtype=int)
+        self.available = np.array([row["available"] for row in rows], dtype=bool)
+        self.high_speed = np.array([row["high_speed"] for row in rows], dtype=bool)
+        self.seat_match = np.array([row["seat_match"] for row in rows], dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def from_tool_messages(
+        cls,
+        tool_messages: List[ToolMessage],
+        prefs: TransportPreferences,
+        origin: str = "",
+        destination: str = ""
+    ) -> "TransportTable":
+        """
+        从 get-tickets 和航班工具的结果建表
+
+        Args:
+            tool_messages: 工具调用结果
+            prefs: 交通偏好（决定每个车次取哪个席别）
+            origin: 出发地
+            destination: 目的地（用于区分去程和返程）
+        """
+        rows, seen = [], set()
+        for entity, record, args in iter_structured_records(tool_messages):
+            if entity == "train":
+                key = ("train", record["train_code"], args.get("date") or record.get("start_date"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                seats = [
+                    {**seat, "price": _number(seat.get("price"))}
+                    for seat in record.get("seats") or []
+                    if _number(seat.get("price")) is not None
+                ]
+                available = [seat for seat in seats if str(seat.get("num") or "").strip() not in _SOLD_OUT]
+                matching = [seat for seat in available if prefs.seat and prefs.seat.replace("卧铺", "卧") in str(seat.get("name"))]
+                candidates = matching or available or seats
+                seat = min(candidates, key=lambda s: s["price"]) if candidates else {}
+                departure_station = record.get("from_station")
+                rows.append({
+                    "kind": "火车",
+                    "code": record["train_code"],
+                    "date": _date_of(args.get("date") or record.get("start_date")),
+                    "from": departure_station,
+                    "to": record.get("to_station"),
+                    "start": record.get("start_time"),
+                    "arrive": record.get("arrive_time"),
+                    "departure": _minute_of_day(record.get("start_time")),
+                    "hours": _round(duration_hours(record.get("duration"))),
+                    "price": seat.get("price"),
+                    "seat": f"{seat.get('name')}({seat.get('num') or '-'})" if seat else "",
+                    "seat_match": bool(matching) or not prefs.seat,
+                    "transfers": 0,
+                    "available": bool(available),
+                    "high_speed": str(record["train_code"])[:1] in ("G", "D", "C"),
+                    "direction": cls._direction(departure_station, origin, destination),
+                })
+            elif entity == "flight":
+                key = ("flight", record.get("flight_no"), record.get("dep_time"))
+                if not record.get("flight_no") or key in seen:
+                    continue
+                seen.add(key)
+                rows.append({
+                    "kind": "航班",
+                    "code": record.get("flight_no"),
+                    "date": _date_of(args.get("date") or record.get("dep_time")),
+                    "from": record.get("dep_airport"),
+                    "to": record.get("arr_airport"),
+                    "start": record.get("dep_time"),
+                    "arrive": record.get("arr_time"),
+                    "departure": _minute_of_day(record.get("dep_time")),
+                    "hours": _round(flight_hours(record.get("dep_time"), record.get("arr_time"))),
+                    "price": _number(record.get("price")),
+                    "seat": "",
+                    "seat_match": True,
+                    "transfers": 1 if record.get("transfer") else 0,
+                    "available": str(record.get("state") or "") not in ("取消", "已取消"),
+                    "high_speed": True,
+                    "direction": cls._direction(record.get("dep_city") or record.get("dep_airport"), origin, destination),
+                })
+        return cls(rows)
+
+    @staticmethod
+    def _direction(departure: Any, origin: str, destination: str) -> str:
+        return "返程" if same_place(departure, destination) and not same_place(departure, origin) else "去程"
+
+    def filter_mask(self, prefs: TransportPreferences) -> np.ndarray:
+        """硬性筛选：有票，且满足直达/高铁动车偏好"""
+        mask = self.available.copy()
+        if prefs.direct_only:
+            mask &= self.transfers == 0
+        if prefs.high_speed_only:
+            mask &= self.high_speed
+        return mask
+
+    def scores(self, prefs: TransportPreferences) -> np.ndarray:
+        """
+        向量化打分（越低越好）：价格和历时按全表归一化后加权，换乘、超出交通预算、
+        不在偏好时间段、没有偏好席别的方案加罚分；价格/历时未知的按最差计
+        """
+        def normalized(values: np.ndarray) -> np.ndarray:
+            if np.all(np.isnan(values)):
+                return np.zeros(len(values))
+            low, high = np.nanmin(values), np.nanmax(values)
+            result = (values - low) / (high - low) if high > low else np.zeros(len(values))
+            return np.nan_to_num(result, nan=1.0)
+
+        score = prefs.price_weight * normalized(self.price) + prefs.duration_weight * normalized(self.hours)
+        score += TRANSFER_PENALTY * self.transfers
+        score += PRICE_WEIGHT * (~self.seat_match)
+        if prefs.max_price is not None:
+            score += OVER_BUDGET_PENALTY * (self.price > prefs.max_price)
+        if prefs.time_window is not None:
+            start, end = prefs.time_window
+            outside = (self.departure < start) | (self.departure >= end)
+            score += TIME_WINDOW_PENALTY * (outside & (self.departure >= 0))
+        return score
+
+    def top(self, prefs: TransportPreferences, top_n: int) -> List[Tuple[Tuple[str, str], List[Dict[str, Any]], int]]:
+        """
+        按 (方向, 日期) 分组，每组返回排名前N的方案
+
+        Returns:
+            [((方向, 日期), 前N行, 该组筛选后的条数)]，按方向、日期排序
+        """
+        if not self.rows:
+            return []
+        mask = self.filter_mask(prefs)
+        if not mask.any():
+            # 没有满足硬性偏好的方案时放宽筛选，只排序
+            logger.info("【交通排序】没有满足筛选条件的车次/航班，已放宽筛选")
+            mask = np.ones(len(self.rows), dtype=bool)
+        score = self.scores(prefs)
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        for index in np.flatnonzero(mask):
+            row = self.rows[index]
+            groups.setdefault((row["direction"], row["date"]), []).append(int(index))
+
+        result = []
+        for key in sorted(groups, key=lambda k: (k[0] != "去程", k[1])):
+            indices = np.array(groups[key])
+            ranked = indices[np.argsort(score[indices], kind="stable")][:top_n]
+            result.append((key, [self.rows[i] for i in ranked], len(indices)))
+        return result
+
+
+    def calendar(self, prefs: TransportPreferences, direction: str = "去程") -> List[Dict[str, Any]]:
+        """
+        按日期汇总某个方向的方案（价格/历时日历），分数在全表范围内归一化，不同日期之间可以直接比较
+
+        Returns:
+            [{date, options, cheapest_price, cheapest, fastest_hours, fastest, best, best_score}]，按日期排序
+        """
+        if not self.rows:
+            return []
+        mask = self.filter_mask(prefs)
+        if not mask.any():
+            mask = np.ones(len(self.rows), dtype=bool)
+        mask &= np.array([row["direction"] == direction and bool(row["date"]) for row in self.rows], dtype=bool)
+        score = self.scores(prefs)
+        dates = np.array([row["date"] for row in self.rows])
+
+        days = []
+        for date in sorted(set(dates[mask].tolist())):
+            indices = np.flatnonzero(mask & (dates == date))
+            prices, hours = self.price[indices], self.hours[indices]
+            cheapest = indices[np.nanargmin(prices)] if not np.all(np.isnan(prices)) else None
+            fastest = indices[np.nanargmin(hours)] if not np.all(np.isnan(hours)) else None
+            best = indices[np.argmin(score[indices])]
+            days.append({
+                "date": date,
+                "options": len(indices),
+                "cheapest_price": float(self.price[cheapest]) if cheapest is not None else None,
+                "cheapest": self.rows[cheapest]["code"] if cheapest is not None else None,
+                "fastest_hours": float(self.hours[fastest]) if fastest is not None else None,
+                "fastest": self.rows[fastest]["code"] if fastest is not None else None,
+                "best": self.rows[best]["code"],
+                "best_score": round(float(score[best]), 3),
+            })
+        return days
+
+
+def rank_transport_options(
+    tool_messages: List[ToolMessage],
+    context: Dict[str, Any],
+    top_n: int = 10
+) -> Optional[str]:
+    """
+    把车次/航班结果按偏好筛选排序，渲染成每个方向、每个日期前N条的表格
+
+    Args:
+        tool_messages: 工具调用结果
+        context: 任务上下文（origin、destination、preferences、budget、people）
+        top_n: 每组保留的条数
+
+    Returns:
+        排序后的表格文本；没有车次/航班结果时返回None
+    """
+    # 只从用户偏好中解析筛选条件：规划器生成的任务描述里会列出要查询的字段（如"是否直达、二等座票价区间"），
+    # 不代表用户的要求
+    prefs = TransportPreferences.parse(
+        context.get("preferences") or "",
+        budget=context.get("budget"),
+        people=context.get("people")
+    )
+    table = TransportTable.from_tool_messages(tool_messages, prefs, context.get("origin", ""), context.get("destination", ""))
+    if not len(table):
+        return None
+
+    conditions = [
+        label for label, on in (
+            ("直达", prefs.direct_only),
+            ("高铁/动车", prefs.high_speed_only),
+            (f"席别{prefs.seat}", bool(prefs.seat)),
+            ("出发时间段", prefs.time_window is not None),
+            (f"单程不超过{prefs.max_price:.0f}元/人", prefs.max_price is not None),
+        ) if on
+    ]
+    sections = [f"已按偏好（{'、'.join(conditions) or '无特殊偏好'}）筛选并按价格、历时排序，每组只列出前{top_n}条："]
+    shown = 0
+    for (direction, date), rows, total in table.top(prefs, top_n):
+        shown += len(rows)
+        sections.append(render_table(rows, [
+            ("kind", "类型"),
+            ("code", "车次/航班"),
+            ("from", "出发"),
+            ("to", "到达"),
+            ("start", "出发时间"),
+            ("arrive", "到达时间"),
+            ("hours", "历时(小时)"),
+            ("price", "价格(元)"),
+            ("seat", "席别(余票)"),
+            ("transfers", "换乘"),
+        ], title=f"{direction} {date or '日期未知'}，筛选后{total}条，列出", max_cell_chars=40))
+    sections.extend(f"注意：{note}" for note in prefs.notes)
+    logger.info(f"✅ 【交通排序】{len(table)}条车次/航班 → 交给总结任务{shown}条")
+    return "\n\n".join(sections)
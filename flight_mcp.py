@@ -11,11 +11,21 @@
 
 import requests
 import json
+import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 MCP_URL = "http://127.0.0.1:8080/mcp"
 SESSION_ID = None
 
+# 多中转城市并发查询的并发上限
+TRANSFER_MAX_WORKERS = 4
+
+# 默认候选中转城市：后端机场代码索引的种子文件中的城市（见 backend/config/code_index_seed.json）
+CODE_INDEX_SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "config", "code_index_seed.json")
+DEFAULT_TRANSFER_HUBS = ["北京", "上海", "广州", "深圳", "成都", "重庆", "西安", "昆明", "武汉", "杭州"]
+
 
 # ============================================================
 #  解析流式 JSON（SSE）
@@ -239,6 +249,164 @@ def getFlightInfo(flight_number):
         "flight_number": flight_number
     })
 
+# ============================================================
+#  多中转城市并发查询
+# ============================================================
+
+def load_transfer_hubs():
+    """
+    候选中转城市：优先使用机场代码索引种子文件中的城市，读取失败时使用默认列表
+    """
+    try:
+        with open(CODE_INDEX_SEED_FILE, encoding="utf-8") as f:
+            hubs = list(json.load(f).get("airports", {}).keys())
+        return hubs or DEFAULT_TRANSFER_HUBS
+    except Exception:
+        return DEFAULT_TRANSFER_HUBS
+
+
+def _extract_itineraries(result):
+    """
+    从工具返回中取出中转方案列表（structuredContent 或 content 中的 JSON 里第一个由字典组成的列表）
+    """
+    if not result:
+        return []
+    candidates = [result.get("structuredContent")]
+    for item in result.get("content") or []:
+        if isinstance(item, dict) and item.get("type") == "text":
+            try:
+                candidates.append(json.loads(item.get("text", "")))
+            except (TypeError, json.JSONDecodeError):
+                continue
+
+    def find_list(node):
+        if isinstance(node, list) and node and all(isinstance(x, dict) for x in node):
+            return node
+        if isinstance(node, dict):
+            for value in node.values():
+                found = find_list(value)
+                if found:
+                    return found
+        return None
+
+    for candidate in candidates:
+        found = find_list(candidate)
+        if found:
+            return found
+    return []
+
+
+def _first_number(item, *keys):
+    """按顺序取第一个能解析出数字的字段（兼容 "5h30m"、"¥1200" 等格式）"""
+    for key in keys:
+        value = item.get(key)
+        if isinstance(value, (int, float)):
+            return float(value)
+        match = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+        if match:
+            return float(match.group())
+    return None
+
+
+def _total_hours(item):
+    value = item.get("total_duration") or item.get("totalDuration") or item.get("duration")
+    text = str(value or "")
+    hours = re.search(r"(\d+(?:\.\d+)?)\s*(?:h|小时)", text)
+    minutes = re.search(r"(\d+)\s*(?:m|分)", text)
+    if hours or minutes:
+        return (float(hours.group(1)) if hours else 0) + (int(minutes.group(1)) / 60 if minutes else 0)
+    total = _first_number(item, "total_duration", "totalDuration", "duration")
+    # 以分钟为单位的数值
+    return total / 60 if total is not None and total > 48 else total
+
+
+FLIGHT_NUMBER_FIELDS = {"flight_number", "flightnumber", "flight_no", "flightno", "flight", "fnum", "航班号"}
+FLIGHT_NUMBER_RE = re.compile(r"^[A-Z0-9]{2}\d{1,4}[A-Z]?$")
+
+
+def _flight_numbers(node):
+    """按顺序取出方案中各航段的航班号字段（只看航班号字段，价格、日期等数字不会混入）"""
+    numbers = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if isinstance(value, (dict, list)):
+                numbers += _flight_numbers(value)
+            elif str(key).lower() in FLIGHT_NUMBER_FIELDS and FLIGHT_NUMBER_RE.match(str(value).strip().upper()):
+                numbers.append(str(value).strip().upper())
+    elif isinstance(node, list):
+        for value in node:
+            numbers += _flight_numbers(value)
+    return numbers
+
+
+def _itinerary_key(item):
+    """去重键：方案中各航段的航班号；没有航班号字段时使用整个方案"""
+    numbers = tuple(dict.fromkeys(_flight_numbers(item)))
+    return numbers or json.dumps(item, ensure_ascii=False, sort_keys=True)
+
+
+def search_transfer_flights(from_place, to_place, hubs=None, min_transfer_time=2.0, max_transfer_time=5.0,
+                            max_workers=TRANSFER_MAX_WORKERS, top_n=10):
+    """
+    同时查询多个中转城市的中转航班，去重后按总耗时和价格排序
+
+    getTransferFlightsByThreePlace 每次只能查一个中转城市，这里用线程池并发查询全部候选中转城市
+    （并发数不超过 max_workers），避免逐个串行查询
+
+    Args:
+        from_place: 出发城市
+        to_place: 到达城市
+        hubs: 候选中转城市列表，默认使用 load_transfer_hubs()
+        min_transfer_time: 最短中转时间（小时）
+        max_transfer_time: 最长中转时间（小时）
+        max_workers: 并发上限
+        top_n: 返回的方案数
+
+    Returns:
+        排序后的中转方案列表，每项附带 transfer_place（中转城市）
+    """
+    global SESSION_ID
+
+    hubs = [hub for hub in (hubs or load_transfer_hubs()) if hub not in (from_place, to_place)]
+    if not hubs:
+        return []
+
+    # 先在主线程中初始化会话，避免多个线程同时初始化
+    if not SESSION_ID and not initialize_session():
+        return []
+
+    def rank(item):
+        hours = _total_hours(item)
+        price = _first_number(item, "total_price", "totalPrice", "price", "lowest_price")
+        return (hours if hours is not None else float("inf"), price if price is not None else float("inf"))
+
+    itineraries = {}
+    started_at = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(getTransferFlightsByThreePlace, from_place, hub, to_place, min_transfer_time, max_transfer_time): hub
+            for hub in hubs
+        }
+        for future in as_completed(futures):
+            hub = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"中转城市 {hub} 查询失败：", e)
+                continue
+            for item in _extract_itineraries(result):
+                key = _itinerary_key(item)
+                item = {**item, "transfer_place": hub}
+                # 同一方案经多个中转城市返回时，保留更短/更便宜的一条（相同时按中转城市名，与完成顺序无关）
+                current = itineraries.get(key)
+                if current is None or (rank(item), hub) < (rank(current), current["transfer_place"]):
+                    itineraries[key] = item
+
+    ranked = sorted(itineraries.values(), key=rank)[:top_n]
+    print(f"\n✅ 并发查询 {len(hubs)} 个中转城市，耗时 {time.time() - started_at:.1f}s，去重后 {len(itineraries)} 个方案")
+    return ranked
+
+
 # ============================================================
 #  显示结果
 # ============================================================
@@ -285,6 +453,10 @@ if __name__ == "__main__":
     # date_result = getTransferFlightsByThreePlace("北京", "香港", "纽约", 2.0, 5.0)
     # display_flight_result(date_result)
 
+    # print("\n=== 测试 search_transfer_flights（多中转城市并发查询）===")
+    # transfers = search_transfer_flights("沈阳", "三亚", hubs=["北京", "上海", "广州", "长沙"])
+    # print(json.dumps(transfers, indent=2, ensure_ascii=False))
+
     time.sleep(1)
 
     print("\n=== 测试 getFlightInfo ===")
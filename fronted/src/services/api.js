@@ -1,8 +1,10 @@
 const API_BASE = import.meta.env?.VITE_API_BASE || 'http://localhost:8000';
 
-export async function generateTravelPlan(payload) {
+// signal: AbortController.signal，中止请求后后端会检测到连接断开并取消执行
+export async function generateTravelPlan(payload, { signal } = {}) {
 	const response = await fetch(`${API_BASE}/travel`, {
 		method: 'POST',
+		signal,
 		headers: {
 			'Content-Type': 'application/json'
 		},
@@ -17,9 +19,10 @@ export async function generateTravelPlan(payload) {
 	return await response.json();
 }
 
-export async function resumeTravelPlan(sessionId, interventionResponse) {
+export async function resumeTravelPlan(sessionId, interventionResponse, { signal } = {}) {
 	const response = await fetch(`${API_BASE}/resume`, {
 		method: 'POST',
+		signal,
 		headers: {
 			'Content-Type': 'application/json'
 		},
@@ -38,9 +41,10 @@ export async function resumeTravelPlan(sessionId, interventionResponse) {
 	return await response.json();
 }
 
-export async function submitFeedback(sessionId, feedback) {
+export async function submitFeedback(sessionId, feedback, { signal } = {}) {
 	const response = await fetch(`${API_BASE}/feedback`, {
 		method: 'POST',
+		signal,
 		headers: {
 			'Content-Type': 'application/json'
 		},